@@ -214,6 +214,7 @@ setup(
         'bayeslite.backends.cgpm_alter',
         'bayeslite.backends.cgpm_analyze',
         'bayeslite.backends.cgpm_schema',
+        'bayeslite.bench',
         'bayeslite.plex',
         'bayeslite.shell',
         'bayeslite.tests',
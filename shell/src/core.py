@@ -17,6 +17,7 @@
 import StringIO
 import apsw
 import cmd
+import timeit
 import traceback
 import sys
 
@@ -56,6 +57,9 @@ class Shell(cmd.Cmd):
         self._traced = False
         self._sql_traced = False
         self._hooked_filenames = set([])
+        self._mode = 'table'
+        self._page_size = None
+        self._timer = False
 
         self._python_globals = {'bayeslite': bayeslite}
 
@@ -68,11 +72,15 @@ class Shell(cmd.Cmd):
         self._installcmd('guess', self.dot_guess)
         self._installcmd('help', self.dot_help)
         self._installcmd('hook', self.dot_hook)
+        self._installcmd('mode', self.dot_mode)
         self._installcmd('open', self.dot_open)
+        self._installcmd('pagesize', self.dot_pagesize)
+        self._installcmd('profile', self.dot_profile)
         self._installcmd('pythexec', self.dot_pythexec)
         self._installcmd('python', self.dot_python)
         self._installcmd('read', self.dot_read)
         self._installcmd('sql', self.dot_sql)
+        self._installcmd('timer', self.dot_timer)
         self._installcmd('trace', self.dot_trace)
         self._installcmd('untrace', self.dot_untrace)
 
@@ -130,16 +138,34 @@ class Shell(cmd.Cmd):
             self.prompt = self.def_prompt
             try:
                 first = True
-                for phrase in parse.parse_bql_string(string):
-                    cursor = bql.execute_phrase(self._bdb, phrase)
+                phrases = parse.parse_bql_string(string)
+                while True:
+                    start = timeit.default_timer()
+                    try:
+                        phrase = phrases.next()
+                    except StopIteration:
+                        break
+                    parse_seconds = timeit.default_timer() - start
+                    cursor, compile_seconds, execute_seconds = \
+                        self._execute_phrase(phrase)
+                    start = timeit.default_timer()
                     with txn.bayesdb_caching(self._bdb):
                         # Separate the output tables by a blank line.
                         if first:
                             first = False
                         else:
                             self.stdout.write('\n')
+                        nrows = 0
                         if cursor is not None:
-                            pretty.pp_cursor(self.stdout, cursor)
+                            nrows = self._pp_cursor(cursor)
+                    fetch_seconds = timeit.default_timer() - start
+                    if self._timer:
+                        self.stdout.write('Run time: parse %.6f,'
+                            ' compile %.6f, execute %.6f, fetch %.6f;'
+                            ' %d row%s\n'
+                            % (parse_seconds, compile_seconds,
+                                execute_seconds, fetch_seconds,
+                                nrows, '' if nrows == 1 else 's'))
             except (bayeslite.BayesDBException, bayeslite.BQLParseError) as e:
                 self.stdout.write('%s\n' % (e,))
             except Exception:
@@ -323,6 +349,80 @@ class Shell(cmd.Cmd):
         else:
             self._hooked_filenames.add(path)
 
+    def _execute_phrase(self, phrase):
+        # Execute phrase and return its cursor, with the seconds spent
+        # compiling it and executing it if the timer is on.
+        if not self._timer:
+            return bql.execute_phrase(self._bdb, phrase), 0., 0.
+        # Read the compile time off the profiler, borrowing one if
+        # none is established.
+        profiler = self._bdb.profiler
+        borrowed = profiler is None
+        if borrowed:
+            profiler = self._bdb.profile()
+        def compile_seconds():
+            return sum(seconds
+                for category, _name, _generator_id, _calls, seconds
+                in profiler.stats()
+                if category == 'compile')
+        compile_start = compile_seconds()
+        start = timeit.default_timer()
+        try:
+            cursor = bql.execute_phrase(self._bdb, phrase)
+        finally:
+            seconds = timeit.default_timer() - start
+            if borrowed:
+                self._bdb.unprofile(profiler)
+        compile_time = compile_seconds() - compile_start
+        return cursor, compile_time, seconds - compile_time
+
+    def _pp_cursor(self, cursor):
+        return pretty.pp_cursor(self.stdout, cursor, mode=self._mode,
+            page_size=self._page_size)
+
+    def dot_mode(self, line):
+        '''set output mode
+        table|csv|json
+
+        Print the results of queries as tables, as CSV with a header
+        row, or as a JSON array of objects.  CSV and JSON are printed
+        as the rows are fetched, for piping large results to files.
+        '''
+        if line in pretty.MODES:
+            self._mode = line
+        else:
+            self.stdout.write('Usage: .mode table|csv|json\n')
+
+    def dot_pagesize(self, line):
+        '''print tables in pages
+        <n>|off
+
+        Print the results of queries in table mode as a table for
+        each page of <n> rows, as soon as the rows are fetched, rather
+        than as one table sized to fit the whole result.
+        '''
+        if line == 'off':
+            self._page_size = None
+        elif line.isdigit() and 0 < int(line):
+            self._page_size = int(line)
+        else:
+            self.stdout.write('Usage: .pagesize <n>|off\n')
+
+    def dot_timer(self, line):
+        '''time queries
+        on|off
+
+        After each BQL phrase, report the seconds spent parsing,
+        compiling, executing, and fetching and printing it, and the
+        number of rows printed.
+        '''
+        if line == 'on':
+            self._timer = True
+        elif line == 'off':
+            self._timer = False
+        else:
+            self.stdout.write('Usage: .timer on|off\n')
+
     def dot_sql(self, line):
         '''execute a SQL query
         <query>
@@ -330,7 +430,7 @@ class Shell(cmd.Cmd):
         Execute a SQL query on the underlying SQLite database.
         '''
         try:
-            pretty.pp_cursor(self.stdout, self._bdb.sql_execute(line))
+            self._pp_cursor(self._bdb.sql_execute(line))
         except apsw.Error as e:
             self.stdout.write('%s\n' % (e,))
         except Exception as e:
@@ -431,46 +531,102 @@ class Shell(cmd.Cmd):
             self.stdout.write('Usage: .untrace bql\n')
             self.stdout.write('       .untrace sql\n')
 
+    def dot_profile(self, line):
+        '''profile queries
+        [on|off|show [table|json]|reset]
+
+        Record the time spent parsing and compiling BQL, executing SQL
+        statements, and calling BQL functions and backend methods, per
+        generator.  `.profile show' prints what has been recorded since
+        `.profile on' or `.profile reset', as a table or as JSON.
+        '''
+        tokens = line.split()
+        profiler = self._bdb.profiler
+        if tokens == ['on']:
+            if profiler is None:
+                self._bdb.profile()
+        elif tokens == ['off']:
+            if profiler is not None:
+                self._bdb.unprofile(profiler)
+        elif tokens == ['reset']:
+            if profiler is not None:
+                profiler.reset()
+        elif 1 <= len(tokens) <= 2 and tokens[0] == 'show' and \
+                tokens[1:] in ([], ['table'], ['json']):
+            if profiler is None:
+                self.stdout.write('Not profiling; use `.profile on\'.\n')
+            else:
+                profiler.dump(self.stdout,
+                    format=tokens[1] if len(tokens) == 2 else 'table')
+        else:
+            self.stdout.write('Usage: .profile on\n')
+            self.stdout.write('       .profile off\n')
+            self.stdout.write('       .profile show [table|json]\n')
+            self.stdout.write('       .profile reset\n')
+
     def dot_csv(self, line):
         '''create table from CSV file
-        <table> </path/to/data.csv>
+        <table> </path/to/data.csv> [-v] [-b]
 
         Create a SQL table named <table> from the data in
-        </path/to/data.csv>.
+        </path/to/data.csv>.  With -v, report the number of rows read
+        and the rate of reading them as it goes.  With -b, set the
+        SQLite PRAGMAs for bulk loading while reading, which is faster
+        but may corrupt the database if the process crashes.
         '''
         # XXX Lousy, lousy tokenizer.
         tokens = line.split()
-        if len(tokens) != 2:
-            self.stdout.write('Usage: .csv <table> </path/to/data.csv>\n')
+        flags = set(tokens[2:])
+        tokens = tokens[:2]
+        if len(tokens) != 2 or not flags <= set(['-v', '-b']):
+            self.stdout.write(
+                'Usage: .csv <table> </path/to/data.csv> [-v] [-b]\n')
             return
+        verbose = '-v' in flags
+        bulk = '-b' in flags
         table = tokens[0]
         pathname = tokens[1]
+        def progress(nrows, elapsed):
+            rate = nrows/elapsed if elapsed > 0 else float('inf')
+            self.stdout.write('\r%d rows read, %.0f rows/s' % (nrows, rate))
+            self.stdout.flush()
         try:
             with open(pathname, 'rU') as f:
                 bayeslite.bayesdb_read_csv(self._bdb, table, f, header=True,
-                                           create=True, ifnotexists=False)
+                    create=True, ifnotexists=False,
+                    progress=progress if verbose else None,
+                    bulk_pragmas=bulk)
         except IOError as e:
             self.stdout.write('%s\n' % (e,))
         except Exception:
             self.stdout.write(traceback.format_exc())
+        finally:
+            if verbose:
+                self.stdout.write('\n')
 
     def dot_guess(self, line):
         '''guess population schema
-        <population> <table>
+        <population> <table> [<sample size>]
 
         Create a population named <population> with variables
         corresponding to columns in table <table>, heuristically
-        guessing their statistical types.
+        guessing their statistical types, from a random sample of
+        <sample size> rows if specified.
         '''
         # XXX Lousy, lousy tokenizer.
         tokens = line.split()
+        sample_size = None
+        if len(tokens) == 3 and tokens[2].isdigit() and 0 < int(tokens[2]):
+            sample_size = int(tokens.pop())
         if len(tokens) != 2:
-            self.stdout.write('Usage: .guess <population> <table>\n')
+            self.stdout.write(
+                'Usage: .guess <population> <table> [<sample size>]\n')
             return
         population = tokens[0]
         table = tokens[1]
         try:
-            guess.bayesdb_guess_population(self._bdb, population, table)
+            guess.bayesdb_guess_population(self._bdb, population, table,
+                sample_size=sample_size)
         except Exception:
             self.stdout.write(traceback.format_exc())
 
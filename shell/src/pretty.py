@@ -14,12 +14,93 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-def pp_cursor(out, cursor):
+import collections
+import csv
+import itertools
+import json
+
+from cStringIO import StringIO
+
+MODES = ('table', 'csv', 'json')
+
+def pp_cursor(out, cursor, mode='table', page_size=None):
+    """Print the results of `cursor` to `out` and return the row count.
+
+    In ``'table'`` mode with `page_size` None, the whole result is
+    fetched first so the columns can be sized to fit it.  With a
+    `page_size`, each page of up to that many rows is printed as a
+    table of its own as soon as it is fetched.  The ``'csv'`` and
+    ``'json'`` modes print rows as they are fetched.
+
+    Rows are read by iterating over `cursor`, as for the cursors of
+    :meth:`~bayeslite.BayesDB.execute`.
+    """
     if not cursor.description:
-        return
+        return 0
     labels = [d[0] for d in cursor.description]
-    table = cursor.fetchall()
-    pp_list(out, table, labels)
+    if mode == 'table':
+        if page_size is None:
+            table = cursor.fetchall()
+            pp_list(out, table, labels)
+            return len(table)
+        nrows = 0
+        while True:
+            table = list(itertools.islice(cursor, page_size))
+            if len(table) == 0:
+                break
+            if 0 < nrows:
+                out.write('\n')
+            pp_list(out, table, labels)
+            nrows += len(table)
+        if nrows == 0:
+            pp_list(out, [], labels)
+        return nrows
+    elif mode == 'csv':
+        return pp_csv(out, cursor, labels)
+    elif mode == 'json':
+        return pp_json(out, cursor, labels)
+    else:
+        raise ValueError('Unknown output mode: %r' % (mode,))
+
+def pp_csv(out, rows, labels):
+    """Print `rows` to `out` as CSV with header `labels`.
+
+    Return the number of rows.  Null values are printed as empty
+    fields, and floating-point values in full precision.
+    """
+    def csv_value(v):
+        if v is None:
+            return ''
+        if isinstance(v, float):
+            return repr(v)
+        return unicode(v).encode('utf-8')
+    def write_row(row):
+        buf = StringIO()
+        csv.writer(buf, lineterminator='\n').writerow(
+            [csv_value(v) for v in row])
+        out.write(buf.getvalue().decode('utf-8'))
+    write_row(labels)
+    nrows = 0
+    for row in rows:
+        write_row(row)
+        nrows += 1
+    return nrows
+
+def pp_json(out, rows, labels):
+    """Print `rows` to `out` as a JSON array of objects keyed by `labels`.
+
+    Return the number of rows.
+    """
+    out.write('[')
+    nrows = 0
+    for row in rows:
+        if 0 < nrows:
+            out.write(',')
+        out.write('\n')
+        out.write(json.dumps(collections.OrderedDict(zip(labels, row))))
+        nrows += 1
+    out.write('\n]\n' if 0 < nrows else ']\n')
+    return nrows
 
 def pp_list(out, table, labels):
     assert 0 < len(labels)
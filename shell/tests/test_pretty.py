@@ -17,6 +17,7 @@
 import StringIO
 import pytest
 
+import bayeslite
 import bayeslite.shell.pretty as pretty
 
 def test_pretty():
@@ -58,3 +59,57 @@ def test_pretty_unicomb():
         u'     Zorb |   2 | zorblaxian kibble\n' \
         u'     Zörb |  42 | zörblǎxïǎn kïbble\n' \
         u'     Zörb |  87 |    zørblaxian ﻛِبّﻞ\n'
+
+def bdb_with_table(labels, table):
+    bdb = bayeslite.bayesdb_open(':memory:')
+    bdb.sql_execute('create table t(%s)' % (', '.join(labels),))
+    for row in table:
+        bdb.sql_execute('insert into t values(%s)'
+            % (', '.join('?' for _ in row),), row)
+    return bdb
+
+def test_pretty_pages():
+    labels = ['name', 'age']
+    table = [['Spot', 3], ['Skruffles', 2], ['Zorb', 2]]
+    with bdb_with_table(labels, table) as bdb:
+        out = StringIO.StringIO()
+        cursor = bdb.execute('select * from t')
+        assert pretty.pp_cursor(out, cursor, page_size=2) == 3
+        assert out.getvalue() == \
+            u'     name | age\n' \
+            u'----------+----\n' \
+            u'     Spot |   3\n' \
+            u'Skruffles |   2\n' \
+            u'\n' \
+            u'name | age\n' \
+            u'-----+----\n' \
+            u'Zorb |   2\n'
+        out = StringIO.StringIO()
+        cursor = bdb.execute('select * from t where age > 3')
+        assert pretty.pp_cursor(out, cursor, page_size=2) == 0
+        assert out.getvalue() == u''
+
+def test_pretty_csv_json():
+    labels = ['name', 'age', 'weight']
+    table = [['Spot', 3, 0.1], [u'Zörb, Jr.', None, 87.]]
+    with bdb_with_table(labels, table) as bdb:
+        out = StringIO.StringIO()
+        cursor = bdb.execute('select * from t')
+        assert pretty.pp_cursor(out, cursor, mode='csv') == 2
+        assert out.getvalue() == \
+            u'name,age,weight\n' \
+            u'Spot,3,0.1\n' \
+            u'"Zörb, Jr.",,87.0\n'
+        out = StringIO.StringIO()
+        cursor = bdb.execute('select * from t')
+        assert pretty.pp_cursor(out, cursor, mode='json') == 2
+        assert out.getvalue() == \
+            u'[\n' \
+            u'{"name": "Spot", "age": 3, "weight": 0.1},\n' \
+            u'{"name": "Z\\u00f6rb, Jr.", "age": null, "weight": 87.0}\n' \
+            u']\n'
+        out = StringIO.StringIO()
+        assert pretty.pp_json(out, iter([]), labels) == 0
+        assert out.getvalue() == u'[]\n'
+        with pytest.raises(ValueError):
+            pretty.pp_cursor(out, bdb.execute('select * from t'), mode='xml')
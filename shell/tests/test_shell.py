@@ -167,11 +167,15 @@ def test_help_returns_list_of_commands(spawnbdb):
         '    .guess    guess population schema',
         '     .help    show help for commands',
         '     .hook    add custom commands from a python source file',
+        '     .mode    set output mode',
         '     .open    close existing database and open new one',
+        ' .pagesize    print tables in pages',
+        '  .profile    profile queries',
         ' .pythexec    execute a Python statement',
         '   .python    evaluate a Python expression',
         '     .read    read a file of shell commands',
         '      .sql    execute a SQL query',
+        '    .timer    time queries',
         '    .trace    trace queries',
         '  .untrace    untrace queries',
         "Type `.help <cmd>' for help on the command <cmd>.",
@@ -197,10 +201,92 @@ def test_untrace_usage(spawnbdb):
     ])
 
 
+def test_output_modes(spawnbdb):
+    c = spawnbdb
+    c.sendexpectcmd('.mode xml')
+    c.expect_lines(['Usage: .mode table|csv|json'])
+    c.expect_prompt()
+    c.sendexpectcmd('.mode csv')
+    c.expect_prompt()
+    c.sendexpectcmd("select 1 as x, 'a,b' as y, null as z;")
+    c.expect_lines([
+        'x,y,z',
+        '1,"a,b",',
+    ])
+    c.expect_prompt()
+    c.sendexpectcmd('.mode json')
+    c.expect_prompt()
+    c.sendexpectcmd("select 1 as x, 'a' as y;")
+    c.expect_lines([
+        '[',
+        '{"x": 1, "y": "a"}',
+        ']',
+    ])
+    c.expect_prompt()
+    c.sendexpectcmd('.mode table')
+    c.expect_prompt()
+    c.sendexpectcmd('.pagesize 0')
+    c.expect_lines(['Usage: .pagesize <n>|off'])
+    c.expect_prompt()
+    c.sendexpectcmd('.pagesize 2')
+    c.expect_prompt()
+    c.sendexpectcmd(
+        '.sql select 1 as x union all select 22 union all select 333')
+    c.expect_lines([
+        ' x',
+        '--',
+        ' 1',
+        '22',
+        '',
+        '  x',
+        '---',
+        '333',
+    ])
+    c.expect_prompt()
+
+
+def test_timer_usage(spawnbdb):
+    c = spawnbdb
+    c.sendexpectcmd('.timer')
+    c.expect_lines(['Usage: .timer on|off'])
+    c.expect_prompt()
+
+
+def test_profile_usage(spawnbdb):
+    c = spawnbdb
+    c.sendexpectcmd('.profile')
+    c.expect_lines([
+        'Usage: .profile on',
+        '       .profile off',
+        '       .profile show [table|json]',
+        '       .profile reset',
+    ])
+    c.expect_prompt()
+    c.sendexpectcmd('.profile show')
+    c.expect_lines(["Not profiling; use `.profile on'."])
+    c.expect_prompt()
+
+
 def test_dot_csv(spawntable):
     _table, _c = spawntable
 
 
+def test_dot_csv_flags(spawnbdb):
+    c = spawnbdb
+    c.sendexpectcmd('.csv dha %s -b' % (DHA_CSV,))
+    c.expect_prompt()
+    c.sendexpectcmd('SELECT COUNT(*) FROM dha;')
+    c.expect_lines([
+        'COUNT(*)',
+        '--------',
+        '     306',
+    ])
+    c.expect_prompt()
+    c.sendexpectcmd('.csv dha2 %s -x' % (DHA_CSV,))
+    c.expect_lines(['Usage: .csv <table> </path/to/data.csv> [-v] [-b]'])
+    c.expect_prompt()
+
+
 def test_dot_csv_dup(spawnbdb):
     c = spawnbdb
     with tempfile.NamedTemporaryFile(prefix='bayeslite-shell') as t:
@@ -390,12 +476,16 @@ def test_hook(spawnbdb):
         '    .guess    guess population schema',
         '     .help    show help for commands',
         '     .hook    add custom commands from a python source file',
+        '     .mode    set output mode',
         '   .myhook    myhook help string',
         '     .open    close existing database and open new one',
+        ' .pagesize    print tables in pages',
+        '  .profile    profile queries',
         ' .pythexec    execute a Python statement',
         '   .python    evaluate a Python expression',
         '     .read    read a file of shell commands',
         '      .sql    execute a SQL query',
+        '    .timer    time queries',
         '    .trace    trace queries',
         '  .untrace    untrace queries',
         "Type `.help <cmd>' for help on the command <cmd>."
@@ -147,6 +147,11 @@ DropModels = namedtuple('DropModels', [
     'generator',                # XXX name
     'modelnos',                 # list of int or None
 ])
+IncorporateRows = namedtuple('IncorporateRows', [
+    'generator',                # XXX name
+    'iterations',               # int or None
+    'seconds',                  # int or None
+])
 
 Regress = namedtuple('Regress', [
     'target',                   # XXX name
@@ -201,11 +201,43 @@ class BayesDB_Backend(object):
         """
         raise NotImplementedError
 
+    def incorporate_rows(self, bdb, generator_id, iterations=None,
+            max_seconds=None):
+        """Incorporate rows added to the base table into the models.
+
+        The rows are those the generator has not yet modeled.  If
+        `iterations` or `max_seconds` is given, analyze the models for
+        that long, on the new rows only if the backend can target
+        them.  Return the list of rowids incorporated.
+
+        Used by the MML::
+
+            INCORPORATE NEW ROWS INTO <generator> [FOR <duration>]
+        """
+        raise NotImplementedError
+
     def column_dependence_probability(self, bdb, generator_id, modelnos, colno0,
             colno1):
         """Compute ``DEPENDENCE PROBABILITY OF <col0> WITH <col1>``."""
         raise NotImplementedError
 
+    def column_dependence_probability_matrix(self, bdb, generator_id,
+            modelnos, colnos):
+        """Compute ``DEPENDENCE PROBABILITY`` for every pair of `colnos`.
+
+        Returns a symmetric matrix, as a list of lists, whose entry
+        ``[i][j]`` is what :meth:`column_dependence_probability` returns
+        for ``colnos[i]`` and ``colnos[j]``.  The default calls it once
+        for each unordered pair.
+        """
+        matrix = [[None] * len(colnos) for _colno in colnos]
+        for i, colno0 in enumerate(colnos):
+            for j in xrange(i, len(colnos)):
+                matrix[i][j] = matrix[j][i] = \
+                    self.column_dependence_probability(
+                        bdb, generator_id, modelnos, colno0, colnos[j])
+        return matrix
+
     def column_mutual_information(self, bdb, generator_id, modelnos, colnos0,
             colnos1, constraints=None, numsamples=100):
         """Compute ``MUTUAL INFORMATION OF (<cols0>) WITH (<cols1>)``."""
@@ -216,6 +248,39 @@ class BayesDB_Backend(object):
         """Compute ``SIMILARITY TO <target_row>`` for given `rowid`."""
         raise NotImplementedError
 
+    def row_similarity_batch(self, bdb, generator_id, modelnos, rowids,
+            target_rowid, colnos):
+        """Compute ``SIMILARITY TO <target_row>`` for each of `rowids`.
+
+        Returns a list with one entry per rowid, each of which is what
+        :meth:`row_similarity` returns for that rowid.  The default
+        calls :meth:`row_similarity` once per rowid; backends that can
+        score a block of rows at once should override it.
+        """
+        return [
+            self.row_similarity(
+                bdb, generator_id, modelnos, rowid, target_rowid, colnos)
+            for rowid in rowids
+        ]
+
+    def row_similarity_matrix(self, bdb, generator_id, modelnos, rowids,
+            colnos):
+        """Compute ``SIMILARITY`` for every pair of `rowids`.
+
+        Returns a symmetric matrix, as a list of lists, whose entry
+        ``[i][j]`` is what :meth:`row_similarity` returns for
+        ``rowids[i]`` and ``rowids[j]``, or else as a numpy array of
+        shape ``(len(rowids), len(rowids))`` of the means over the
+        models of those entries.  The default calls
+        :meth:`row_similarity` once for each unordered pair.
+        """
+        matrix = [[None] * len(rowids) for _rowid in rowids]
+        for i, rowid in enumerate(rowids):
+            for j in xrange(i, len(rowids)):
+                matrix[i][j] = matrix[j][i] = self.row_similarity(
+                    bdb, generator_id, modelnos, rowid, rowids[j], colnos)
+        return matrix
+
     def predictive_relevance(self, bdb, generator_id, modelnos, rowid_target,
             rowid_query, hypotheticals, colno):
         """Compute predictive relevance, also known as relevance probability.
@@ -244,6 +309,28 @@ class BayesDB_Backend(object):
         """Predict a value for a column and return confidence."""
         raise NotImplementedError
 
+    def predict_confidence_batch(self, bdb, generator_id, modelnos, rowids,
+            colnos_list, numsamples=None):
+        """Predict values, with confidences, for a batch of cells.
+
+        Returns a list with, for each ``(rowid, colnos)`` drawn in
+        parallel from `rowids` and `colnos_list`, a list of the
+        ``(value, confidence)`` pairs :meth:`predict_confidence` returns
+        for each colno in ``colnos``.  When ``colnos`` has more than
+        one colno, their cells are all missing from the row, so they
+        may be simulated jointly.  The default calls
+        :meth:`predict_confidence` once per cell; backends that can
+        predict the cells of a row at once should override it.
+        """
+        return [
+            [
+                self.predict_confidence(bdb, generator_id, modelnos, rowid,
+                    colno, numsamples=numsamples)
+                for colno in colnos
+            ]
+            for rowid, colnos in zip(rowids, colnos_list)
+        ]
+
     def simulate_joint(self, bdb, generator_id, modelnos, rowid, targets,
             constraints, num_samples=1, accuracy=None):
         """Simulate `targets` from a generator, subject to `constraints`.
@@ -285,3 +372,20 @@ class BayesDB_Backend(object):
         `modelno` is a model number or `None`, meaning all models.
         """
         raise NotImplementedError
+
+    def logpdf_joint_batch(self, bdb, generator_id, modelnos, rowids,
+            targets_list, constraints_list):
+        """Evaluate :meth:`logpdf_joint` for each of a batch of queries.
+
+        Returns a list of log densities, one for each ``(rowid, targets,
+        constraints)`` drawn in parallel from `rowids`, `targets_list`,
+        and `constraints_list`.  The default calls :meth:`logpdf_joint`
+        once per query; backends that can score a block of rows at
+        once should override it.
+        """
+        return [
+            self.logpdf_joint(
+                bdb, generator_id, modelnos, rowid, targets, constraints)
+            for rowid, targets, constraints
+            in zip(rowids, targets_list, constraints_list)
+        ]
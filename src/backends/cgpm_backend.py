@@ -14,16 +14,20 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import apsw
 import itertools
 import json
 import math
+import numpy
 
 from collections import Counter
+from collections import OrderedDict
 from collections import defaultdict
 
 from cgpm.crosscat.engine import Engine
 
 import bayeslite.core as core
+import bayeslite.backends.cgpm_codec as cgpm_codec
 
 from bayeslite.exception import BQLError
 from bayeslite.backend import BayesDB_Backend
@@ -96,12 +100,55 @@ INSERT INTO bayesdb_cgpm_modelno (generator_id, modelno, cgpm_modelno)
     );
 '''
 
+CGPM_SCHEMA_4 = '''
+UPDATE bayesdb_backend SET version = 4 WHERE name = 'cgpm';
+
+CREATE TABLE bayesdb_cgpm_estimand_cache (
+    generator_id        INTEGER NOT NULL REFERENCES bayesdb_generator(id),
+    engine_stamp        INTEGER NOT NULL,
+    estimand            TEXT NOT NULL,
+    arguments_json      TEXT NOT NULL,
+    modelnos_json       TEXT NOT NULL,
+    nsamples            INTEGER NOT NULL,
+    value_json          BLOB NOT NULL,
+    last_used           INTEGER NOT NULL,
+    PRIMARY KEY(generator_id, engine_stamp, estimand, arguments_json,
+        modelnos_json, nsamples)
+);
+
+CREATE INDEX bayesdb_cgpm_estimand_cache_last_used
+    ON bayesdb_cgpm_estimand_cache(last_used);
+'''
+
+CGPM_SCHEMA_5 = '''
+UPDATE bayesdb_backend SET version = 5 WHERE name = 'cgpm';
+
+ALTER TABLE bayesdb_cgpm_generator
+    ADD COLUMN engine_blob
+    BLOB;
+
+CREATE TABLE bayesdb_cgpm_state (
+    generator_id        INTEGER NOT NULL,
+    modelno             INTEGER NOT NULL,
+    state_blob          BLOB NOT NULL,
+
+    FOREIGN KEY (generator_id, modelno)
+        REFERENCES bayesdb_generator_model(generator_id, modelno),
+    PRIMARY KEY(generator_id, modelno)
+);
+'''
+
 
 class CGPM_Backend(BayesDB_Backend):
 
-    def __init__(self, cgpm_registry, multiprocess=None):
+    def __init__(self, cgpm_registry, multiprocess=None,
+            estimand_cache_size=None):
         self._cgpm_registry = cgpm_registry
         self._multiprocess = multiprocess
+        # Maximum number of estimand results to persist in the table
+        # bayesdb_cgpm_estimand_cache, per bdb.  None or 0 disables the
+        # persistent cache of estimands.
+        self._estimand_cache_size = estimand_cache_size
         # The cache is a dictionary whose keys are bayeslite.BayesDB objects,
         # and whose values are dictionaries (one cache per bdb). We need
         # self._cache to have separate caches for each bdb because the same
@@ -111,6 +158,11 @@ class CGPM_Backend(BayesDB_Backend):
         # import, creates a single CGPM_Backend object to be used throughout
         # the python session).
         self._cache = dict()
+        # Keys of the persisted estimands used since the last one was
+        # stored, least recently used first, per bdb.  Reading the
+        # cache notes its use only here, and storing the next estimand
+        # writes the recency of these to the database.
+        self._estimand_hits = dict()
 
     def name(self):
         return 'cgpm'
@@ -133,7 +185,17 @@ class CGPM_Backend(BayesDB_Backend):
                 # Install CGPM version 3.
                 bdb.sql_execute(CGPM_SCHEMA_3)
                 version = 3
-            if version != 3:
+            if version == 3:
+                # Install CGPM version 4.
+                bdb.sql_execute(CGPM_SCHEMA_4)
+                version = 4
+            if version == 4:
+                # Install CGPM version 5, and convert the engines from
+                # JSON to the binary encoding, one state per model.
+                bdb.sql_execute(CGPM_SCHEMA_5)
+                _migrate_engine_json(bdb)
+                version = 5
+            if version != 5:
                 # Unrecognized version.
                 raise BQLError(bdb, 'CGPM already installed'
                     ' with unknown schema version: %d' % (version,))
@@ -143,6 +205,11 @@ class CGPM_Backend(BayesDB_Backend):
         self._multiprocess = switch
         return old
 
+    def set_estimand_cache_size(self, size):
+        old = self._estimand_cache_size
+        self._estimand_cache_size = size
+        return old
+
     def create_generator(self, bdb, generator_id, schema_tokens, **kwargs):
         schema_ast = cgpm_schema.parse.parse(schema_tokens)
         schema = _create_schema(bdb, generator_id, schema_ast, **kwargs)
@@ -150,7 +217,7 @@ class CGPM_Backend(BayesDB_Backend):
         # Store the schema.
         bdb.sql_execute('''
             INSERT INTO bayesdb_cgpm_generator
-                (generator_id, schema_json, engine_json) VALUES (?, ?, NULL)
+                (generator_id, schema_json, engine_blob) VALUES (?, ?, NULL)
         ''', (generator_id, json_dumps(schema)))
 
         # Get the underlying population and table.
@@ -165,6 +232,7 @@ class CGPM_Backend(BayesDB_Backend):
 
         # Assign codes to categories and consecutive column numbers to
         # the modeled variables.
+        self._del_cache_entry(bdb, generator_id, 'categories')
         vars_cursor = bdb.sql_execute('''
             SELECT colno, name, stattype FROM bayesdb_variable
                 WHERE population_id = ? AND 0 <= colno
@@ -215,6 +283,16 @@ class CGPM_Backend(BayesDB_Backend):
         # Remove the cache for this generator_id.
         self._del_cache_entry(bdb, generator_id, None)
 
+        # Delete cached estimands.
+        bdb.sql_execute('''
+            DELETE FROM bayesdb_cgpm_estimand_cache WHERE generator_id = ?
+        ''', (generator_id,))
+
+        # Delete states.
+        bdb.sql_execute('''
+            DELETE FROM bayesdb_cgpm_state WHERE generator_id = ?
+        ''', (generator_id,))
+
         # Delete categories.
         bdb.sql_execute('''
             DELETE FROM bayesdb_cgpm_category WHERE generator_id = ?
@@ -266,6 +344,7 @@ class CGPM_Backend(BayesDB_Backend):
                         (generator_id, colno, value, code)
                         VALUES (?, ?, ?, ?)
                 ''', (generator_id, colno, value, code))
+        self._del_cache_entry(bdb, generator_id, 'categories')
 
         # Retrieve the rows from the table.
         rows = list(itertools.chain.from_iterable(
@@ -318,8 +397,8 @@ class CGPM_Backend(BayesDB_Backend):
             ''', (generator_id,))
         # Appending models to an existing engine.
         else:
-            # Retrieve the engine.
-            engine = self._engine(bdb, generator_id)
+            # Retrieve the engine.  New states are modeled on state 0.
+            engine = self._engine(bdb, generator_id, [0])
 
             # Confirm requested modelnos do not include existing models.
             intersection = [m for m in existing if m[0] in modelnos]
@@ -340,6 +419,11 @@ class CGPM_Backend(BayesDB_Backend):
                         VALUES (?, ?, ?)
                 ''', (generator_id, modelno, cgpm_modelno))
 
+            # Serialize only the new states, without caching.
+            self._serialize_engine(
+                bdb, generator_id, engine, False, cgpm_modelnos)
+            return
+
         # Serialize the engine without caching.
         self._serialize_engine(bdb, generator_id, engine, False)
 
@@ -353,11 +437,14 @@ class CGPM_Backend(BayesDB_Backend):
 
         # Drop all models?
         if modelnos is None or sorted(modelnos_existing) == sorted(modelnos):
-            # Set engine JSON to null.
+            # Set engine to null and delete its states.
             bdb.sql_execute('''
-                UPDATE bayesdb_cgpm_generator SET engine_json = NULL
+                UPDATE bayesdb_cgpm_generator SET engine_blob = NULL
                 WHERE generator_id = ?
             ''', (generator_id,))
+            bdb.sql_execute('''
+                DELETE FROM bayesdb_cgpm_state WHERE generator_id = ?
+            ''', (generator_id,))
             # Clear mapping of modelnos.
             bdb.sql_execute('''
                 DELETE FROM bayesdb_cgpm_modelno
@@ -365,12 +452,23 @@ class CGPM_Backend(BayesDB_Backend):
             ''', (generator_id,))
             # Delete the engine from the cache.
             self._del_cache_entry(bdb, generator_id, 'engine')
-        # Drop some models.
+            # Delete cached estimands, since the engine stamp is not
+            # incremented when the engine is dropped.
+            bdb.sql_execute('''
+                DELETE FROM bayesdb_cgpm_estimand_cache
+                WHERE generator_id = ?
+            ''', (generator_id,))
+        # Drop some models, without loading any states.
         else:
-            engine = self._engine(bdb, generator_id)
+            engine = self._engine_latest(bdb, generator_id)
             cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+            bdb.sql_execute('''
+                DELETE FROM bayesdb_cgpm_state
+                WHERE generator_id = ? AND modelno IN (%s)
+            ''' % (','.join(map(str, modelnos)),), (generator_id,))
             for m in cgpm_modelnos:
-                del engine.states[m]
+                if engine is not None:
+                    del engine.states[m]
                 # Delete the modelno entry.
                 bdb.sql_execute('''
                     DELETE FROM bayesdb_cgpm_modelno
@@ -388,9 +486,13 @@ class CGPM_Backend(BayesDB_Backend):
                 WHERE generator_id = ? ORDER BY cgpm_modelno ASC
             ''', (generator_id,))
             modelnos_cgpm_new = [m[0] for m in cursor]
-            assert modelnos_cgpm_new == range(engine.num_states())
-            # Serialize the engine.
-            self._serialize_engine(bdb, generator_id, engine, True)
+            assert modelnos_cgpm_new == \
+                range(len(modelnos_existing) - len(cgpm_modelnos))
+            # The remaining states are unchanged, but renumbered.
+            engine_stamp = self._bump_engine_stamp(bdb, generator_id)
+            if engine is not None:
+                assert modelnos_cgpm_new == range(engine.num_states())
+                self._set_cache_entry(bdb, generator_id, 'stamp', engine_stamp)
 
     def alter(self, bdb, generator_id, modelnos, commands):
         # Get the population_id.
@@ -400,10 +502,10 @@ class CGPM_Backend(BayesDB_Backend):
         cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
 
         # Retrieve the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
         # Find baseline variable numbers for error checking.
-        vars_baseline = engine.states[0].outputs
+        vars_baseline = _baseline_state(engine, cgpm_modelnos).outputs
 
         # Retrieve the AST.
         alter_ast =  cgpm_alter.parse.parse(commands)
@@ -552,7 +654,7 @@ class CGPM_Backend(BayesDB_Backend):
             multiprocess=self._multiprocess)
 
         # Serialize the engine.
-        self._serialize_engine(bdb, generator_id, engine, True)
+        self._serialize_engine(bdb, generator_id, engine, True, cgpm_modelnos)
 
     def analyze_models(
             self, bdb, generator_id, modelnos=None, iterations=None,
@@ -573,7 +675,7 @@ class CGPM_Backend(BayesDB_Backend):
         cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
 
         # Retrieve the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
         # Retrieve user-specified target variables to transition.
         analyze_ast = cgpm_analyze.parse.parse(program)
@@ -583,9 +685,10 @@ class CGPM_Backend(BayesDB_Backend):
         # Explicitly suppress progress bar if quiet, otherwise use default.
         progress = False if quiet else None
 
-        vars_baseline = engine.states[0].outputs
+        state = _baseline_state(engine, cgpm_modelnos)
+        vars_baseline = state.outputs
         vars_foreign = list(itertools.chain.from_iterable([
-            cgpm.outputs for cgpm in engine.states[0].hooked_cgpms.itervalues()
+            cgpm.outputs for cgpm in state.hooked_cgpms.itervalues()
         ]))
 
         # By default transition all baseline variables only.
@@ -633,6 +736,9 @@ class CGPM_Backend(BayesDB_Backend):
                 raise BQLError(bdb, 'No VARIABLES or SKIP in Loom.')
             if rowids_user:
                 raise BQLError(bdb, 'No ROWS in Loom.')
+            # Loom transitions all the states.
+            cgpm_modelnos = None
+            engine = self._engine(bdb, generator_id)
 
         # Run transitions on baseline variables.
         if vars_target_baseline:
@@ -681,8 +787,121 @@ class CGPM_Backend(BayesDB_Backend):
             )
 
         # Serialize the engine.
-        self._serialize_engine(bdb, generator_id, engine, True)
+        self._serialize_engine(bdb, generator_id, engine, True, cgpm_modelnos)
+
+    def incorporate_rows(self, bdb, generator_id, iterations=None,
+            max_seconds=None):
+        schema = self._schema(bdb, generator_id)
+        generator = core.bayesdb_generator_name(bdb, generator_id)
 
+        # Rows left out of a subsample are not new, and foreign cgpms
+        # have no way to take rows after they are initialized.
+        if schema['subsample']:
+            raise BQLError(bdb, 'Cannot incorporate new rows'
+                ' into subsampled generator: %r' % (generator,))
+        if schema['cgpm_composition']:
+            raise BQLError(bdb, 'Cannot incorporate new rows'
+                ' into generator with foreign cgpms: %r' % (generator,))
+
+        # Find the rows of the table with no individual, in order.
+        population_id = core.bayesdb_generator_population(bdb, generator_id)
+        table_name = core.bayesdb_generator_table(bdb, generator_id)
+        qt = sqlite3_quote_name(table_name)
+        varnames = [var for var, _st, _cct, _da in schema['variables']]
+        colnos = [
+            core.bayesdb_variable_number(bdb, population_id, generator_id, var)
+            for var in varnames
+        ]
+        qexpressions = ''.join(
+            ', t.%s' % (sqlite3_quote_name(var),)
+            for var, colno in zip(varnames, colnos) if 0 <= colno)
+        cursor = bdb.sql_execute('''
+            SELECT t._rowid_%s FROM %s AS t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bayesdb_cgpm_individual AS ci
+                        WHERE ci.generator_id = ?
+                            AND ci.table_rowid = t._rowid_
+                )
+            ORDER BY t._rowid_ ASC
+        ''' % (qexpressions, qt), (generator_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+
+        # Map values to codes, omitting missing values.  The categorical
+        # distributions were sized for the categories seen at creation,
+        # so a new category cannot be modeled.
+        colnos = [colno for colno in colnos if 0 <= colno]
+        to_numeric = [
+            self._to_numeric_converter(bdb, generator_id, colno)
+            for colno in colnos
+        ]
+        table_rowids = []
+        observations = []
+        unknown = set()
+        nonnumeric = set()
+        for row in rows:
+            observation = {}
+            for colno, convert, value in zip(colnos, to_numeric, row[1:]):
+                if value is None:
+                    continue
+                code = convert(value)
+                # Values of numerical columns pass through unconverted,
+                # and may be text or blobs that cgpm cannot model.
+                if not isinstance(code, (int, long, float)):
+                    nonnumeric.add((colno, value))
+                    continue
+                if math.isnan(code):
+                    unknown.add((colno, value))
+                    continue
+                observation[colno] = code
+            table_rowids.append(row[0])
+            observations.append(observation)
+        def describe(cells):
+            return ', '.join(sorted(
+                '%s=%r' % (core.bayesdb_variable_name(
+                    bdb, population_id, generator_id, colno), value)
+                for colno, value in cells))
+        if unknown:
+            raise BQLError(bdb, 'Cannot incorporate new categories: %s' %
+                (describe(unknown),))
+        if nonnumeric:
+            raise BQLError(bdb, 'Cannot incorporate non-numeric values: %s' %
+                (describe(nonnumeric),))
+
+        # Assign the next contiguous cgpm rowids to the new rows.
+        cursor = bdb.sql_execute('''
+            SELECT COALESCE(MAX(cgpm_rowid) + 1, 0)
+                FROM bayesdb_cgpm_individual WHERE generator_id = ?
+        ''', (generator_id,))
+        first = cursor_value(cursor)
+        cgpm_rowids = range(first, first + len(table_rowids))
+        bdb.sql_executemany('''
+            INSERT INTO bayesdb_cgpm_individual
+                (generator_id, table_rowid, cgpm_rowid)
+                VALUES (?, ?, ?)
+        ''', [
+            (generator_id, table_rowid, cgpm_rowid)
+            for table_rowid, cgpm_rowid in zip(table_rowids, cgpm_rowids)
+        ])
+
+        # Incorporate the rows into every state, and transition just
+        # them, as ANALYZE does for ROWS, if asked.
+        engine = self._engine(bdb, generator_id)
+        engine.incorporate_bulk(
+            cgpm_rowids, observations, multiprocess=self._multiprocess)
+        if iterations or max_seconds:
+            engine.transition(
+                N=iterations,
+                S=max_seconds,
+                rowids=cgpm_rowids,
+                progress=False,
+                multiprocess=self._multiprocess,
+            )
+
+        # Serialize the engine, which also invalidates cached estimands.
+        self._serialize_engine(bdb, generator_id, engine, True)
+        return table_rowids
 
     def column_dependence_probability(
             self, bdb, generator_id, modelnos, colno0, colno1):
@@ -696,15 +915,30 @@ class CGPM_Backend(BayesDB_Backend):
         cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
 
         # Get the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
-        # Engine gives us a list of dependence probabilities which it is our
-        # responsibility to integrate over.
-        depprob_list = engine.dependence_probability(
+        # Engine gives us a list of dependence probabilities which it
+        # is our responsibility to integrate over.  This only compares
+        # view assignments, which is cheaper than looking it up in the
+        # estimand cache.
+        return engine.dependence_probability(
             colno0, colno1, statenos=cgpm_modelnos,
             multiprocess=self._multiprocess)
 
-        return depprob_list
+    def column_dependence_probability_matrix(
+            self, bdb, generator_id, modelnos, colnos):
+        cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
+        # One n x n matrix per model, read off the view partitions in a
+        # single pass over the states.
+        matrices = engine.dependence_probability_pairwise(
+            colnos=colnos, statenos=cgpm_modelnos,
+            multiprocess=self._multiprocess)
+        n = len(colnos)
+        return [
+            [[matrix[i][j] for matrix in matrices] for j in xrange(n)]
+            for i in xrange(n)
+        ]
 
     def column_mutual_information(
             self, bdb, generator_id, modelnos, colnos0, colnos1,
@@ -713,28 +947,33 @@ class CGPM_Backend(BayesDB_Backend):
         if numsamples is None:
             numsamples = 1000
 
-        # Get the modelnos.
-        cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+        def compute():
+            # Get the modelnos.
+            cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
 
-        # Get the engine.
-        engine = self._engine(bdb, generator_id)
+            # Get the engine.
+            engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
-        # Build the evidence, ignoring nan values and converting nominals.
-        evidence = constraints and {
-            colno: (self._to_numeric(bdb, generator_id, colno, value)
-                if value is not None else None)
-            for colno, value in constraints
-        }
+            # Build the evidence, ignoring nan values and converting
+            # nominals.
+            evidence = constraints and {
+                colno: (self._to_numeric(bdb, generator_id, colno, value)
+                    if value is not None else None)
+                for colno, value in constraints
+            }
 
-        # Engine gives us a list of samples which it is our
-        # responsibility to integrate over.
-        mi_list = engine.mutual_information(
-            colnos0, colnos1, constraints=evidence, N=numsamples,
-            progress=True, statenos=cgpm_modelnos,
-            multiprocess=self._multiprocess)
+            # Engine gives us a list of samples which it is our
+            # responsibility to integrate over.
+            return engine.mutual_information(
+                colnos0, colnos1, constraints=evidence, N=numsamples,
+                progress=True, statenos=cgpm_modelnos,
+                multiprocess=self._multiprocess)
 
         # Pass through the distribution of CMI to BayesDB without aggregation.
-        return mi_list
+        arguments = [colnos0, colnos1, constraints and sorted(constraints)]
+        return self._estimand_cached(
+            bdb, generator_id, 'mutual_information', arguments, modelnos,
+            numsamples, compute)
 
     def row_similarity(
             self, bdb, generator_id, modelnos, rowid, target_rowid, colnos):
@@ -750,7 +989,7 @@ class CGPM_Backend(BayesDB_Backend):
             return [float('nan')]
 
         # Get the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
         # Engine gives us a list of similarities which it is our
         # responsibility to integrate over.
@@ -760,6 +999,58 @@ class CGPM_Backend(BayesDB_Backend):
 
         return similarity_list
 
+    def row_similarity_batch(
+            self, bdb, generator_id, modelnos, rowids, target_rowid, colnos):
+        # Resolve the modelnos, engine, and individual indexing once for
+        # the whole batch rather than once per row.
+        cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+        cgpm_target_rowid = self._cgpm_rowid(bdb, generator_id, target_rowid)
+        cgpm_rowids = self._cgpm_rowids(bdb, generator_id, rowids)
+        if cgpm_target_rowid == -1:
+            return [[float('nan')] for _rowid in rowids]
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
+        return [
+            [float('nan')] if cgpm_rowid == -1 else
+            engine.row_similarity(
+                cgpm_rowid, cgpm_target_rowid, colnos,
+                statenos=cgpm_modelnos, multiprocess=self._multiprocess)
+            for cgpm_rowid in cgpm_rowids
+        ]
+
+    def row_similarity_matrix(
+            self, bdb, generator_id, modelnos, rowids, colnos):
+        cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+        cgpm_rowids = self._cgpm_rowids(bdb, generator_id, rowids)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
+        if cgpm_modelnos is None:
+            cgpm_modelnos = range(len(engine.states))
+        # Two rows are similar in a view if it puts them in the same
+        # cluster, so compare the row assignments of each model's views
+        # for all pairs at once, as the engine does for one pair, and
+        # accumulate the mean over models in a single n x n array.
+        n = len(rowids)
+        mean = numpy.zeros((n, n))
+        for s in cgpm_modelnos:
+            state = engine.states[s]
+            cols = state.outputs if colnos is None else colnos
+            views = set(state.view_for(colno) for colno in cols)
+            weight = 1. / (len(views) * len(cgpm_modelnos))
+            for view in views:
+                Zr = view.Zr()
+                clusters = numpy.array([
+                    Zr[cgpm_rowid] if cgpm_rowid != -1 else -1
+                    for cgpm_rowid in cgpm_rowids
+                ])
+                same = clusters[:, None] == clusters[None, :]
+                numpy.add(mean, weight, out=mean, where=same)
+        # Rows not incorporated are similar to nothing.
+        unknown = numpy.array(cgpm_rowids) == -1
+        mean[unknown, :] = float('nan')
+        mean[:, unknown] = float('nan')
+        if not cgpm_modelnos:
+            mean[:, :] = float('nan')
+        return mean
+
     def predictive_relevance(
             self, bdb, generator_id, modelnos, rowid_target, rowid_query,
             hypotheticals, colno):
@@ -803,7 +1094,7 @@ class CGPM_Backend(BayesDB_Backend):
                 % (hypotheticals,))
 
         # Get the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
 
         # Go!
         similarity_list = engine.relevance_probability(
@@ -814,35 +1105,51 @@ class CGPM_Backend(BayesDB_Backend):
 
     def predict_confidence(
             self, bdb, generator_id, modelnos, rowid, colno, numsamples=None):
+        [[prediction]] = self.predict_confidence_batch(
+            bdb, generator_id, modelnos, [rowid], [[colno]],
+            numsamples=numsamples)
+        return prediction
+
+    def predict_confidence_batch(
+            self, bdb, generator_id, modelnos, rowids, colnos_list,
+            numsamples=None):
         if not numsamples:
             numsamples = 2
         assert numsamples > 0
 
-        def _impute_nominal(sample):
-            counts = Counter(s[0] for s in sample)
+        def _impute_nominal(values):
+            counts = Counter(values)
             mode_count = max(counts[v] for v in counts)
             pred = iter(v for v in counts if counts[v] == mode_count).next()
             conf = float(mode_count) / numsamples
             return pred, conf
 
-        def _impute_numerical(sample):
-            pred = sum(s[0] for s in sample) / float(len(sample))
+        def _impute_numerical(values):
+            pred = sum(values) / float(len(values))
             conf = 0 # XXX Punt confidence for now
             return pred, conf
 
-        # Retrieve the samples. Specifying `rowid` ensures that relevant
-        # constraints are retrieved by `simulate`, so provide empty constraints.
-        sample = self.simulate_joint(
-            bdb, generator_id, modelnos, rowid, [colno], [], numsamples)
-
-        # Determine the imputation strategy (mode or mean).
+        # Determine the imputation strategy (mode or mean) of each column.
         population_id = core.bayesdb_generator_population(bdb, generator_id)
-        stattype = core.bayesdb_variable_stattype(
-            bdb, population_id, generator_id, colno)
-        if _is_nominal(stattype):
-            return _impute_nominal(sample)
-        else:
-            return _impute_numerical(sample)
+        impute = {}
+        for colno in set(colno for colnos in colnos_list for colno in colnos):
+            stattype = core.bayesdb_variable_stattype(
+                bdb, population_id, generator_id, colno)
+            impute[colno] = _impute_nominal if _is_nominal(stattype) \
+                else _impute_numerical
+
+        predictions = []
+        for rowid, colnos in zip(rowids, colnos_list):
+            # Retrieve the samples of all the row's cells at once.
+            # Specifying `rowid` ensures that relevant constraints are
+            # retrieved by `simulate`, so provide empty constraints.
+            sample = self.simulate_joint(
+                bdb, generator_id, modelnos, rowid, colnos, [], numsamples)
+            predictions.append([
+                impute[colno]([s[j] for s in sample])
+                for j, colno in enumerate(colnos)
+            ])
+        return predictions
 
     def simulate_joint(
             self, bdb, generator_id, modelnos, rowid, targets, constraints,
@@ -861,7 +1168,7 @@ class CGPM_Backend(BayesDB_Backend):
             if not math.isnan(value_numeric):
                 cgpm_constraints.update({colno: value_numeric})
         # Retrieve the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
         samples = engine.simulate(
             rowid=cgpm_rowid,
             targets=cgpm_targets,
@@ -880,10 +1187,12 @@ class CGPM_Backend(BayesDB_Backend):
             statenos=cgpm_modelnos,
             multiprocess=self._multiprocess
         )
-        def map_value(colno, value):
-            return self._from_numeric(bdb, generator_id, colno, value)
+        from_numeric = [
+            (colno, self._from_numeric_converter(bdb, generator_id, colno))
+            for colno in cgpm_targets
+        ]
         return [
-            [map_value(colno, row[colno]) for colno in cgpm_targets]
+            [convert(row[colno]) for colno, convert in from_numeric]
             for row in weighted_samples
         ]
 
@@ -903,7 +1212,7 @@ class CGPM_Backend(BayesDB_Backend):
             if not math.isnan(value_numeric):
                 cgpm_constraints.update({colno: value_numeric})
         # Retrieve the engine.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
         logpdfs = engine.logpdf(
             rowid=cgpm_rowid,
             targets=cgpm_targets,
@@ -922,6 +1231,44 @@ class CGPM_Backend(BayesDB_Backend):
             multiprocess=self._multiprocess,
         )
 
+    def logpdf_joint_batch(
+            self, bdb, generator_id, modelnos, rowids, targets_list,
+            constraints_list):
+        cgpm_modelnos = self._get_modelnos(bdb, generator_id, modelnos)
+        cgpm_rowids = self._cgpm_rowids(bdb, generator_id, rowids)
+        engine = self._engine(bdb, generator_id, cgpm_modelnos)
+        results = []
+        for cgpm_rowid, targets, constraints in \
+                zip(cgpm_rowids, targets_list, constraints_list):
+            cgpm_targets = {
+                colno: self._to_numeric(bdb, generator_id, colno, value)
+                for colno, value in targets
+            }
+            cgpm_constraints = {}
+            for colno, value in constraints:
+                value_numeric = self._to_numeric(
+                    bdb, generator_id, colno, value)
+                if not math.isnan(value_numeric):
+                    cgpm_constraints.update({colno: value_numeric})
+            logpdfs = engine.logpdf(
+                rowid=cgpm_rowid,
+                targets=cgpm_targets,
+                constraints=cgpm_constraints,
+                inputs=None,
+                accuracy=None,
+                statenos=cgpm_modelnos,
+                multiprocess=self._multiprocess
+            )
+            results.append(engine._likelihood_weighted_integrate(
+                logpdfs=logpdfs,
+                rowid=cgpm_rowid,
+                constraints=cgpm_constraints,
+                inputs=None,
+                statenos=cgpm_modelnos,
+                multiprocess=self._multiprocess,
+            ))
+        return results
+
     def _unique_rowid(self, rowids):
         if len(set(rowids)) != 1:
             raise ValueError('Multiple-row query: %r' % (list(set(rowids)),))
@@ -953,10 +1300,12 @@ class CGPM_Backend(BayesDB_Backend):
         ''' % (qexpressions, qt), (generator_id,))
 
         # Map values to codes.
-        def map_value(colno, value):
-            return self._to_numeric(bdb, generator_id, colno, value)
+        to_numeric = [
+            self._to_numeric_converter(bdb, generator_id, colno)
+            for colno in colnos
+        ]
         return [
-            tuple(map_value(colno, x) for colno, x in zip(colnos, row))
+            tuple(convert(x) for convert, x in zip(to_numeric, row))
             for row in cursor
         ]
 
@@ -1056,35 +1405,83 @@ class CGPM_Backend(BayesDB_Backend):
 
         return schema
 
-    def _engine(self, bdb, generator_id):
-        # Retrieve the cache.
+    def _engine(self, bdb, generator_id, cgpm_modelnos=None):
+        """Return the engine of `generator_id`.
 
+        Only the states numbered `cgpm_modelnos`, or all states if
+        None, are guaranteed to be loaded.  The others may be None
+        until a later call requests them.
+        """
         # Probe the cache.
-        cached_engine = self._engine_latest(bdb, generator_id)
-        if cached_engine is not None:
-            return cached_engine
+        engine = self._engine_latest(bdb, generator_id)
 
         # Not cached or mismatched stamps. Load the engine from the database.
-        cursor = bdb.sql_execute('''
-            SELECT engine_json, engine_stamp FROM bayesdb_cgpm_generator
-                WHERE generator_id = ?
-        ''', (generator_id,)).fetchall()
-        engine_json, engine_stamp = cursor[0]
-
-        # Check if the generator has an initialized engine.
-        if not engine_json:
-            generator = core.bayesdb_generator_name(bdb, generator_id)
-            raise BQLError(bdb, 'No models initialized for generator: %r'
-                % (generator,))
+        if engine is None:
+            cursor = bdb.sql_execute('''
+                SELECT engine_blob, engine_stamp FROM bayesdb_cgpm_generator
+                    WHERE generator_id = ?
+            ''', (generator_id,)).fetchall()
+            engine_blob, engine_stamp = cursor[0]
+
+            # Check if the generator has an initialized engine.
+            if not engine_blob:
+                generator = core.bayesdb_generator_name(bdb, generator_id)
+                raise BQLError(bdb, 'No models initialized for generator: %r'
+                    % (generator,))
+
+            # Decode everything but the states, which are loaded below.
+            metadata = cgpm_codec.decode(engine_blob)
+            cursor = bdb.sql_execute('''
+                SELECT COUNT(*) FROM bayesdb_cgpm_modelno
+                    WHERE generator_id = ?
+            ''', (generator_id,))
+            states = [None] * cursor_value(cursor)
 
-        # Deserialize the engine.
-        engine = Engine.from_metadata(
-            json.loads(engine_json), rng=bdb.np_prng,
-            multiprocess=self._multiprocess)
+            # Cache the engine metadata with its stamp.
+            self._del_cache_entry(bdb, generator_id, 'engine')
+            self._set_cache_entry(bdb, generator_id, 'metadata', metadata)
+            self._set_cache_entry(bdb, generator_id, 'stamp', engine_stamp)
+        else:
+            states = engine.states
 
-        # Cache the engine with its stamp.
-        self._set_cache_entry(bdb, generator_id, 'engine', engine)
-        self._set_cache_entry(bdb, generator_id, 'stamp', engine_stamp)
+        # Load the missing states.
+        if cgpm_modelnos is None:
+            cgpm_modelnos = xrange(len(states))
+        missing = sorted(set(s for s in cgpm_modelnos if states[s] is None))
+        if missing:
+            cursor = bdb.sql_execute('''
+                SELECT m.cgpm_modelno, s.state_blob
+                    FROM bayesdb_cgpm_modelno AS m, bayesdb_cgpm_state AS s
+                    WHERE m.generator_id = :generator_id
+                        AND s.generator_id = :generator_id
+                        AND m.modelno = s.modelno
+                        AND m.cgpm_modelno IN (%s)
+                    ORDER BY m.cgpm_modelno ASC
+            ''' % (','.join(map(str, missing)),), {
+                'generator_id': generator_id,
+            }).fetchall()
+            assert [m for m, _blob in cursor] == missing
+            metadata = self._get_cache_entry(bdb, generator_id, 'metadata')
+            if metadata is None:
+                cursor_blob = bdb.sql_execute('''
+                    SELECT engine_blob FROM bayesdb_cgpm_generator
+                        WHERE generator_id = ?
+                ''', (generator_id,))
+                metadata = cgpm_codec.decode(cursor_value(cursor_blob))
+                self._set_cache_entry(bdb, generator_id, 'metadata', metadata)
+            # Deserialize an engine of just the missing states.
+            loaded = Engine.from_metadata(
+                dict(metadata, states=[
+                    cgpm_codec.decode(state_blob) for _m, state_blob in cursor
+                ]),
+                rng=bdb.np_prng, multiprocess=self._multiprocess)
+            for m, state in zip(missing, loaded.states):
+                states[m] = state
+            if engine is None:
+                engine = loaded
+                engine.states = states
+                # Cache the engine.
+                self._set_cache_entry(bdb, generator_id, 'engine', engine)
 
         return engine
 
@@ -1111,9 +1508,32 @@ class CGPM_Backend(BayesDB_Backend):
         ''', (generator_id,))
         return cursor_value(cursor)
 
-    def _serialize_engine(self, bdb, generator_id, engine, cache):
-        # Write the engine to JSON.
-        engine_json = json_dumps(engine.to_metadata())
+    def _bump_engine_stamp(self, bdb, generator_id):
+        # Increment the stamp.
+        engine_stamp_old = self._engine_stamp(bdb, generator_id)
+        engine_stamp_new = engine_stamp_old + 1
+        bdb.sql_execute('''
+            UPDATE bayesdb_cgpm_generator SET engine_stamp = ?
+                WHERE generator_id = ?
+        ''', (engine_stamp_new, generator_id))
+        return engine_stamp_new
+
+    def _serialize_engine(self, bdb, generator_id, engine, cache,
+            cgpm_modelnos=None):
+        # Encode the states numbered cgpm_modelnos, or all loaded states
+        # if None, separately from the rest of the engine.
+        if cgpm_modelnos is None:
+            cgpm_modelnos = [
+                s for s, state in enumerate(engine.states) if state is not None
+            ]
+        states = engine.states
+        engine.states = [states[s] for s in cgpm_modelnos]
+        try:
+            metadata = engine.to_metadata()
+        finally:
+            engine.states = states
+        state_blobs = [cgpm_codec.encode(m) for m in metadata.pop('states')]
+        engine_blob = cgpm_codec.encode(metadata)
 
         # Increment the stamp.
         engine_stamp_old = self._engine_stamp(bdb, generator_id)
@@ -1122,20 +1542,125 @@ class CGPM_Backend(BayesDB_Backend):
         # Update the engine and stamp.
         bdb.sql_execute('''
             UPDATE bayesdb_cgpm_generator
-                SET engine_json = :engine_json,
+                SET engine_blob = :engine_blob,
                     engine_stamp = :engine_stamp
                 WHERE generator_id = :generator_id
         ''', {
-            'engine_json': engine_json,
+            'engine_blob': buffer(engine_blob),
             'engine_stamp': engine_stamp_new,
             'generator_id': generator_id,
         })
 
-        # Add it to the cache.
+        # Update the states.
+        for cgpm_modelno, state_blob in zip(cgpm_modelnos, state_blobs):
+            bdb.sql_execute('''
+                INSERT OR REPLACE INTO bayesdb_cgpm_state
+                    (generator_id, modelno, state_blob)
+                    SELECT generator_id, modelno, :state_blob
+                        FROM bayesdb_cgpm_modelno
+                        WHERE generator_id = :generator_id
+                            AND cgpm_modelno = :cgpm_modelno
+            ''', {
+                'state_blob': buffer(state_blob),
+                'generator_id': generator_id,
+                'cgpm_modelno': cgpm_modelno,
+            })
+
+        # Add it to the cache.  The metadata will be decoded afresh if
+        # more states are needed.
+        self._del_cache_entry(bdb, generator_id, 'metadata')
         if cache:
             self._set_cache_entry(bdb, generator_id, 'engine', engine)
             self._set_cache_entry(bdb, generator_id, 'stamp', engine_stamp_new)
 
+    def _estimand_cached(self, bdb, generator_id, estimand, arguments,
+            modelnos, nsamples, compute):
+        """Return `compute()`, persisted in bayesdb_cgpm_estimand_cache.
+
+        Results are keyed by the current engine stamp, so any operation
+        that modifies the engine (ANALYZE, ALTER, DROP MODELS, and so
+        on) implicitly invalidates them.  When the cache holds more than
+        the configured number of entries, the least recently used are
+        evicted.  Using an entry does not write to the database, and on
+        a read-only database, nothing new is stored.
+        """
+        capacity = self._estimand_cache_size
+        if not capacity:
+            return compute()
+        key = {
+            'generator_id': generator_id,
+            'engine_stamp': self._engine_stamp(bdb, generator_id),
+            'estimand': estimand,
+            'arguments_json': json_dumps(arguments),
+            'modelnos_json': json_dumps(modelnos),
+            'nsamples': nsamples,
+        }
+        cursor = bdb.sql_execute('''
+            SELECT value_json FROM bayesdb_cgpm_estimand_cache
+                WHERE generator_id = :generator_id
+                    AND engine_stamp = :engine_stamp
+                    AND estimand = :estimand
+                    AND arguments_json = :arguments_json
+                    AND modelnos_json = :modelnos_json
+                    AND nsamples = :nsamples
+        ''', key)
+        value_json = cursor_value(cursor, nullok=True)
+        hits = self._estimand_hits.setdefault(bdb, OrderedDict())
+        hit = tuple(sorted(key.iteritems()))
+        if value_json is not None:
+            hits.pop(hit, None)
+            hits[hit] = key
+            return json.loads(value_json)
+        value = compute()
+        try:
+            self._estimand_store(bdb, key, value, hits, capacity)
+        except apsw.ReadOnlyError:
+            # A read-only database caches nothing.
+            pass
+        return value
+
+    def _estimand_store(self, bdb, key, value, hits, capacity):
+        # Write the recency of the hits since the last store, in the
+        # order they were used, then the new entry as the most recent.
+        clock = cursor_value(bdb.sql_execute('''
+            SELECT IFNULL(MAX(last_used), 0) FROM bayesdb_cgpm_estimand_cache
+        '''))
+        for i, hit_key in enumerate(hits.itervalues()):
+            hit_key['last_used'] = clock + 1 + i
+        bdb.sql_executemany('''
+            UPDATE bayesdb_cgpm_estimand_cache
+                SET last_used = :last_used
+                WHERE generator_id = :generator_id
+                    AND engine_stamp = :engine_stamp
+                    AND estimand = :estimand
+                    AND arguments_json = :arguments_json
+                    AND modelnos_json = :modelnos_json
+                    AND nsamples = :nsamples
+        ''', hits.values())
+        key['last_used'] = clock + 1 + len(hits)
+        hits.clear()
+        # Results for stale engines can never be hit again.
+        bdb.sql_execute('''
+            DELETE FROM bayesdb_cgpm_estimand_cache
+                WHERE generator_id = ? AND engine_stamp != ?
+        ''', (key['generator_id'], key['engine_stamp']))
+        key['value_json'] = json_dumps(value)
+        bdb.sql_execute('''
+            INSERT INTO bayesdb_cgpm_estimand_cache
+                (generator_id, engine_stamp, estimand, arguments_json,
+                    modelnos_json, nsamples, value_json, last_used)
+                VALUES (:generator_id, :engine_stamp, :estimand,
+                    :arguments_json, :modelnos_json, :nsamples,
+                    :value_json, :last_used)
+        ''', key)
+        # Evict the least recently used entries beyond capacity.
+        bdb.sql_execute('''
+            DELETE FROM bayesdb_cgpm_estimand_cache
+                WHERE last_used <= (
+                    SELECT last_used FROM bayesdb_cgpm_estimand_cache
+                        ORDER BY last_used DESC LIMIT 1 OFFSET ?
+                )
+        ''', (capacity,))
 
     def _retrieve_cache(self, bdb,):
         if bdb in self._cache:
@@ -1175,63 +1700,144 @@ class CGPM_Backend(BayesDB_Backend):
         cgpm_rowid = cursor_value(cursor, nullok=nullok)
         return cgpm_rowid if cgpm_rowid is not None else -1
 
+    def _cgpm_rowids(self, bdb, generator_id, table_rowids):
+        """Map each of `table_rowids` to its cgpm rowid, or -1 if none."""
+        mapping = {}
+        # Stay well below sqlite3's default limit of 999 parameters.
+        chunk = 500
+        for i in xrange(0, len(table_rowids), chunk):
+            batch = table_rowids[i:i + chunk]
+            cursor = bdb.sql_execute('''
+                SELECT table_rowid, cgpm_rowid FROM bayesdb_cgpm_individual
+                    WHERE generator_id = ? AND table_rowid IN (%s)
+            ''' % (', '.join('?' for _ in batch),), [generator_id] + batch)
+            mapping.update(cursor)
+        return [mapping.get(table_rowid, -1) for table_rowid in table_rowids]
+
     def _to_numeric(self, bdb, generator_id, colno, value):
         """Convert value in bayeslite to equivalent cgpm format."""
         if value is None:
             return float('NaN')
+        return self._to_numeric_converter(bdb, generator_id, colno)(value)
+
+    def _from_numeric(self, bdb, generator_id, colno, value):
+        """Convert value in cgpm to equivalent bayeslite format."""
+        if math.isnan(value):
+            return None
+        return self._from_numeric_converter(bdb, generator_id, colno)(value)
+
+    def _to_numeric_converter(self, bdb, generator_id, colno):
+        """Return a function converting values of `colno` to cgpm format.
+
+        The stattype and categories are looked up once, so converting
+        a whole column costs no more queries than converting one value.
+        """
+        nan = float('NaN')
         # XXX Latent variables are not associated with an entry in
         # bayesdb_cgpm_category, so just pass through whatever value
         # the user supplied, as a float.
         if colno < 0:
-            return float(value)
-        population_id = core.bayesdb_generator_population(bdb, generator_id)
-        stattype = core.bayesdb_variable_stattype(
-            bdb, population_id, generator_id, colno)
-        if _is_nominal(stattype):
-            cursor = bdb.sql_execute('''
-                SELECT code FROM bayesdb_cgpm_category
-                    WHERE generator_id = ? AND colno = ? AND value = ?
-            ''', (generator_id, colno, value))
-            integer = cursor_value(cursor, nullok=True)
+            return lambda value: nan if value is None else float(value)
+        categories = self._variable_categories(bdb, generator_id, colno)
+        if categories is None:
+            return lambda value: nan if value is None else value
+        codes, _values = categories
+        def to_numeric(value):
+            if value is None:
+                return nan
+            # Categories are stored as text.  Anything else is compared
+            # with them by sqlite3's rules, so ask sqlite3, once.
+            key = value if isinstance(value, basestring) \
+                else (value.__class__, value)
+            try:
+                integer = codes[key]
+            except KeyError:
+                cursor = bdb.sql_execute('''
+                    SELECT code FROM bayesdb_cgpm_category
+                        WHERE generator_id = ? AND colno = ? AND value = ?
+                ''', (generator_id, colno, value))
+                integer = codes[key] = cursor_value(cursor, nullok=True)
             if integer is None:
-                return float('NaN')
+                return nan
                 # raise BQLError('Invalid category: %r' % (value,))
             return integer
-        else:
-            return value
+        return to_numeric
 
-    def _from_numeric(self, bdb, generator_id, colno, value):
-        """Convert value in cgpm to equivalent bayeslite format."""
-        if math.isnan(value):
-            return None
-        population_id = core.bayesdb_generator_population(bdb, generator_id)
-        stattype = core.bayesdb_variable_stattype(
-            bdb, population_id, generator_id, colno)
-        if _is_nominal(stattype):
-            # XXX Latent variables are not associated with an entry in
-            # bayesdb_cgpm_category, so just pass through whatever value cgpm
-            # returns as a string.
-            if colno < 0:
-                return str(value)
-            cursor = bdb.sql_execute('''
-                SELECT value FROM bayesdb_cgpm_category
-                    WHERE generator_id = ? AND colno = ? AND code = ?
-            ''', (generator_id, colno, value))
-            text = cursor_value(cursor, nullok=True)
+    def _from_numeric_converter(self, bdb, generator_id, colno):
+        """Return a function converting cgpm values of `colno` back."""
+        categories = self._variable_categories(bdb, generator_id, colno)
+        if categories is None:
+            return lambda value: None if math.isnan(value) else value
+        # XXX Latent variables are not associated with an entry in
+        # bayesdb_cgpm_category, so just pass through whatever value cgpm
+        # returns as a string.
+        if colno < 0:
+            return lambda value: None if math.isnan(value) else str(value)
+        _codes, values = categories
+        def from_numeric(value):
+            if math.isnan(value):
+                return None
+            text = values.get(value)
             if text is None:
                 raise BQLError('Invalid category: %r' % (value,))
             return text
-        else:
-            return value
+        return from_numeric
+
+    def _variable_categories(self, bdb, generator_id, colno):
+        """Return (codes, values) dicts of the categories of `colno`.
+
+        `codes` maps each category to its code and `values` maps back.
+        Return None if `colno` is not nominal.
+        """
+        categories = self._categories(bdb, generator_id)
+        if colno not in categories:
+            # The variable may be newer than the cached categories.
+            self._del_cache_entry(bdb, generator_id, 'categories')
+            categories = self._categories(bdb, generator_id)
+            if colno not in categories:
+                population_id = core.bayesdb_generator_population(
+                    bdb, generator_id)
+                # Fails with the appropriate error.
+                core.bayesdb_variable_stattype(
+                    bdb, population_id, generator_id, colno)
+                assert False, 'Variable not cached: %r' % (colno,)
+        return categories[colno]
+
+    def _categories(self, bdb, generator_id):
+        # Load the categories of all nominal variables in bulk, as a
+        # map from colno to (codes, values), or None if not nominal.
+        categories = self._get_cache_entry(bdb, generator_id, 'categories')
+        if categories is not None:
+            return categories
+        population_id = core.bayesdb_generator_population(bdb, generator_id)
+        cursor = bdb.sql_execute('''
+            SELECT colno, stattype FROM bayesdb_variable
+                WHERE population_id = ?
+                    AND (generator_id IS NULL OR generator_id = ?)
+        ''', (population_id, generator_id))
+        categories = {
+            colno: ({}, {}) if _is_nominal(stattype) else None
+            for colno, stattype in cursor
+        }
+        cursor = bdb.sql_execute('''
+            SELECT colno, value, code FROM bayesdb_cgpm_category
+                WHERE generator_id = ?
+        ''', (generator_id,))
+        for colno, value, code in cursor:
+            codes, values = categories[colno]
+            codes[value] = code
+            values[code] = value
+        self._set_cache_entry(bdb, generator_id, 'categories', categories)
+        return categories
 
     def _retrieve_baseline_variables(self, bdb, generator_id):
         # XXX Store this data in the bdb.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, [0])
         return engine.states[0].outputs
 
     def _retrieve_foreign_variables(self, bdb, generator_id):
         # XXX Store this data in the bdb.
-        engine = self._engine(bdb, generator_id)
+        engine = self._engine(bdb, generator_id, [0])
         return list(itertools.chain.from_iterable([
             cgpm.outputs for cgpm in engine.states[0].hooked_cgpms.itervalues()
         ]))
@@ -1817,6 +2423,36 @@ def _default_numerical(bdb, generator_id, var):
 def _is_nominal(stattype):
     return casefold(stattype) == 'nominal'
 
+def _baseline_state(engine, cgpm_modelnos):
+    # The baseline variables are the same in every state, so consult
+    # one that is sure to be loaded.
+    return engine.states[cgpm_modelnos[0] if cgpm_modelnos else 0]
+
+def _migrate_engine_json(bdb):
+    # Re-encode every engine stored as JSON in the binary format, with
+    # each state in a row of its own.
+    cursor = bdb.sql_execute('''
+        SELECT generator_id, engine_json FROM bayesdb_cgpm_generator
+            WHERE engine_json IS NOT NULL
+    ''').fetchall()
+    for generator_id, engine_json in cursor:
+        metadata = json.loads(engine_json)
+        states = metadata.pop('states', [])
+        bdb.sql_execute('''
+            UPDATE bayesdb_cgpm_generator
+                SET engine_blob = ?, engine_json = NULL
+                WHERE generator_id = ?
+        ''', (buffer(cgpm_codec.encode(metadata)), generator_id))
+        bdb.sql_executemany('''
+            INSERT INTO bayesdb_cgpm_state (generator_id, modelno, state_blob)
+                SELECT generator_id, modelno, ?
+                    FROM bayesdb_cgpm_modelno
+                    WHERE generator_id = ? AND cgpm_modelno = ?
+        ''', [
+            (buffer(cgpm_codec.encode(state)), generator_id, cgpm_modelno)
+            for cgpm_modelno, state in enumerate(states)
+        ])
+
 _DEFAULT_DIST = {
     'counts':           _default_numerical,     # XXX change to poisson.
     'cyclic':           _default_numerical,     # XXX change to von mises.
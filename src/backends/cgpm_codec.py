@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Compact binary encoding of cgpm engine metadata.
+
+The metadata of a cgpm engine, as returned by `Engine.to_metadata`,
+is a tree of dicts and lists whose bulk is long homogeneous lists of
+numbers: the data matrix, row partitions, and per-view assignments.
+Rather than spell those out in JSON, we store each one as a raw
+little-endian NumPy buffer, and keep only the small remainder of the
+tree -- hyperparameters, column types, and so on -- in a JSON header
+that refers to the buffers by index.
+
+An encoded section is laid out as::
+
+    magic "BQLS" | u32 header length | header JSON | buffers...
+
+The cgpm backend stores the metadata of an engine sans states as one
+section, and the metadata of each state as a section of its own, so
+that states can be loaded individually.
+
+Decoding yields the same tree as a round trip through
+`json.loads(json_dumps(metadata))` would -- dict keys become strings,
+tuples become lists, and numbers keep their Python types -- except
+that the data matrices under the keys in `_ARRAY_FIELDS`, which
+`Engine.from_metadata` and `State.from_metadata` pass through
+`numpy.asarray` anyway, stay NumPy arrays.
+"""
+
+import itertools
+import json
+import struct
+
+import numpy
+
+from bayeslite.util import json_dumps
+
+_SECTION_MAGIC = 'BQLS'
+
+# Lists shorter than this are not worth a buffer of their own.
+_MIN_ARRAY_SIZE = 16
+
+_ARRAY_KEY = '__bayeslite_array__'
+
+# Keys whose arrays are decoded as arrays rather than lists.
+_ARRAY_FIELDS = frozenset(['X'])
+
+_DTYPES = {
+    float: numpy.dtype('<f8'),
+    numpy.float64: numpy.dtype('<f8'),
+    int: numpy.dtype('<i8'),
+}
+
+def encode(obj):
+    """Encode a JSON-compatible tree `obj` as a binary string."""
+    arrays = []
+    tree = _extract(obj, arrays)
+    buffers = [array.tostring() for array in arrays]
+    descriptors = [
+        (array.dtype.str, array.shape, len(data))
+        for array, data in zip(arrays, buffers)
+    ]
+    header = json_dumps({'tree': tree, 'arrays': descriptors})
+    return ''.join(
+        [struct.pack('<4sI', _SECTION_MAGIC, len(header)), header] + buffers)
+
+def decode(blob, offset=0):
+    """Decode the tree encoded in `blob` starting at `offset`."""
+    blob = buffer(blob)
+    magic, length = struct.unpack_from('<4sI', blob, offset)
+    if magic != _SECTION_MAGIC:
+        raise ValueError('Not an encoded cgpm section')
+    offset += struct.calcsize('<4sI')
+    header = json.loads(str(blob[offset:offset + length]))
+    offset += length
+    arrays = []
+    for dtype, shape, size in header['arrays']:
+        dtype = numpy.dtype(str(dtype))
+        array = numpy.frombuffer(blob, dtype=dtype,
+            count=size // dtype.itemsize, offset=offset)
+        arrays.append(array.reshape(shape))
+        offset += size
+    return _insert(header['tree'], arrays)
+
+def _extract(obj, arrays):
+    # Replace homogeneous numeric lists in obj by references to arrays.
+    if isinstance(obj, dict):
+        return dict((k, _extract(v, arrays)) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        array = _homogeneous_array(obj)
+        if array is not None:
+            arrays.append(array)
+            return {_ARRAY_KEY: len(arrays) - 1}
+        return [_extract(v, arrays) for v in obj]
+    return obj
+
+def _insert(obj, arrays, as_array=False):
+    # Inverse of _extract.  The arrays are views of the blob, so copy
+    # those returned as arrays.
+    if isinstance(obj, dict):
+        if len(obj) == 1 and _ARRAY_KEY in obj:
+            array = arrays[obj[_ARRAY_KEY]]
+            return array.copy() if as_array else array.tolist()
+        return dict((k, _insert(v, arrays, k in _ARRAY_FIELDS))
+            for k, v in obj.iteritems())
+    if isinstance(obj, list):
+        return [_insert(v, arrays) for v in obj]
+    return obj
+
+def _homogeneous_array(obj):
+    # Return obj as an array if it is a rectangular list of lists of
+    # Python numbers all of one type, float or int, else None.  Mixed
+    # types stay in JSON so that decoding preserves them exactly.
+    if len(obj) < _MIN_ARRAY_SIZE and \
+            not (obj and isinstance(obj[0], (list, tuple))):
+        return None
+    try:
+        array = numpy.array(obj)
+    except ValueError:          # ragged
+        return None
+    if array.size < _MIN_ARRAY_SIZE or array.dtype.kind not in 'if':
+        return None
+    # Check the element types without a Python loop per element.
+    flat = obj
+    for _ in xrange(array.ndim - 1):
+        flat = itertools.chain.from_iterable(flat)
+    dtypes = set(_DTYPES.get(t) for t in set(map(type, flat)))
+    if len(dtypes) != 1 or None in dtypes:
+        return None
+    return array.astype(dtypes.pop(), copy=False)
@@ -24,15 +24,17 @@ import csv
 import gzip
 import itertools
 import json
+import multiprocessing
 import os
 import tempfile
 
 from StringIO import StringIO
 from collections import Counter
-from collections import OrderedDict
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import loom.tasks
+import numpy
 
 from distributions.io.stream import open_compressed
 from loom.cFormat import assignment_stream_load
@@ -125,6 +127,12 @@ CREATE TABLE bayesdb_loom_row_kind_partition (
 
 CSV_DELIMITER = ','
 
+# Nominal columns with more distinct values are modelled as unbounded.
+MAX_NOMINAL_VALUES = 256
+
+# Number of rows per executemany when bulk-inserting into the loom tables.
+INSERT_CHUNK_SIZE = 10000
+
 STATTYPE_TO_LOOMTYPE = {
     'unbounded_nominal'    : 'dpd',
     'counts'               : 'gp',
@@ -146,15 +154,17 @@ class LoomBackend(BayesDB_Backend):
     begin with ``bayesdb_loom``.
     """
 
-    def __init__(self, loom_store_path):
+    def __init__(self, loom_store_path, analyze_workers=None):
         """Initialize the Loom backend.
 
         `loom_store_path` is the absolute path at which loom stores its
-        auxiliary data files.
+        auxiliary data files.  `analyze_workers` is the number of models
+        to analyze at once, by default the number of CPUs.
         """
         if not os.path.isabs(loom_store_path):
             raise ValueError('Loom store path must be an absolute path.')
         self.loom_store_path = loom_store_path
+        self.analyze_workers = analyze_workers
         os.environ['LOOM_STORE'] = self.loom_store_path
         if not os.path.isdir(self.loom_store_path):
             os.makedirs(self.loom_store_path)
@@ -168,6 +178,11 @@ class LoomBackend(BayesDB_Backend):
     def name(self):
         return 'loom'
 
+    def set_analyze_workers(self, workers):
+        old = self.analyze_workers
+        self.analyze_workers = workers
+        return old
+
     def register(self, bdb):
         with bdb.savepoint():
             version = bayesdb_backend_version(bdb, self.name())
@@ -187,23 +202,36 @@ class LoomBackend(BayesDB_Backend):
             VALUES (?, ?, ?)
         ''', (generator_id, name, self.loom_store_path))
 
-        headers = []
-        data = []
-        data_by_column = {}
-        for colno in bayesdb_variable_numbers(bdb, population_id, None):
-            column_name = bayesdb_variable_name(bdb, population_id, None, colno)
-            headers.append(column_name)
-            qt = sqlite3_quote_name(table)
-            qcn = sqlite3_quote_name(column_name)
-            cursor = bdb.sql_execute('SELECT %s FROM %s' % (qcn, qt))
-            col_data = [item for (item,) in cursor.fetchall()]
-            data.append(col_data)
-            data_by_column[column_name] = col_data
-        data = [list(i) for i in zip(*data)]
+        colnos = bayesdb_variable_numbers(bdb, population_id, None)
+        headers = [
+            bayesdb_variable_name(bdb, population_id, None, colno)
+            for colno in colnos
+        ]
+
+        # Write the rows CSV in a single pass over the table, noting
+        # the rowids and the distinct values of each nominal column on
+        # the way.
+        distinct_values = dict(
+            (i, set()) for i, colno in enumerate(colnos)
+            if bayesdb_variable_stattype(
+                bdb, population_id, None, colno) == 'nominal')
+        rowids = []
+        qt = sqlite3_quote_name(table)
+        qcns = ','.join(map(sqlite3_quote_name, headers))
+        cursor = bdb.sql_execute('SELECT oid, %s FROM %s' % (qcns, qt))
+        def rows():
+            for row in cursor:
+                rowids.append(row[0])
+                for i, values in distinct_values.iteritems():
+                    if len(values) <= MAX_NOMINAL_VALUES:
+                        values.add(row[i + 1])
+                yield row[1:]
+        csv_file = self._data_to_csv(bdb, headers, rows())
 
         # Ingest data into loom.
-        schema_file = self._data_to_schema(bdb, population_id, data_by_column)
-        csv_file = self._data_to_csv(bdb, headers, data)
+        schema_file = self._data_to_schema(bdb, population_id, dict(
+            (headers[i], len(values))
+            for i, values in distinct_values.iteritems()))
         project_path = self._get_loom_project_path(bdb, generator_id)
         loom.tasks.ingest(project_path, rows_csv=csv_file.name,
             schema=schema_file.name)
@@ -212,17 +240,14 @@ class LoomBackend(BayesDB_Backend):
         self._store_encoding_info(bdb, generator_id)
 
         # Store rowid mapping in the bdb.
-        qt = sqlite3_quote_name(table)
-        rowids = bdb.sql_execute('SELECT oid FROM %s' % (qt,)).fetchall()
-        insertions = ','.join(
-            str((generator_id, table_rowid, loom_rowid))
-            for loom_rowid, (table_rowid,) in enumerate(rowids)
-        )
-        bdb.sql_execute('''
+        _executemany_chunked(bdb, '''
             INSERT INTO bayesdb_loom_rowid_mapping
                 (generator_id, table_rowid, loom_rowid)
-                VALUES %s
-        ''' % (insertions,))
+                VALUES (?, ?, ?)
+        ''', (
+            (generator_id, table_rowid, loom_rowid)
+            for loom_rowid, table_rowid in enumerate(rowids)
+        ))
 
     def _store_encoding_info(self, bdb, generator_id):
         encoding_path = os.path.join(
@@ -303,13 +328,19 @@ class LoomBackend(BayesDB_Backend):
                 csv_writer.writerow(processed_row)
         return csv_file
 
-    def _data_to_schema(self, bdb, population_id, data_by_column):
+    def _data_to_schema(self, bdb, population_id, distinct_counts):
+        """Write the loom schema for the population to a temporary file.
+
+        `distinct_counts` maps the name of each nominal column to its
+        number of distinct values, counted up to just past
+        MAX_NOMINAL_VALUES.
+        """
         json_dict = {}
         for colno in bayesdb_variable_numbers(bdb, population_id, None):
             column_name = bayesdb_variable_name(bdb, population_id, None, colno)
             stattype = bayesdb_variable_stattype(bdb, population_id, None, colno)
             if stattype == 'nominal' \
-                    and len(set(data_by_column[column_name])) > 256:
+                    and distinct_counts[column_name] > MAX_NOMINAL_VALUES:
                 stattype = 'unbounded_nominal'
             json_dict[column_name] = STATTYPE_TO_LOOMTYPE[stattype]
         with tempfile.NamedTemporaryFile(delete=False) as schema_file:
@@ -366,6 +397,7 @@ class LoomBackend(BayesDB_Backend):
         self._close_query_server(bdb, generator_id)
         self._close_preql_server(bdb, generator_id)
         self._del_cache_entry(bdb, generator_id, None)
+        _invalidate_partitions(bdb, generator_id)
         with bdb.savepoint():
             self.drop_models(bdb, generator_id)
             bdb.sql_execute('''
@@ -404,6 +436,7 @@ class LoomBackend(BayesDB_Backend):
             # Close the servers.
             self._close_query_server(bdb, generator_id)
             self._close_preql_server(bdb, generator_id)
+            _invalidate_partitions(bdb, generator_id)
             bdb.sql_execute('''
                 UPDATE bayesdb_loom_generator_model_info
                 SET num_models = 0
@@ -420,6 +453,10 @@ class LoomBackend(BayesDB_Backend):
     def analyze_models(self, bdb, generator_id, modelnos=None, iterations=1,
             max_seconds=None, ckpt_iterations=None, ckpt_seconds=None,
             program=None):
+        # Loom runs the analysis of each model to completion in a
+        # subprocess, with no time budget and no intermediate state to
+        # checkpoint, so neither can be honoured; the partitions of
+        # each model are saved as soon as it finishes instead.
         if max_seconds is not None:
             raise BQLError(bdb,
                 'Loom analyze does not support number of seconds.')
@@ -427,24 +464,48 @@ class LoomBackend(BayesDB_Backend):
             raise BQLError(bdb, 'Loom analyze does not support checkpoint.')
         if program is not None:
             raise BQLError(bdb, 'Loom analyze does not support programs.')
-        if modelnos is not None:
-            raise BQLError(bdb, 'Loom cannot analyze specific model numbers.')
 
-        # Prepare arguments for loom.tasks.infer invocation.
-        num_models = (self._get_num_models(bdb, generator_id))
-        iterations = max(int(iterations), 1)
+        num_models = self._get_num_models(bdb, generator_id)
+        if modelnos is None:
+            modelnos = range(num_models)
+        else:
+            unknown = [m for m in modelnos if not 0 <= m < num_models]
+            if unknown:
+                raise BQLError(bdb, 'No such Loom models: %r' % (unknown,))
+
+        # Prepare arguments for loom.tasks.infer_one invocations.
+        iterations = max(int(iterations or 1), 1)
         config = {'schedule': {'extra_passes': iterations}}
         project_path = self._get_loom_project_path(bdb, generator_id)
-
-        # Run inference.
-        loom.tasks.infer(project_path, sample_count=num_models, config=config)
-
-        # Save the column and row partitions.
-        self._store_kind_partition(bdb, generator_id, modelnos)
-
-        # Close cached query servers.
+        stopped = []
+
+        def infer(modelno):
+            if stopped:
+                return None
+            loom.tasks.infer_one(project_path, seed=modelno, config=config)
+            return modelno
+
+        # Run inference, one model per worker, and save the column and
+        # row partitions of each model as it finishes.  The query
+        # servers read the models that are being rewritten, so close
+        # them first.
         self._close_query_server(bdb, generator_id)
         self._close_preql_server(bdb, generator_id)
+        workers = self.analyze_workers or multiprocessing.cpu_count()
+        pool = ThreadPool(max(1, min(workers, len(modelnos))))
+        try:
+            for modelno in pool.imap_unordered(infer, modelnos):
+                if modelno is not None:
+                    self._store_kind_partition(bdb, generator_id, [modelno])
+                    _invalidate_partitions(bdb, generator_id)
+        finally:
+            # On error or interruption, let the running models finish
+            # but start no more.
+            stopped.append(True)
+            pool.close()
+            pool.join()
+            self._close_query_server(bdb, generator_id)
+            self._close_preql_server(bdb, generator_id)
 
     def _store_kind_partition(self, bdb, generator_id, modelnos):
         population_id = bayesdb_generator_population(bdb, generator_id)
@@ -456,37 +517,38 @@ class LoomBackend(BayesDB_Backend):
                     bdb, generator_id, modelno)
                 # Bulk insertion of mapping from colno to kind_id.
                 colnos = bayesdb_variable_numbers(bdb, population_id, None)
-                ranks = [self._get_loom_rank(bdb, generator_id, colno)
-                    for colno in colnos]
-                insertions = ','.join(
-                    str((generator_id, modelno, colno, column_partition[rank]))
-                    for colno, rank in zip(colnos, ranks)
-                )
-                bdb.sql_execute('''
+                ranks = self._get_column_ranks(bdb, generator_id)
+                _executemany_chunked(bdb, '''
                     INSERT OR REPLACE INTO bayesdb_loom_column_kind_partition
                     (generator_id, modelno, colno, kind_id)
-                    VALUES %s
-                ''' % (insertions,))
+                    VALUES (?, ?, ?, ?)
+                ''', (
+                    (generator_id, modelno, colno,
+                        column_partition[ranks[colno]])
+                    for colno in colnos
+                ))
                 # Bulk insertion of mapping from (kind_id, rowid) to cluster_id.
                 row_partition = self._retrieve_row_partition(
                     bdb, generator_id, modelno)
                 rowids = bdb.sql_execute('''
                     SELECT table_rowid, loom_rowid
                         FROM bayesdb_loom_rowid_mapping
-                ''').fetchall()
-                insertions = ','.join(
-                    str((generator_id, modelno, rowid[0], rowid[1],
-                            kind_id, partition_id))
-                    for kind_id in row_partition
-                    for rowid, partition_id
-                        in zip(rowids, row_partition[kind_id]))
-                bdb.sql_execute('''
+                        WHERE generator_id = ?
+                        ORDER BY loom_rowid
+                ''', (generator_id,)).fetchall()
+                _executemany_chunked(bdb, '''
                     INSERT OR REPLACE INTO
                         bayesdb_loom_row_kind_partition
                     (generator_id, modelno, table_rowid, loom_rowid,
                         kind_id, partition_id)
-                    VALUES %s
-                ''' % (insertions,))
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    (generator_id, modelno, table_rowid, loom_rowid,
+                        kind_id, partition_id)
+                    for kind_id in row_partition
+                    for (table_rowid, loom_rowid), partition_id
+                        in zip(rowids, row_partition[kind_id])
+                ))
 
     def _retrieve_column_partition(self, bdb, generator_id, modelno):
         """Return column partition from a CrossCat model.
@@ -535,41 +597,33 @@ class LoomBackend(BayesDB_Backend):
             modelnos = range(self._get_num_models(bdb, generator_id))
         if colno0 == colno1:
             return [1.]
-        cursor = bdb.sql_execute('''
-            SELECT
-                CAST(t1.kind_id = t2.kind_id AS INT)
-            FROM bayesdb_loom_column_kind_partition as t1
-                JOIN bayesdb_loom_column_kind_partition as t2 USING
-                    (generator_id, modelno)
-            WHERE t1.generator_id = ?
-                AND t1.modelno in (%s)
-                AND t1.colno = ?
-                AND t2.colno = ?
-        ''' % (','.join(map(str, modelnos)),), (generator_id, colno0, colno1))
-        return [c for (c,) in cursor]
-
-    def _get_kind_id(self, bdb, generator_id, modelno, colno):
-        """Return kind_id (view assignment) of colno in modelno."""
-        cursor = bdb.sql_execute('''
-            SELECT kind_id
-            FROM bayesdb_loom_column_kind_partition
-            WHERE generator_id = ?
-                AND modelno = ?
-                AND colno = ?
-        ''', (generator_id, modelno, colno,))
-        return cursor_value(cursor)
-
-    def _get_partition_id(self, bdb, generator_id, modelno, kind_id, rowid):
-        """Return row partition_id of given rowid, within kind_id of modelno."""
-        cursor = bdb.sql_execute('''
-            SELECT partition_id
-            FROM bayesdb_loom_row_kind_partition
-            WHERE generator_id = ?
-                AND modelno = ?
-                AND kind_id = ?
-                AND table_rowid = ?
-        ''', (generator_id, modelno, kind_id, rowid))
-        return cursor_value(cursor)
+        partitions = self._get_partitions(bdb, generator_id)
+        models = partitions.model_indices(modelnos)
+        if not models:
+            return []
+        c0 = partitions.colno_index[colno0]
+        c1 = partitions.colno_index[colno1]
+        kinds = partitions.kinds[models]
+        return (kinds[:, c0] == kinds[:, c1]).astype(int).tolist()
+
+    def column_dependence_probability_matrix(self,
+            bdb, generator_id, modelnos, colnos):
+        if modelnos is None:
+            modelnos = range(self._get_num_models(bdb, generator_id))
+        partitions = self._get_partitions(bdb, generator_id)
+        models = partitions.model_indices(modelnos)
+        matrix = [[[]] * len(colnos) for _colno in colnos]
+        for i in xrange(len(colnos)):
+            matrix[i][i] = [1.]
+        if not models:
+            return matrix
+        columns = [partitions.colno_index[colno] for colno in colnos]
+        kinds = partitions.kinds[numpy.ix_(models, columns)]
+        for i in xrange(len(colnos)):
+            same = (kinds[:, i + 1:] == kinds[:, i:i + 1]).astype(int)
+            for j, dependent in enumerate(same.T.tolist(), i + 1):
+                matrix[i][j] = matrix[j][i] = dependent
+        return matrix
 
     def _get_constraint_row(self, constraints, bdb, generator_id, population_id,
             server):
@@ -664,26 +718,40 @@ class LoomBackend(BayesDB_Backend):
         assert len(colnos) == 1
         if rowid == target_rowid:
             return [1.] * len(modelnos)
-        cursor = bdb.sql_execute('''
-            SELECT
-                CAST(t1.partition_id = t2.partition_id AS INT)
-            FROM bayesdb_loom_row_kind_partition as t1
-                JOIN bayesdb_loom_row_kind_partition as t2
-                USING (generator_id, modelno, kind_id)
-            WHERE t1.generator_id = ?
-                AND t1.modelno in (%s)
-                AND t1.kind_id = (
-                    SELECT kind_id
-                    FROM bayesdb_loom_column_kind_partition
-                    WHERE generator_id = t1.generator_id
-                        AND modelno = t1.modelno
-                        AND colno = ?
-                )
-                AND t1.table_rowid = ?
-                AND t2.table_rowid = ?
-        ''' % (','.join(map(str, modelnos)),), (
-            generator_id, colnos[0], rowid, target_rowid))
-        return [c for (c,) in cursor]
+        partitions = self._get_partitions(bdb, generator_id)
+        models = partitions.model_indices(modelnos)
+        if not models or rowid not in partitions.rowid_index or \
+                target_rowid not in partitions.rowid_index:
+            return []
+        clusters = partitions.row_clusters(
+            models, colnos[0],
+            [partitions.rowid_index[rowid],
+                partitions.rowid_index[target_rowid]])
+        return (clusters[:, 0] == clusters[:, 1]).astype(int).tolist()
+
+    def row_similarity_matrix(self, bdb, generator_id, modelnos, rowids,
+            colnos):
+        if modelnos is None:
+            modelnos = range(self._get_num_models(bdb, generator_id))
+        assert len(colnos) == 1
+        partitions = self._get_partitions(bdb, generator_id)
+        models = partitions.model_indices(modelnos)
+        matrix = [[[]] * len(rowids) for _rowid in rowids]
+        for i in xrange(len(rowids)):
+            matrix[i][i] = [1.] * len(modelnos)
+        if not models:
+            return matrix
+        # Rows unknown to the models are similar to nothing but themselves.
+        known = [rowid in partitions.rowid_index for rowid in rowids]
+        clusters = partitions.row_clusters(models, colnos[0], [
+            partitions.rowid_index.get(rowid, 0) for rowid in rowids
+        ])
+        for i in xrange(len(rowids)):
+            same = (clusters[:, i + 1:] == clusters[:, i:i + 1]).astype(int)
+            for j, similar in enumerate(same.T.tolist(), i + 1):
+                matrix[i][j] = matrix[j][i] = \
+                    similar if known[i] and known[j] else []
+        return matrix
 
     def predictive_relevance(self, bdb, generator_id, modelnos, rowid_target,
             rowid_queries, hypotheticals, colno):
@@ -692,19 +760,22 @@ class LoomBackend(BayesDB_Backend):
                 ' because it is unable to insert rows into CrossCat')
         if modelnos is None:
             modelnos = range(self._get_num_models(bdb, generator_id))
-        relevances = [0] * len(rowid_queries)
-        for modelno in modelnos:
-            kind_id_context = self._get_kind_id(
-                bdb, generator_id, modelno, colno)
-            partition_id_target = self._get_partition_id(bdb,
-                generator_id, modelno, kind_id_context, rowid_target)
-            for idx, rowid in enumerate(rowid_queries):
-                partition_id_query = self._get_partition_id(
-                    bdb, generator_id, modelno, kind_id_context, rowid)
-                if partition_id_target == partition_id_query:
-                    relevances[idx] += 1
+        partitions = self._get_partitions(bdb, generator_id)
+        models = partitions.model_indices(modelnos)
+        if len(models) < len(modelnos):
+            raise BQLError(bdb, 'Loom models have not been analyzed.')
+        rows = [
+            partitions.rowid_index.get(rowid) for rowid in rowid_queries
+        ]
+        target = partitions.rowid_index.get(rowid_target)
+        if target is None or None in rows:
+            raise BQLError(bdb, 'Loom has no partition for row %d.' % (
+                rowid_target if target is None
+                else rowid_queries[rows.index(None)],))
+        clusters = partitions.row_clusters(models, colno, [target] + rows)
+        relevances = (clusters[:, 1:] == clusters[:, :1]).sum(axis=0)
         # XXX This procedure appears to be computing the wrong thing.
-        return [xsum/float(len(modelnos)) for xsum in relevances]
+        return [xsum/float(len(modelnos)) for xsum in relevances.tolist()]
 
     def predict_confidence(self, bdb, generator_id, modelnos, rowid, colno,
             numsamples=None):
@@ -833,36 +904,46 @@ class LoomBackend(BayesDB_Backend):
 
     def logpdf_joint(self, bdb, generator_id, modelnos, rowid, targets,
             constraints):
-        population_id = bayesdb_generator_population(bdb, generator_id)
-        ordered_column_names = self._get_ordered_column_names(bdb, generator_id)
+        return self.logpdf_joint_batch(
+            bdb, generator_id, modelnos, [rowid], [targets], [constraints])[0]
 
+    def logpdf_joint_batch(self, bdb, generator_id, modelnos, rowids,
+            targets_list, constraints_list):
+        ranks = self._get_column_ranks(bdb, generator_id)
         # Pr[targets|constraints] = Pr[targets, constraints] / Pr[constraints]
         # The numerator is and_case; denominator is conditional_case.
-        and_case = OrderedDict(
-            [(a, None) for a in ordered_column_names])
-        conditional_case = OrderedDict(
-            [(a, None) for a in ordered_column_names])
-
-        for (colno, value) in targets:
-            column_name = bayesdb_variable_name(bdb, population_id, None, colno)
-            and_case[column_name] = self._convert_to_proper_stattype(
-                bdb, generator_id, colno, value)
-            conditional_case[column_name] = None
-        for (colno, value) in constraints:
-            column_name = bayesdb_variable_name(bdb, population_id, None, colno)
-            processed_value = self._convert_to_proper_stattype(
-                bdb, generator_id, colno, value)
-
-            and_case[column_name] = processed_value
-            conditional_case[column_name] = processed_value
-
-        and_case = and_case.values()
-        conditional_case = conditional_case.values()
-
+        rows = []
+        for targets, constraints in zip(targets_list, constraints_list):
+            and_case = [None] * len(ranks)
+            conditional_case = [None] * len(ranks)
+            for (colno, value) in targets:
+                and_case[ranks[colno]] = self._convert_to_proper_stattype(
+                    bdb, generator_id, colno, value)
+                conditional_case[ranks[colno]] = None
+            for (colno, value) in constraints:
+                processed_value = self._convert_to_proper_stattype(
+                    bdb, generator_id, colno, value)
+                and_case[ranks[colno]] = processed_value
+                conditional_case[ranks[colno]] = processed_value
+            rows.append(and_case)
+            rows.append(conditional_case)
+        scores = self._score_rows(bdb, generator_id, rows)
+        return [scores[i] - scores[i + 1] for i in xrange(0, len(scores), 2)]
+
+    def _score_rows(self, bdb, generator_id, rows):
+        """Return the loom score of each row in `rows`.
+
+        Each distinct row is sent to the query server only once, so that
+        e.g. the unconstrained conditional case shared by every query of
+        a batch costs a single round trip.
+        """
         server = self._get_query_server(bdb, generator_id)
-        and_score = server.score(and_case)
-        conditional_score = server.score(conditional_case)
-        return and_score - conditional_score
+        scores = {}
+        for row in rows:
+            key = tuple(row)
+            if key not in scores:
+                scores[key] = server.score(row)
+        return [scores[tuple(row)] for row in rows]
 
     def _convert_to_proper_stattype(self, bdb, generator_id, colno, value):
         """Convert a value returned by the logpdf_joint method parameters into a
@@ -871,8 +952,7 @@ class LoomBackend(BayesDB_Backend):
         """
         if value is None:
             return value
-        population_id = bayesdb_generator_population(bdb, generator_id)
-        stattype = bayesdb_variable_stattype(bdb, population_id, None, colno)
+        stattype = self._get_column_stattypes(bdb, generator_id)[colno]
         # If nominal, then return the integer code.
         if _is_nominal(stattype):
             return self._get_integer_form(bdb, generator_id, colno, value)
@@ -889,14 +969,20 @@ class LoomBackend(BayesDB_Backend):
 
     def _get_integer_form(self, bdb, generator_id, colno, string_form):
         """Return integer code representing the string."""
-        cursor = bdb.sql_execute('''
-            SELECT integer_form
-            FROM bayesdb_loom_string_encoding
-            WHERE generator_id = ?
-                AND colno = ?
-                AND string_form = ?
-        ''', (generator_id, colno, string_form,))
-        return cursor_value(cursor)
+        encoding = self._get_cache_entry(bdb, generator_id, 'string_encoding')
+        if encoding is None:
+            cursor = bdb.sql_execute('''
+                SELECT colno, string_form, integer_form
+                FROM bayesdb_loom_string_encoding
+                WHERE generator_id = ?
+            ''', (generator_id,))
+            encoding = dict(((c, s), i) for c, s, i in cursor)
+            self._set_cache_entry(
+                bdb, generator_id, 'string_encoding', encoding)
+        if (colno, string_form) not in encoding:
+            raise ValueError('Unknown category for column %d: %r'
+                % (colno, string_form))
+        return encoding[colno, string_form]
 
     def _get_is_incorporated_rowid(self, bdb, generator_id, rowid):
         """Return True iff the rowid is incorporated in the loom model."""
@@ -907,16 +993,6 @@ class LoomBackend(BayesDB_Backend):
         ''', (generator_id, rowid))
         return cursor_value(cursor) > 0
 
-    def _get_loom_rank(self, bdb, generator_id, colno):
-        """Return the loom rank (column number) for the given colno."""
-        cursor = bdb.sql_execute('''
-            SELECT rank
-            FROM bayesdb_loom_column_ordering
-            WHERE generator_id = ?
-                AND colno = ?
-        ''', (generator_id, colno,))
-        return cursor_value(cursor)
-
     def _get_ordered_column_numbers(self, bdb, generator_id):
         """Return list of columns number ordered by their loom rank."""
         cursor = bdb.sql_execute('''
@@ -927,6 +1003,28 @@ class LoomBackend(BayesDB_Backend):
         ''', (generator_id,))
         return [colno for (colno,) in cursor]
 
+    def _get_column_ranks(self, bdb, generator_id):
+        """Return dict mapping colno to loom rank, cached per generator."""
+        ranks = self._get_cache_entry(bdb, generator_id, 'column_ranks')
+        if ranks is None:
+            ranks = dict(
+                (colno, rank) for rank, colno in enumerate(
+                    self._get_ordered_column_numbers(bdb, generator_id)))
+            self._set_cache_entry(bdb, generator_id, 'column_ranks', ranks)
+        return ranks
+
+    def _get_column_stattypes(self, bdb, generator_id):
+        """Return dict mapping colno to stattype, cached per generator."""
+        stattypes = self._get_cache_entry(bdb, generator_id, 'stattypes')
+        if stattypes is None:
+            population_id = bayesdb_generator_population(bdb, generator_id)
+            stattypes = dict(
+                (colno, bayesdb_variable_stattype(
+                    bdb, population_id, None, colno))
+                for colno in self._get_column_ranks(bdb, generator_id))
+            self._set_cache_entry(bdb, generator_id, 'stattypes', stattypes)
+        return stattypes
+
     def _get_ordered_column_names(self, bdb, generator_id):
         """Return list of column names ordered by their loom rank."""
         population_id = bayesdb_generator_population(bdb, generator_id)
@@ -935,6 +1033,35 @@ class LoomBackend(BayesDB_Backend):
             for colno in self._get_ordered_column_numbers(bdb, generator_id)
         ]
 
+    # Cached kind and row partitions.
+
+    def _get_partitions(self, bdb, generator_id):
+        """Return the _Partitions of all models of the generator.
+
+        Within a transaction they are memoized in `bdb.cache`, until
+        the models change, so that they roll back with the rows they
+        were read from.
+        """
+        cache = bdb.cache
+        key = ('loom', generator_id)
+        partitions = None if cache is None else cache.get(key)
+        if partitions is None:
+            column_cursor = bdb.sql_execute('''
+                SELECT modelno, colno, kind_id
+                FROM bayesdb_loom_column_kind_partition
+                WHERE generator_id = ?
+            ''', (generator_id,))
+            row_cursor = bdb.sql_execute('''
+                SELECT modelno, kind_id, table_rowid, partition_id
+                FROM bayesdb_loom_row_kind_partition
+                WHERE generator_id = ?
+            ''', (generator_id,))
+            partitions = _Partitions(
+                column_cursor.fetchall(), row_cursor.fetchall())
+            if cache is not None:
+                cache[key] = partitions
+        return partitions
+
     # Cached QueryServer objects.
 
     def _get_query_server(self, bdb, generator_id):
@@ -1007,6 +1134,19 @@ class LoomBackend(BayesDB_Backend):
             elif key in cache[generator_id]:
                 del cache[generator_id][key]
 
+def _executemany_chunked(bdb, sql, bindings_seq):
+    """Execute `sql` on each of `bindings_seq`, INSERT_CHUNK_SIZE at a time."""
+    bindings_seq = iter(bindings_seq)
+    while True:
+        chunk = list(itertools.islice(bindings_seq, INSERT_CHUNK_SIZE))
+        if not chunk:
+            break
+        bdb.sql_executemany(sql, chunk)
+
+def _invalidate_partitions(bdb, generator_id):
+    if bdb.cache is not None:
+        bdb.cache.pop(('loom', generator_id), None)
+
 def _is_nominal(stattype):
     return casefold(stattype) in ['nominal', 'unbounded_nominal']
 
@@ -1015,3 +1155,51 @@ def _is_continuous(stattype):
 
 def _is_countable(stattype):
     return casefold(stattype) in ['counts', 'boolean']
+
+class _Partitions(object):
+    """Kind and row partitions of the models of a loom generator.
+
+    `kinds[m, c]` is the kind of the column with index `c` in the model
+    with index `m`, and `clusters[m, k, r]` is the cluster of the row
+    with index `r` within kind `k` of that model, or -1 if missing.
+    The indices are given by `modelno_index`, `colno_index`, and
+    `rowid_index`.
+    """
+
+    def __init__(self, column_partition, row_partition):
+        modelnos = sorted(set(m for m, _c, _k in column_partition))
+        colnos = sorted(set(c for _m, c, _k in column_partition))
+        rowids = sorted(set(r for _m, _k, r, _p in row_partition))
+        self.modelno_index = dict((m, i) for i, m in enumerate(modelnos))
+        self.colno_index = dict((c, i) for i, c in enumerate(colnos))
+        self.rowid_index = dict((r, i) for i, r in enumerate(rowids))
+        self.kinds = -numpy.ones((len(modelnos), len(colnos)), dtype=int)
+        for modelno, colno, kind_id in column_partition:
+            self.kinds[
+                self.modelno_index[modelno], self.colno_index[colno]] = kind_id
+        nkinds = 1 + max([k for _m, k, _r, _p in row_partition] or [0])
+        self.clusters = -numpy.ones(
+            (len(modelnos), nkinds, len(rowids)), dtype=int)
+        for modelno, kind_id, rowid, partition_id in row_partition:
+            if modelno in self.modelno_index:
+                self.clusters[self.modelno_index[modelno], kind_id,
+                    self.rowid_index[rowid]] = partition_id
+
+    def model_indices(self, modelnos):
+        """Return indices of those of `modelnos` that have partitions."""
+        return [
+            self.modelno_index[modelno] for modelno in modelnos
+            if modelno in self.modelno_index
+        ]
+
+    def row_clusters(self, models, colno, rows):
+        """Return the clusters of `rows` in the kind of `colno`.
+
+        The result is an array indexed by position in `models` and in
+        `rows`.
+        """
+        models = numpy.asarray(models, dtype=int)
+        kinds = self.kinds[models, self.colno_index[colno]]
+        return self.clusters[
+            models[:, numpy.newaxis], kinds[:, numpy.newaxis],
+            numpy.asarray(rows, dtype=int)[numpy.newaxis, :]]
@@ -25,6 +25,7 @@ interface for the NIG-Normal model.
 """
 
 import math
+import numpy
 import random
 
 import bayeslite.backend
@@ -80,6 +81,16 @@ CREATE TABLE bayesdb_nig_normal_deviation (
 );
 '''
 
+nig_normal_schema_3 = '''
+UPDATE bayesdb_backend SET version = 3 WHERE name = 'nig_normal';
+
+CREATE TABLE bayesdb_nig_normal_rowid (
+    generator_id    INTEGER NOT NULL PRIMARY KEY
+                        REFERENCES bayesdb_generator(id),
+    last_rowid      INTEGER NOT NULL
+);
+'''
+
 class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
     """Normal-Inverse-Gamma-Normal backend for BayesDB.
 
@@ -95,6 +106,7 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
     def __init__(self, hypers=(0, 1, 1, 1), seed=0):
         self.hypers = hypers
         self.prng = random.Random(seed)
+        self.np_prng = numpy.random.RandomState(seed)
 
     def name(self): return 'nig_normal'
 
@@ -107,7 +119,16 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
             if version == 1:
                 bdb.sql_execute(nig_normal_schema_2)
                 version = 2
-            if version != 2:
+            if version == 2:
+                bdb.sql_execute(nig_normal_schema_3)
+                # Existing generators count every row of their table.
+                cursor = bdb.sql_execute('''
+                    SELECT id FROM bayesdb_generator WHERE backend = ?
+                ''', (self.name(),))
+                for (generator_id,) in cursor.fetchall():
+                    _insert_last_rowid(bdb, generator_id)
+                version = 3
+            if version != 3:
                 raise BQLError(bdb, 'NIG-Normal already installed'
                     ' with unknown schema version: %d' % (version,))
 
@@ -139,6 +160,7 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
                 'sum': xsum,
                 'sumsq': sumsq,
             })
+        _insert_last_rowid(bdb, generator_id)
 
         # XXX Make the schema a little more flexible.
         if schema == [[]]:
@@ -167,8 +189,10 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
                         observed_colno)
                     VALUES (?, ?, ?, ?)
             ''', (population_id, generator_id, dev_colno, obs_colno))
+        _invalidate_params(bdb, generator_id)
 
     def drop_generator(self, bdb, generator_id):
+        _invalidate_params(bdb, generator_id)
         with bdb.savepoint():
             self.drop_models(bdb, generator_id)
             delete_columns_sql = '''
@@ -181,6 +205,10 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
                     WHERE generator_id = ?
             '''
             bdb.sql_execute(delete_deviations_sql, (generator_id,))
+            delete_rowid_sql = '''
+                DELETE FROM bayesdb_nig_normal_rowid WHERE generator_id = ?
+            '''
+            bdb.sql_execute(delete_rowid_sql, (generator_id,))
 
     def initialize_models(self, bdb, generator_id, modelnos):
         population_id = core.bayesdb_generator_population(bdb, generator_id)
@@ -194,6 +222,7 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
             insert_sample_sql)
 
     def drop_models(self, bdb, generator_id, modelnos=None):
+        _invalidate_params(bdb, generator_id)
         with bdb.savepoint():
             if modelnos is None:
                 delete_models_sql = '''
@@ -239,18 +268,70 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
         self._set_models(bdb, population_id, generator_id, modelnos,
             update_sample_sql)
 
+    def incorporate_rows(self, bdb, generator_id, iterations=None,
+            max_seconds=None):
+        # New rows are those past the last one counted in the
+        # sufficient statistics, to which their own are added.
+        population_id = core.bayesdb_generator_population(bdb, generator_id)
+        table = core.bayesdb_population_table(bdb, population_id)
+        update_sql = '''
+            UPDATE bayesdb_nig_normal_column
+                SET count = count + :count, sum = sum + :sum,
+                    sumsq = sumsq + :sumsq
+                WHERE generator_id = :generator_id
+                    AND colno = :colno
+        '''
+        with bdb.savepoint():
+            last_rowid = cursor_value(bdb.sql_execute('''
+                SELECT last_rowid FROM bayesdb_nig_normal_rowid
+                    WHERE generator_id = ?
+            ''', (generator_id,)))
+            rowids = [rowid for (rowid,) in bdb.sql_execute('''
+                SELECT _rowid_ FROM %s WHERE _rowid_ > ?
+                    ORDER BY _rowid_ ASC
+            ''' % (sqlite3_quote_name(table),), (last_rowid,))]
+            if not rowids:
+                return rowids
+            colnos = [colno for (colno,) in bdb.sql_execute('''
+                SELECT colno FROM bayesdb_nig_normal_column
+                    WHERE generator_id = ?
+                    ORDER BY colno ASC
+            ''', (generator_id,))]
+            for colno in colnos:
+                column_name = core.bayesdb_variable_name(
+                    bdb, population_id, generator_id, colno)
+                (count, xsum, sumsq) = data_suff_stats(
+                    bdb, table, column_name, last_rowid)
+                bdb.sql_execute(update_sql, {
+                    'generator_id': generator_id,
+                    'colno': colno,
+                    'count': count,
+                    'sum': xsum,
+                    'sumsq': sumsq,
+                })
+            bdb.sql_execute('''
+                UPDATE bayesdb_nig_normal_rowid SET last_rowid = ?
+                    WHERE generator_id = ?
+            ''', (rowids[-1], generator_id))
+            # One step reaches the posterior, as in analyze_models.
+            if iterations or max_seconds:
+                self.analyze_models(bdb, generator_id)
+        return rowids
+
     def _set_models(self, bdb, population_id, generator_id, modelnos, sql):
         collect_stats_sql = '''
             SELECT colno, count, sum, sumsq FROM
                 bayesdb_nig_normal_column WHERE generator_id = ?
         '''
+        _invalidate_params(bdb, generator_id)
         with bdb.savepoint():
             cursor = bdb.sql_execute(collect_stats_sql, (generator_id,))
+            bindings = []
             for (colno, count, xsum, sumsq) in cursor:
                 stats = (count, xsum, sumsq)
                 for modelno in modelnos:
                     (mu, sig) = self._gibbs_step_params(self.hypers, stats)
-                    bdb.sql_execute(sql, {
+                    bindings.append({
                         'population_id': population_id,
                         'generator_id': generator_id,
                         'colno': colno,
@@ -258,6 +339,7 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
                         'mu': mu,
                         'sigma': sig,
                     })
+            bdb.sql_executemany(sql, bindings)
 
     def _modelnos(self, bdb, generator_id):
         modelnos_sql = '''
@@ -278,90 +360,73 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
         # sigma.  This method does not expose the inter-column
         # dependence induced by approximating the true distribution
         # with a finite number of full-table models.
-        with bdb.savepoint():
-            if modelnos is None:
-                modelnos = self._modelnos(bdb, generator_id)
-            modelno = self.prng.choice(modelnos)
-            (mus, sigmas) = self._model_mus_sigmas(bdb, generator_id, modelno)
-            return [[self._simulate_1(bdb, generator_id, mus, sigmas, colno)
-                     for colno in targets]
-                    for _ in range(num_samples)]
-
-    def _simulate_1(self, bdb, generator_id, mus, sigmas, colno):
-        if colno < 0:
-            dev_colno = colno
-            cursor = bdb.sql_execute('''
-                SELECT observed_colno FROM bayesdb_nig_normal_deviation
-                    WHERE generator_id = ? AND deviation_colno = ?
-            ''', (generator_id, dev_colno))
-            obs_colno = cursor_value(cursor)
-            return self.prng.gauss(0, sigmas[obs_colno])
-        else:
-            return self.prng.gauss(mus[colno], sigmas[colno])
-
-    def _model_mus_sigmas(self, bdb, generator_id, modelno):
-        # TODO Filter in the database by the columns I will actually use?
-        # TODO Cache the results using bdb.cache?
-        params_sql = '''
-            SELECT colno, mu, sigma FROM bayesdb_nig_normal_model
-                WHERE generator_id = ? AND modelno = ?
-        '''
-        cursor = bdb.sql_execute(params_sql, (generator_id, modelno))
-        mus = {}
-        sigmas = {}
-        for (colno, mu, sigma) in cursor:
-            assert colno not in mus
-            mus[colno] = mu
-            assert colno not in sigmas
-            sigmas[colno] = sigma
-        return (mus, sigmas)
+        params = self._params(bdb, generator_id)
+        if modelnos is None:
+            modelnos = params.modelnos
+        modelno = self.prng.choice(modelnos)
+        mus, sigmas = params.columns(targets, [modelno])
+        return self.np_prng.normal(
+            mus, sigmas, size=(num_samples, len(targets))).tolist()
 
     def logpdf_joint(self, bdb, generator_id, modelnos, rowid, targets,
-            _constraints,):
+            constraints):
+        return self.logpdf_joint_batch(
+            bdb, generator_id, modelnos, [rowid], [targets], [constraints])[0]
+
+    def logpdf_joint_batch(self, bdb, generator_id, modelnos, rowids,
+            targets_list, constraints_list):
         # Note: The constraints are irrelevant for the same reason as
-        # in simulate_joint.
-        (all_mus, all_sigmas) = self._all_mus_sigmas(bdb, generator_id)
-        def model_log_pdf(modelno):
-            mus = all_mus[modelno]
-            sigmas = all_sigmas[modelno]
-            def logpdf_1((colno, x)):
-                return self._logpdf_1(bdb, generator_id, mus, sigmas, colno, x)
-            return sum(map(logpdf_1, targets))
+        # in simulate_joint.  Score each block of queries sharing the
+        # same target columns in one array computation over all models.
+        params = self._params(bdb, generator_id)
         # XXX Ignore modelnos and aggregate over all of them.
-        modelwise = [model_log_pdf(m) for m in sorted(all_mus.keys())]
-        return logmeanexp(modelwise)
-
-    def _logpdf_1(self, bdb, generator_id, mus, sigmas, colno, x):
-        if colno < 0:
-            dev_colno = colno
-            cursor = bdb.sql_execute('''
-                SELECT observed_colno FROM bayesdb_nig_normal_deviation
-                    WHERE generator_id = ? AND deviation_colno = ?
-            ''', (generator_id, dev_colno))
-            obs_colno = cursor_value(cursor)
-            return logpdf_gaussian(x, 0, sigmas[obs_colno])
-        else:
-            return logpdf_gaussian(x, mus[colno], sigmas[colno])
-
-    def _all_mus_sigmas(self, bdb, generator_id):
+        if len(params.modelnos) == 0:
+            return [logmeanexp([]) for _targets in targets_list]
+        blocks = {}
+        for i, targets in enumerate(targets_list):
+            colnos = tuple(colno for colno, _value in targets)
+            blocks.setdefault(colnos, []).append(i)
+        results = [None] * len(targets_list)
+        for colnos, indices in blocks.iteritems():
+            mus, sigmas = params.columns(colnos)
+            xs = numpy.array([
+                [value for _colno, value in targets_list[i]]
+                for i in indices
+            ], dtype=float).reshape((len(indices), len(colnos)))
+            deviations = (xs[:, numpy.newaxis, :] - mus) / sigmas
+            logpdfs = - numpy.log(sigmas) - HALF_LOG2PI \
+                - 0.5 * deviations * deviations
+            modelwise = numpy.sum(logpdfs, axis=2)
+            for i, row in zip(indices, modelwise):
+                results[i] = logmeanexp(row.tolist())
+        return results
+
+    def _params(self, bdb, generator_id):
+        """Return the :class:`_Params` of the models of `generator_id`.
+
+        Within a transaction they are memoized in `bdb.cache`, until
+        the models or deviations change.
+        """
+        cache = bdb.cache
+        key = ('nig_normal', generator_id)
+        if cache is not None and key in cache:
+            return cache[key]
         params_sql = '''
-            SELECT colno, modelno, mu, sigma FROM bayesdb_nig_normal_model
-                WHERE generator_id = :generator_id
-        ''' # TODO Filter in the database by the columns I will actually use?
+            SELECT modelno, colno, mu, sigma FROM bayesdb_nig_normal_model
+                WHERE generator_id = ?
+        '''
+        deviations_sql = '''
+            SELECT deviation_colno, observed_colno
+                FROM bayesdb_nig_normal_deviation
+                WHERE generator_id = ?
+        '''
         with bdb.savepoint():
-            cursor = bdb.sql_execute(params_sql, (generator_id,))
-            all_mus = {}
-            all_sigmas = {}
-            for (colno, modelno, mu, sigma) in cursor:
-                if modelno not in all_mus:
-                    all_mus[modelno] = {}
-                if modelno not in all_sigmas:
-                    all_sigmas[modelno] = {}
-                assert colno not in all_mus[modelno]
-                all_mus[modelno][colno] = mu
-                assert colno not in all_sigmas[modelno]
-                all_sigmas[modelno][colno] = sigma
-            return (all_mus, all_sigmas)
+            params = _Params(
+                bdb.sql_execute(params_sql, (generator_id,)).fetchall(),
+                bdb.sql_execute(deviations_sql, (generator_id,)).fetchall())
+        if cache is not None:
+            cache[key] = params
+        return params
 
     def column_dependence_probability(self, bdb, generator_id, modelnos, colno0,
             colno1):
@@ -382,11 +447,12 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
             numsamples=None):
         if colno < 0:
             return (0, 1)       # deviation of mode from mean is zero
+        params = self._params(bdb, generator_id)
         if modelnos is None:
-            modelnos = self._modelnos(bdb, generator_id)
+            modelnos = params.modelnos
         modelno = self.prng.choice(modelnos)
-        mus, _sigmas = self._model_mus_sigmas(bdb, generator_id, modelno)
-        return (mus[colno], 1.)
+        mus, _sigmas = params.columns([colno], [modelno])
+        return (mus[0, 0], 1.)
 
     def insert(self, bdb, generator_id, item):
         (_, colno, value) = item
@@ -439,6 +505,62 @@ class NIGNormalBackend(bayeslite.backend.BayesDB_Backend):
     def _inv_gamma(self, shape, scale):
         return float(scale) / self.prng.gammavariate(shape, 1.0)
 
+class _Params(object):
+    """Parameters mu and sigma of the models of an NIG-Normal generator.
+
+    `mus[m, c]` and `sigmas[m, c]` are the parameters of the column
+    with index `c` in `colno_index` in the model with index `m` in
+    `modelnos`.  `observed` maps each deviation to the colno of the
+    variable it observes.
+    """
+
+    def __init__(self, params, deviations):
+        self.modelnos = sorted(set(m for m, _c, _mu, _sigma in params))
+        colnos = sorted(set(c for _m, c, _mu, _sigma in params))
+        self.model_index = dict((m, i) for i, m in enumerate(self.modelnos))
+        self.colno_index = dict((c, i) for i, c in enumerate(colnos))
+        self.observed = dict(deviations)
+        shape = (len(self.modelnos), len(colnos))
+        self.mus = numpy.empty(shape)
+        self.sigmas = numpy.empty(shape)
+        for modelno, colno, mu, sigma in params:
+            i = self.model_index[modelno]
+            j = self.colno_index[colno]
+            self.mus[i, j] = mu
+            self.sigmas[i, j] = sigma
+
+    def columns(self, colnos, modelnos=None):
+        """Return arrays of mu and sigma for `colnos` in `modelnos`.
+
+        The arrays are indexed by position in `modelnos`, or all
+        models if None, and in `colnos`.  Deviations are centred at
+        zero, with the scale of the variable they observe.
+        """
+        if modelnos is None:
+            models = slice(None)
+        else:
+            models = [self.model_index[modelno] for modelno in modelnos]
+        columns = [
+            self.colno_index[self.observed[colno] if colno < 0 else colno]
+            for colno in colnos
+        ]
+        mus = self.mus[models][:, columns]
+        mus[:, numpy.array([colno < 0 for colno in colnos], dtype=bool)] = 0
+        sigmas = self.sigmas[models][:, columns]
+        return (mus, sigmas)
+
+def _insert_last_rowid(bdb, generator_id):
+    # Record that the generator counts every row now in its table.
+    table = core.bayesdb_generator_table(bdb, generator_id)
+    bdb.sql_execute('''
+        INSERT INTO bayesdb_nig_normal_rowid (generator_id, last_rowid)
+            SELECT ?, COALESCE(MAX(_rowid_), 0) FROM %s
+    ''' % (sqlite3_quote_name(table),), (generator_id,))
+
+def _invalidate_params(bdb, generator_id):
+    if bdb.cache is not None:
+        bdb.cache.pop(('nig_normal', generator_id), None)
+
 HALF_LOG2PI = 0.5 * math.log(2 * math.pi)
 
 def logpdf_gaussian(x, mu, sigma):
@@ -447,22 +569,27 @@ def logpdf_gaussian(x, mu, sigma):
         - (0.5 * deviation * deviation / (sigma * sigma))
     return ans
 
-def data_suff_stats(bdb, table, column_name):
-    # This is incorporate/remove in bulk, reading from the database.
+def data_suff_stats(bdb, table, column_name, last_rowid=None):
+    # This is incorporate/remove in bulk, reading from the database,
+    # of the rows past last_rowid if given.  Missing values are not
+    # observations, so do not count them, and any other value must be
+    # a number.
     qt = sqlite3_quote_name(table)
     qcn = sqlite3_quote_name(column_name)
-    # TODO Do this computation inside the database?
-    gather_data_sql = '''
-        SELECT %s FROM %s
-    ''' % (qcn, qt)
-    cursor = bdb.sql_execute(gather_data_sql)
-    count = 0
-    xsum = 0
-    sumsq = 0
-    for (item,) in cursor:
-        count += 1
-        xsum += item
-        sumsq += item * item
+    if last_rowid is None:
+        where, bindings = '', ()
+    else:
+        where, bindings = 'WHERE _rowid_ > ?', (last_rowid,)
+    gather_stats_sql = '''
+        SELECT COUNT(%s), TOTAL(%s), TOTAL(%s * %s),
+                MIN(CASE WHEN typeof(%s) IN ('text', 'blob') THEN %s END)
+            FROM %s %s
+    ''' % (qcn, qcn, qcn, qcn, qcn, qcn, qt, where)
+    cursor = bdb.sql_execute(gather_stats_sql, bindings)
+    (count, xsum, sumsq, nonnumeric) = cursor.fetchall()[0]
+    if nonnumeric is not None:
+        raise BQLError(bdb, 'NIG-Normal cannot model non-numeric value'
+            ' of %s: %r' % (repr(column_name), nonnumeric))
     return (count, xsum, sumsq)
 
 def posterior_hypers(hypers, stats):
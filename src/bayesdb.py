@@ -19,6 +19,9 @@ import contextlib
 import numpy.random
 import random
 import struct
+import threading
+
+from multiprocessing.pool import ThreadPool
 
 import bayeslite.bql as bql
 import bayeslite.bqlfn as bqlfn
@@ -30,12 +33,14 @@ import bayeslite.txn as txn
 import bayeslite.weakprng as weakprng
 
 from bayeslite.backend import bayesdb_register_builtin_backends
+from bayeslite.profiler import BayesDBProfiler
+from bayeslite.util import LRUCache
 from bayeslite.util import cursor_value
 
 bayesdb_open_cookie = 0xed63e2c26d621a5b5146a334849d43f0
 
 def bayesdb_open(pathname=None, builtin_backends=None, seed=None,
-        version=None, compatible=None):
+        version=None, compatible=None, check=None):
     """Open the BayesDB in the file at `pathname`.
 
     If there is no file at `pathname`, it is automatically created.
@@ -51,11 +56,19 @@ def bayesdb_open(pathname=None, builtin_backends=None, seed=None,
     bayeslite cannot read it.  If `compatible` is `True`,
     `bayesdb_open` will not incompatibly change the format of the
     database (but some newer bayesdb features may not work).
+
+    `check` is the level of integrity check to make on opening the
+    database: ``'none'``, ``'quick'`` for SQLite's ``PRAGMA
+    quick_check``, or ``'full'``, the default, for ``PRAGMA
+    integrity_check``; both also check foreign keys.  A successful
+    check of a database file is recorded in it, and not repeated at
+    the same or a lower level until the file changes.  If the check
+    fails, `bayesdb_open` raises :exc:`IOError`.
     """
     if builtin_backends is None:
         builtin_backends = True
     bdb = BayesDB(bayesdb_open_cookie, pathname=pathname, seed=seed,
-        version=version, compatible=compatible)
+        version=version, compatible=compatible, check=check)
     if builtin_backends:
         bayesdb_register_builtin_backends(bdb)
     return bdb
@@ -73,7 +86,7 @@ class BayesDB(object):
     """
 
     def __init__(self, cookie, pathname=None, seed=None, version=None,
-            compatible=None):
+            compatible=None, check=None):
         if cookie != bayesdb_open_cookie:
             raise ValueError('Do not construct BayesDB objects directly!')
         if pathname is None:
@@ -85,8 +98,21 @@ class BayesDB(object):
         self.backends = {}
         self.tracer = None
         self.sql_tracer = None
+        self.profiler = None
         self.temptable = 0
         self.qid = 0
+        self.batch_size = None  # rows per batch of row-wise BQL functions
+        self.generator_threads = None   # threads for per-generator calls
+        self._generator_pool = None
+        self._generator_pool_size = None
+        self._thread_local = threading.local()
+        # Taken by worker threads in turn to use the SQLite connection.
+        self._connection_lock = threading.RLock()
+        # Parsed phrases by BQL text, and compiled SQL by BQL text and
+        # batch size; see bql.execute_phrase.
+        self.phrase_cache = LRUCache(256)
+        self.sql_cache = LRUCache(256)
+        self._sql_cache_version = None
         if seed is None:
             seed = struct.pack('<QQQQ', 0, 0, 0, 0)
         self._prng = weakprng.weakprng(seed)
@@ -97,7 +123,7 @@ class BayesDB(object):
 
         # Set up or check the permanent schema on disk.
         schema.bayesdb_install_schema(self, version=version,
-            compatible=compatible)
+            compatible=compatible, check=check)
 
         # Set up the in-memory BQL functions and virtual tables that
         # need not have storage on disk.
@@ -105,6 +131,8 @@ class BayesDB(object):
         self._sqlite3.createmodule('bql_mutinf', bqlvtab.MutinfModule(self))
         self._sqlite3.cursor().execute(
             'create virtual table temp.bql_mutinf using bql_mutinf')
+        self._sqlite3.createmodule('bql_simulate',
+            bqlvtab.SimulateModule(self))
 
         # Set up math utilities.
         bqlmath.bayesdb_install_bqlmath(self._sqlite3, self)
@@ -122,6 +150,11 @@ class BayesDB(object):
     def close(self):
         """Close the database.  Further use is not allowed."""
         assert self._txn_depth == 0, "pending BayesDB transactions"
+        if self._generator_pool is not None:
+            self._generator_pool.close()
+            self._generator_pool.join()
+            self._generator_pool = None
+            self._generator_pool_size = None
         self._sqlite3.close()
         self._sqlite3 = None
 
@@ -133,7 +166,8 @@ class BayesDB(object):
         initialized from the seed supplied to :func:`bayesdb_open`.
         Use it to conserve reproducibility of results.
         """
-        return self._py_prng
+        py_prng = getattr(self._thread_local, 'py_prng', None)
+        return self._py_prng if py_prng is None else py_prng
 
     @property
     def np_prng(self):
@@ -143,12 +177,85 @@ class BayesDB(object):
         initialized from the seed supplied to :func:`bayesdb_open`.
         Use it to conserve reproducibility of results.
         """
-        return self._np_prng
+        np_prng = getattr(self._thread_local, 'np_prng', None)
+        return self._np_prng if np_prng is None else np_prng
 
     @property
     def cache(self):
         return self._cache
 
+    def _generator_executor(self):
+        """Return a thread pool for per-generator calls, or None.
+
+        None means per-generator calls should be made serially: either
+        `generator_threads` is not set, or we are already in a worker
+        thread or in a SQL callback, where the SQLite connection is
+        busy.
+        """
+        if not self.generator_threads or \
+                getattr(self._thread_local, 'serial', False):
+            return None
+        if self._generator_pool is None or \
+                self._generator_pool_size != self.generator_threads:
+            if self._generator_pool is not None:
+                self._generator_pool.close()
+            self._generator_pool = ThreadPool(self.generator_threads)
+            self._generator_pool_size = self.generator_threads
+        return self._generator_pool
+
+    @contextlib.contextmanager
+    def _serially(self, seed=None, worker=False):
+        """Make per-generator calls serially in this thread for a while.
+
+        If `seed` is not None, also use PRNGs seeded from it in place of
+        `py_prng` and `np_prng` in this thread.
+
+        If `worker` is true, this is a worker thread of
+        `_generator_executor`: it must take its turn with the SQLite
+        connection, since other workers may be using it too.  See
+        `_connection`.
+        """
+        local = self._thread_local
+        saved = (
+            getattr(local, 'serial', False),
+            getattr(local, 'worker', False),
+            getattr(local, 'py_prng', None),
+            getattr(local, 'np_prng', None),
+        )
+        local.serial = True
+        local.worker = saved[1] or worker
+        if seed is not None:
+            local.py_prng = random.Random(seed)
+            local.np_prng = numpy.random.RandomState(seed)
+        try:
+            yield
+        finally:
+            local.serial, local.worker, local.py_prng, local.np_prng = saved
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """Hold the SQLite connection for a while, if in a worker thread.
+
+        The thread that hands per-generator calls to the workers waits
+        for them without touching the connection, so only the workers
+        need take turns.  A worker holds the connection for the whole
+        of a savepoint or transaction, and for each statement until it
+        has read all the rows; computation outside those runs in
+        parallel.
+        """
+        if getattr(self._thread_local, 'worker', False):
+            with self._connection_lock:
+                yield
+        else:
+            yield
+
+    def _cursor(self, cursor):
+        # A worker must read all its rows before it lets go of the
+        # connection.
+        if getattr(self._thread_local, 'worker', False):
+            return bql.BayesDBRowsCursor(cursor)
+        return cursor
+
     def trace(self, tracer):
         """Trace execution of BQL queries.
 
@@ -215,6 +322,48 @@ class BayesDB(object):
         assert self.sql_tracer == tracer
         self.sql_tracer = None
 
+    def profile(self, profiler=None):
+        """Profile queries executed in the database.
+
+        Establish `profiler`, or a new
+        :class:`~bayeslite.profiler.BayesDBProfiler` if it is None, to
+        record the time spent parsing and compiling BQL, executing
+        each SQL statement, and calling each BQL function and each
+        backend method, and return it.
+
+        Only one profiler can be established at a time.  To remove it,
+        use :meth:`~BayesDB.unprofile`.
+        """
+        assert self.profiler is None
+        if profiler is None:
+            profiler = BayesDBProfiler()
+        self.profiler = profiler
+        def sql_profile(statement, nanoseconds):
+            profiler.record('sql', statement, nanoseconds / 1e9)
+        self._sqlite3.setprofile(sql_profile)
+        return profiler
+
+    def unprofile(self, profiler):
+        """Stop profiling queries executed in the database.
+
+        `profiler` must have been previously established with
+        :meth:`~BayesDB.profile`.
+        """
+        assert self.profiler == profiler
+        self._sqlite3.setprofile(None)
+        self.profiler = None
+
+    @contextlib.contextmanager
+    def _profiling(self, category, name):
+        """Record the time of the body of a `with` statement, if
+        profiling."""
+        profiler = self.profiler
+        if profiler is None:
+            yield
+        else:
+            with profiler.timing(category, name):
+                yield
+
     def execute(self, string, bindings=None):
         """Execute a BQL query and return a cursor for its results.
 
@@ -266,6 +415,31 @@ class BayesDB(object):
             raise
 
     def _do_execute(self, string, bindings):
+        phrase = self.phrase_cache.get(string)
+        if phrase is None:
+            with self._profiling('parse', 'parse_bql_string'):
+                phrase = self._parse_phrase(string)
+            self.phrase_cache.put(string, phrase)
+        # Compiled SQL may be stale if the SQL schema has changed, or if
+        # another connection has changed the database, since we last
+        # looked.
+        # Run each PRAGMA to completion, so that no statement is left
+        # active to lock tables while the phrase executes.
+        with self._connection():
+            cursor = self._sqlite3.cursor()
+            schema_version = \
+                cursor_value(cursor.execute('PRAGMA schema_version'))
+            data_version = cursor_value(cursor.execute('PRAGMA data_version'))
+            if (schema_version, data_version) != self._sql_cache_version:
+                self.sql_cache.clear()
+                self._sql_cache_version = (schema_version, data_version)
+            cursor = bql.execute_phrase(
+                self, phrase, bindings, cache_key=string)
+            if cursor is None:
+                return self._empty_cursor
+            return self._cursor(cursor)
+
+    def _parse_phrase(self, string):
         phrases = parse.parse_bql_string(string)
         phrase = None
         try:
@@ -278,8 +452,7 @@ class BayesDB(object):
             pass
         else:
             raise ValueError('>1 phrase in string')
-        cursor = bql.execute_phrase(self, phrase, bindings)
-        return self._empty_cursor if cursor is None else cursor
+        return phrase
 
     def sql_execute(self, string, bindings=None):
         """Execute a SQL query on the underlying SQLite database.
@@ -298,9 +471,30 @@ class BayesDB(object):
             self.sql_tracer, self._do_sql_execute, string, bindings)
 
     def _do_sql_execute(self, string, bindings):
-        cursor = self._sqlite3.cursor()
-        cursor.execute(string, bindings)
-        return bql.BayesDBCursor(self, cursor)
+        with self._connection():
+            cursor = self._sqlite3.cursor()
+            cursor.execute(string, bindings)
+            return self._cursor(bql.BayesDBCursor(self, cursor))
+
+    def sql_executemany(self, string, bindings_seq):
+        """Execute a SQL query once for each of a sequence of bindings.
+
+        The argument `string` is as for :meth:`~BayesDB.sql_execute`.
+        The argument `bindings_seq` is an iterable of sequences or
+        dictionaries of bindings for parameters in the query.
+
+        This is much faster than calling :meth:`~BayesDB.sql_execute`
+        repeatedly, e.g. to insert many rows.  The query is traced
+        only once, with the sequence of bindings.
+        """
+        return self._maybe_trace(
+            self.sql_tracer, self._do_sql_executemany, string, bindings_seq)
+
+    def _do_sql_executemany(self, string, bindings_seq):
+        with self._connection():
+            cursor = self._sqlite3.cursor()
+            cursor.executemany(string, bindings_seq)
+            return self._cursor(bql.BayesDBCursor(self, cursor))
 
     @contextlib.contextmanager
     def savepoint(self):
@@ -326,7 +520,7 @@ class BayesDB(object):
                 bdb.execute('CREATE GENERATOR foo ...')
             # foo will have been dropped and re-created.
         """
-        with txn.bayesdb_savepoint(self):
+        with self._connection(), txn.bayesdb_savepoint(self):
             yield
 
     @contextlib.contextmanager
@@ -336,7 +530,7 @@ class BayesDB(object):
         This may be used to compute hypotheticals -- the bdb is
         guaranteed to remain unmodified afterward.
         """
-        with txn.bayesdb_savepoint_rollback(self):
+        with self._connection(), txn.bayesdb_savepoint_rollback(self):
             yield
 
     @contextlib.contextmanager
@@ -347,7 +541,7 @@ class BayesDB(object):
         nesting.  Parsed metadata and models are cached in Python
         during a savepoint.
         """
-        with txn.bayesdb_transaction(self):
+        with self._connection(), txn.bayesdb_transaction(self):
             yield
 
     def temp_table_name(self):
@@ -357,7 +551,8 @@ class BayesDB(object):
 
     def last_insert_rowid(self):
         """Return the rowid of the row most recently inserted."""
-        return self._sqlite3.last_insert_rowid()
+        with self._connection():
+            return self._sqlite3.last_insert_rowid()
 
     def reconnect(self):
         """Reconnecting may sometimes be necessary, e.g. before a DROP TABLE"""
@@ -375,7 +570,8 @@ class BayesDB(object):
         This may return unexpected results after a statement that is not an
         INSERT, DELETE, or UPDATE.
         """
-        return self._sqlite3.changes()
+        with self._connection():
+            return self._sqlite3.changes()
 
 class IBayesDBTracer(object):
     """BayesDB articulated tracing interface.
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+
+"""Benchmarks of BQL queries and backends.
+
+:func:`run_benchmarks` times reading a reproducible synthetic table,
+creating a population and generator for it, initializing and
+analyzing models, and estimating, simulating, and inferring from
+them, for each of the ``cgpm``, ``nig_normal``, and ``std_normal``
+backends.  The results are JSON-compatible, so that runs of different
+versions of bayeslite can be saved and diffed::
+
+    python -m bayeslite.bench --rows 10000 --columns 20 -o bench.json
+"""
+
+from bayeslite.bench.population import synthetic_table
+from bayeslite.bench.suite import BACKENDS
+from bayeslite.bench.suite import STAGES
+from bayeslite.bench.suite import dump_benchmarks
+from bayeslite.bench.suite import run_benchmarks
+
+__all__ = [
+    'BACKENDS',
+    'STAGES',
+    'dump_benchmarks',
+    'run_benchmarks',
+    'synthetic_table',
+]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+
+import argparse
+import sys
+
+from bayeslite.bench.population import STATTYPES
+from bayeslite.bench.suite import BACKENDS
+from bayeslite.bench.suite import dump_benchmarks
+from bayeslite.bench.suite import run_benchmarks
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m bayeslite.bench')
+    parser.add_argument('-b', '--backend', type=str, action='append',
+                        choices=sorted(BACKENDS), default=None,
+                        help="Backend to benchmark; may be repeated."
+                        " Default: all.")
+    parser.add_argument('-r', '--rows', type=int, default=1000,
+                        help="Number of rows of the synthetic table.")
+    parser.add_argument('-c', '--columns', type=int, default=10,
+                        help="Number of columns of the synthetic table.")
+    parser.add_argument('-t', '--stattypes', type=str,
+                        default=','.join(STATTYPES),
+                        help="Comma-separated stattypes, cycled over the"
+                        " columns.")
+    parser.add_argument('-m', '--models', type=int, default=4,
+                        help="Number of models to initialize.")
+    parser.add_argument('-i', '--iterations', type=int, default=2,
+                        help="Number of iterations of analysis.")
+    parser.add_argument('--pairwise-rows', type=int, default=100,
+                        help="Number of pairs of rows to compare.")
+    parser.add_argument('--simulate-rows', type=int, default=1000,
+                        help="Number of rows to simulate.")
+    parser.add_argument('-n', '--repeat', type=int, default=1,
+                        help="Number of repetitions; the best time counts.")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="Seed for the table and the BayesDB.")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="File to write the JSON results to."
+                        " Default: standard output.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = run_benchmarks(
+        backends=args.backend,
+        rows=args.rows,
+        columns=args.columns,
+        stattypes=args.stattypes.split(','),
+        models=args.models,
+        iterations=args.iterations,
+        pairwise_rows=args.pairwise_rows,
+        simulate_rows=args.simulate_rows,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    if args.output is None:
+        dump_benchmarks(results, sys.stdout)
+    else:
+        with open(args.output, 'w') as f:
+            dump_benchmarks(results, f)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
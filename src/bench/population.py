@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Reproducible synthetic populations for benchmarks.
+
+The columns of a synthetic table are split into `views` groups of
+dependent columns.  Each row belongs to one of `clusters` clusters in
+each view, and a cell is drawn from its column's distribution in the
+row's cluster: a Gaussian for numerical columns, a categorical over
+`categories` symbols for nominal columns.  This is the structure that
+CrossCat models, so analysis has something to find.
+"""
+
+import csv
+
+from StringIO import StringIO
+
+import numpy
+
+STATTYPES = ('numerical', 'nominal')
+
+def synthetic_table(rows, columns, stattypes=STATTYPES, seed=0, views=2,
+        clusters=3, categories=5):
+    """Return a synthetic table as `(names, stattypes, data)`.
+
+    `stattypes` is cycled to give the statistical types of the
+    `columns` columns, which are named ``c0``, ``c1``, ....  `data`
+    is a list of `rows` rows, each a list of values.  The same
+    arguments always yield the same table.
+    """
+    for stattype in stattypes:
+        if stattype not in STATTYPES:
+            raise ValueError('Unknown stattype for synthetic table: %r'
+                % (stattype,))
+    prng = numpy.random.RandomState(seed)
+    names = ['c%d' % (i,) for i in xrange(columns)]
+    column_stattypes = [stattypes[i % len(stattypes)] for i in xrange(columns)]
+    view_of_column = [i % views for i in xrange(columns)]
+    assignments = prng.randint(clusters, size=(rows, views))
+    data_by_column = []
+    for i, stattype in enumerate(column_stattypes):
+        cluster = assignments[:, view_of_column[i]]
+        if stattype == 'numerical':
+            means = prng.normal(0, 10, size=clusters)
+            values = prng.normal(means[cluster], 1).tolist()
+        else:
+            weights = prng.dirichlet([1.] * categories, size=clusters)
+            symbols = numpy.zeros(rows, dtype=int)
+            for k in xrange(clusters):
+                members = cluster == k
+                symbols[members] = prng.choice(
+                    categories, size=numpy.sum(members), p=weights[k])
+            values = ['s%d' % (symbol,) for symbol in symbols.tolist()]
+        data_by_column.append(values)
+    data = [list(row) for row in zip(*data_by_column)]
+    return (names, column_stattypes, data)
+
+def synthetic_csv(names, data):
+    """Return a file object reading `data` as CSV with header `names`."""
+    f = StringIO()
+    writer = csv.writer(f)
+    writer.writerow(names)
+    for row in data:
+        writer.writerow([repr(v) if isinstance(v, float) else v for v in row])
+    f.seek(0)
+    return f
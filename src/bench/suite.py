@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Time the stages of a BQL session on a synthetic population.
+
+Each stage is run in order on a fresh in-memory BayesDB per backend
+and repetition, and the best time of each stage over the repetitions
+is reported.
+"""
+
+import struct
+import timeit
+
+import bayeslite
+
+from bayeslite.bench.population import STATTYPES
+from bayeslite.bench.population import synthetic_csv
+from bayeslite.bench.population import synthetic_table
+from bayeslite.quote import bql_quote_name
+from bayeslite.util import json_dumps
+
+STAGES = (
+    'read_csv',
+    'create_population',
+    'create_generator',
+    'initialize',
+    'analyze',
+    'estimate_rowwise',
+    'estimate_pairwise_columns',
+    'estimate_pairwise_rows',
+    'simulate',
+    'infer',
+)
+
+def _cgpm_backend(seed):
+    from bayeslite.backends.cgpm_backend import CGPM_Backend
+    return CGPM_Backend(cgpm_registry={}, multiprocess=False)
+
+def _nig_normal_backend(seed):
+    from bayeslite.backends.nig_normal import NIGNormalBackend
+    return NIGNormalBackend(seed=seed)
+
+def _std_normal_backend(seed):
+    from bayeslite.backends.iid_gaussian import StdNormalBackend
+    return StdNormalBackend(seed=seed)
+
+# For each backend by its BQL name: a function of a seed returning an
+# instance, the stattypes it models, and the stages it supports.
+BACKENDS = {
+    'cgpm': (_cgpm_backend, STATTYPES, STAGES),
+    'nig_normal': (_nig_normal_backend, ('numerical',), STAGES),
+    'std_normal': (_std_normal_backend, ('numerical',), STAGES[:6] + (
+        'simulate',
+    )),
+}
+
+def run_benchmarks(backends=None, rows=1000, columns=10,
+        stattypes=STATTYPES, models=4, iterations=2, pairwise_rows=100,
+        simulate_rows=1000, repeat=1, seed=0):
+    """Benchmark `backends` on a synthetic population.
+
+    The population has `rows` rows and `columns` columns of the
+    given `stattypes`, as made by
+    :func:`~bayeslite.bench.population.synthetic_table`; columns of
+    stattypes a backend does not model are ignored in its population.
+    `pairwise_rows` limits the pairs of rows in the pairwise row
+    query, and `simulate_rows` is the number of rows simulated.
+
+    Return a dict, suitable for :func:`bayeslite.util.json_dumps`,
+    of the parameters and of the seconds taken by each stage for each
+    backend.
+    """
+    if backends is None:
+        backends = sorted(BACKENDS)
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend: %r' % (backend,))
+    parameters = {
+        'backends': list(backends),
+        'rows': rows,
+        'columns': columns,
+        'stattypes': list(stattypes),
+        'models': models,
+        'iterations': iterations,
+        'pairwise_rows': pairwise_rows,
+        'simulate_rows': simulate_rows,
+        'repeat': repeat,
+        'seed': seed,
+    }
+    table = synthetic_table(rows, columns, stattypes=stattypes, seed=seed)
+    timings = {}
+    for backend in backends:
+        best = {}
+        for _ in xrange(repeat):
+            for stage, seconds in _run_session(backend, table, parameters):
+                if stage not in best or seconds < best[stage]:
+                    best[stage] = seconds
+        timings[backend] = best
+    return {
+        'bayeslite': bayeslite.__version__,
+        'parameters': parameters,
+        'seconds': timings,
+    }
+
+def _run_session(backend_name, table, parameters):
+    # Yield (stage, seconds) for each stage the backend supports.
+    make_backend, modeled_stattypes, stages = BACKENDS[backend_name]
+    names, stattypes, data = table
+    modeled = [
+        name for name, stattype in zip(names, stattypes)
+        if stattype in modeled_stattypes
+    ]
+    if not modeled:
+        raise ValueError('No columns modeled by backend %r' % (backend_name,))
+    qm = [bql_quote_name(name) for name in modeled]
+    population_schema = '; '.join(
+        '%s %s' % (bql_quote_name(name),
+            stattype if stattype in modeled_stattypes else 'IGNORE')
+        for name, stattype in zip(names, stattypes))
+    queries = {
+        'create_population':
+            'CREATE POPULATION p FOR t (%s)' % (population_schema,),
+        'create_generator':
+            'CREATE GENERATOR g FOR p USING %s' % (backend_name,),
+        'initialize':
+            'INITIALIZE %d MODELS FOR g' % (parameters['models'],),
+        'analyze':
+            'ANALYZE g FOR %d ITERATIONS' % (parameters['iterations'],),
+        'estimate_rowwise':
+            'ESTIMATE PREDICTIVE PROBABILITY OF %s FROM p' % (qm[0],),
+        'estimate_pairwise_columns':
+            'ESTIMATE DEPENDENCE PROBABILITY FROM PAIRWISE VARIABLES OF p',
+        'estimate_pairwise_rows':
+            'ESTIMATE SIMILARITY IN THE CONTEXT OF %s FROM PAIRWISE p'
+            ' LIMIT %d' % (qm[0], parameters['pairwise_rows']),
+        'simulate':
+            'SIMULATE %s FROM p LIMIT %d'
+            % (', '.join(qm[:2]), parameters['simulate_rows']),
+        'infer':
+            'INFER EXPLICIT PREDICT %s CONFIDENCE predict_conf FROM p'
+            % (qm[0],),
+    }
+    seed = struct.pack('<QQQQ', parameters['seed'], 0, 0, 0)
+    with bayeslite.bayesdb_open(builtin_backends=False, seed=seed) as bdb:
+        bayeslite.bayesdb_register_backend(
+            bdb, make_backend(parameters['seed']))
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            start = timeit.default_timer()
+            if stage == 'read_csv':
+                bayeslite.bayesdb_read_csv(
+                    bdb, 't', synthetic_csv(names, data), header=True,
+                    create=True)
+            else:
+                bdb.execute(queries[stage]).fetchall()
+            yield (stage, timeit.default_timer() - start)
+
+def dump_benchmarks(results, f):
+    """Write `results` of :func:`run_benchmarks` to `f` as JSON."""
+    f.write(json_dumps(results))
+    f.write('\n')
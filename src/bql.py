@@ -34,15 +34,20 @@ import bayeslite.core as core
 import bayeslite.txn as txn
 
 from bayeslite.exception import BQLError
-from bayeslite.guess import bayesdb_guess_stattypes
+from bayeslite.guess import bayesdb_guess_stattypes_streaming
 from bayeslite.read_csv import bayesdb_read_csv_file
 from bayeslite.sqlite3_util import sqlite3_quote_name
 from bayeslite.util import casefold
 from bayeslite.util import cursor_value
 
 
-def execute_phrase(bdb, phrase, bindings=()):
-    """Execute the BQL AST phrase `phrase` and return a cursor of results."""
+def execute_phrase(bdb, phrase, bindings=(), cache_key=None):
+    """Execute the BQL AST phrase `phrase` and return a cursor of results.
+
+    If `cache_key` is not None, it must determine `phrase`, e.g. be
+    the text it was parsed from, and the SQL compiled for a query is
+    cached in `bdb.sql_cache` under it until the catalog changes.
+    """
     if isinstance(phrase, ast.Parametrized):
         n_numpar = phrase.n_numpar
         nampar_map = phrase.nampar_map
@@ -57,9 +62,16 @@ def execute_phrase(bdb, phrase, bindings=()):
         # Compile the query in the transaction in case we need to
         # execute subqueries to determine column lists.  Compiling is
         # a quick tree descent, so this should be fast.
-        out = compiler.Output(n_numpar, nampar_map, bindings)
-        with bdb.savepoint():
-            compiler.compile_query(bdb, phrase, out)
+        key = None if cache_key is None else (cache_key, bdb.batch_size)
+        cached = None if key is None else bdb.sql_cache.get(key)
+        if cached is not None:
+            out = cached.rebind(bindings)
+        else:
+            out = compiler.Output(n_numpar, nampar_map, bindings)
+            with bdb.savepoint(), bdb._profiling('compile', 'compile_query'):
+                compiler.compile_query(bdb, phrase, out)
+            if key is not None and out.cacheable():
+                bdb.sql_cache.put(key, out)
         winders, unwinders = out.getwindings()
         return execute_wound(bdb, winders, unwinders, out.getvalue(),
             out.getbindings())
@@ -90,11 +102,27 @@ def execute_phrase(bdb, phrase, bindings=()):
             qt = sqlite3_quote_name(phrase.name)
             temp = 'TEMP ' if phrase.temp else ''
             ifnotexists = 'IF NOT EXISTS ' if phrase.ifnotexists else ''
-            out.write('CREATE %sTABLE %s%s AS ' % (temp, ifnotexists, qt))
-            compiler.compile_query(bdb, phrase.query, out)
+            create = 'CREATE %sTABLE %s%s AS ' % (temp, ifnotexists, qt)
+            with bdb._profiling('compile', 'compile_query'):
+                compiler.compile_query(bdb, phrase.query, out)
+            query = out.getvalue()
             winders, unwinders = out.getwindings()
             with compiler.bayesdb_wind(bdb, winders, unwinders):
-                bdb.sql_execute(out.getvalue(), out.getbindings())
+                if isinstance(phrase.query, ast.Simulate):
+                    # SIMULATE calls the backends as SQLite reads its
+                    # rows, and they may open savepoints, which SQLite
+                    # refuses while a statement is writing.  So create
+                    # the empty table, and insert the rows as they are
+                    # read by a separate statement.
+                    bdb.sql_execute('%sSELECT * FROM (%s) LIMIT 0' %
+                        (create, query), out.getbindings())
+                    cursor = bdb.sql_execute(query, out.getbindings())
+                    if cursor.description:
+                        params = ', '.join('?' for _ in cursor.description)
+                        bdb.sql_executemany('INSERT INTO %s VALUES (%s)' %
+                            (qt, params), cursor)
+                else:
+                    bdb.sql_execute(create + query, out.getbindings())
         return empty_cursor(bdb)
 
     if isinstance(phrase, ast.CreateTabCsv):
@@ -106,6 +134,8 @@ def execute_phrase(bdb, phrase, bindings=()):
                 else:
                     raise BQLError(bdb, 'Table already exists: %s' %
                         (repr(phrase.name),))
+            # The bulk loading PRAGMAs can't be changed in the savepoint,
+            # so always load without them.
             bayesdb_read_csv_file(
                 bdb, phrase.name, phrase.csv, header=True, create=True)
         return empty_cursor(bdb)
@@ -227,12 +257,14 @@ def execute_phrase(bdb, phrase, bindings=()):
             qtt = sqlite3_quote_name(temptable)
             cursor = bdb.sql_execute('SELECT * FROM %s' % (qt,))
             column_names = [d[0] for d in cursor.description]
-            rows = cursor.fetchall()
-            stattypes = bayesdb_guess_stattypes(column_names, rows)
-            distinct_value_counts = [
-                len(set([row[i] for row in rows]))
-                for i in range(len(column_names))
-            ]
+            stattypes = bayesdb_guess_stattypes_streaming(column_names, cursor)
+            # Count NULL as a distinct value too.
+            qcns = map(sqlite3_quote_name, column_names)
+            cursor = bdb.sql_execute('SELECT %s FROM %s' % (
+                ','.join('COUNT(DISTINCT %s) + IFNULL(MAX(%s IS NULL), 0)'
+                    % (qcn, qcn) for qcn in qcns),
+                qt))
+            distinct_value_counts = cursor.fetchone()
             out.winder('''
                 CREATE TEMP TABLE %s (
                     column TEXT,
@@ -278,6 +310,7 @@ def execute_phrase(bdb, phrase, bindings=()):
             bdb.sql_execute('''
                 DELETE FROM bayesdb_population WHERE id = ?
             ''', (population_id,))
+            core.bayesdb_invalidate_catalog(bdb)
         return empty_cursor(bdb)
 
     if isinstance(phrase, ast.AlterPop):
@@ -313,6 +346,7 @@ def execute_phrase(bdb, phrase, bindings=()):
                     bdb.sql_execute(update_generator_sql,
                         (cmd.name, population_id))
                     assert bdb._sqlite3.totalchanges() - total_changes == 1
+                    core.bayesdb_invalidate_catalog(bdb)
                     # If population has implicit generator, rename it too.
                     if core.bayesdb_population_has_implicit_generator(
                             bdb, population_id):
@@ -355,9 +389,9 @@ def execute_phrase(bdb, phrase, bindings=()):
                     if cmd.stattype is None:
                         cursor = bdb.sql_execute(
                             'SELECT %s FROM %s' % (qc, qt))
-                        rows = cursor.fetchall()
-                        [stattype, reason] = bayesdb_guess_stattypes(
-                            [cmd.name], rows)[0]
+                        [stattype, reason] = \
+                            bayesdb_guess_stattypes_streaming(
+                                [cmd.name], cursor)[0]
                         # Fail if trying to model a key.
                         if stattype == 'key':
                             raise BQLError(bdb,
@@ -445,6 +479,7 @@ def execute_phrase(bdb, phrase, bindings=()):
                     bdb.sql_execute(
                         update_stattype_sql,
                         (casefold(cmd.stattype), population_id,))
+                    core.bayesdb_invalidate_catalog(bdb)
                 else:
                     assert False, 'Invalid ALTER POPULATION command: %s' % \
                         (repr(cmd),)
@@ -465,6 +500,8 @@ def execute_phrase(bdb, phrase, bindings=()):
             raise BQLError(bdb, 'No such backend: %s' %
                 (repr(backend_name),))
         backend = bdb.backends[backend_name]
+        if bdb.profiler is not None:
+            backend = bdb.profiler.backend(backend)
 
         # Retrieve the (possibility implicit) generator name.
         generator_name = phrase.name or phrase.population
@@ -484,6 +521,7 @@ def execute_phrase(bdb, phrase, bindings=()):
                         (name, population_id, backend, implicit)
                         VALUES (?, ?, ?, ?)
                 ''', (generator_name, population_id, backend.name(), implicit))
+                core.bayesdb_invalidate_catalog(bdb)
                 generator_id = core.bayesdb_get_generator(
                     bdb, population_id, generator_name)
                 # Do any backend-specific initialization.
@@ -518,6 +556,7 @@ def execute_phrase(bdb, phrase, bindings=()):
                 DELETE FROM bayesdb_generator WHERE id = ?
             '''
             bdb.sql_execute(drop_generator_sql, (generator_id,))
+            core.bayesdb_invalidate_catalog(bdb)
         return empty_cursor(bdb)
 
     if isinstance(phrase, ast.AlterGen):
@@ -559,6 +598,7 @@ def execute_phrase(bdb, phrase, bindings=()):
                     bdb.sql_execute(update_generator_sql,
                         (cmd.name, generator_id))
                     assert bdb._sqlite3.totalchanges() - total_changes == 1
+                    core.bayesdb_invalidate_catalog(bdb)
                     # Remember the new name for subsequent commands.
                     generator = cmd.name
                 elif isinstance(cmd, ast.AlterGenGeneric):
@@ -692,6 +732,23 @@ def execute_phrase(bdb, phrase, bindings=()):
                     })
         return empty_cursor(bdb)
 
+    if isinstance(phrase, ast.IncorporateRows):
+        if not core.bayesdb_has_generator(bdb, None, phrase.generator):
+            raise BQLError(bdb, 'No such generator: %s' %
+                (phrase.generator,))
+        generator_id = core.bayesdb_get_generator(bdb, None, phrase.generator)
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        try:
+            with bdb.savepoint():
+                backend.incorporate_rows(bdb, generator_id,
+                    iterations=phrase.iterations,
+                    max_seconds=phrase.seconds)
+        except NotImplementedError:
+            raise BQLError(bdb, 'Backend %s cannot incorporate new rows'
+                ' into generator %s' % (repr(backend.name()),
+                    repr(phrase.generator)))
+        return empty_cursor(bdb)
+
     if isinstance(phrase, ast.Regress):
         # Retrieve the population.
         if not core.bayesdb_has_population(bdb, phrase.population):
@@ -814,6 +871,7 @@ def _create_population(bdb, phrase):
         INSERT INTO bayesdb_population (name, tabname, implicit)
             VALUES (?, ?, ?)
     ''', (population_name, phrase.table, implicit))
+    core.bayesdb_invalidate_catalog(bdb)
     population_id = core.bayesdb_get_population(bdb, population_name)
 
     # Extract the population column names and stattypes as pairs.
@@ -843,10 +901,10 @@ def _create_population(bdb, phrase):
         qt = sqlite3_quote_name(phrase.table)
         qcns = ','.join(map(sqlite3_quote_name, pop_guess))
         cursor = bdb.sql_execute('SELECT %s FROM %s' % (qcns, qt))
-        rows = cursor.fetchall()
         # XXX This function returns a stattype called `key`, which we will add
         # to the pop_ignore_vars.
-        pop_guess_stattypes = bayesdb_guess_stattypes(pop_guess, rows)
+        pop_guess_stattypes = bayesdb_guess_stattypes_streaming(
+            pop_guess, cursor)
         pop_guess_vars = zip(pop_guess, [st[0] for st in pop_guess_stattypes])
         migrate = [(col, st) for col, st in pop_guess_vars if st=='key']
         for col, st in migrate:
@@ -945,6 +1003,7 @@ def rename_table(bdb, old, new):
         UPDATE bayesdb_population SET tabname = ? WHERE tabname = ?
     '''
     bdb.sql_execute(update_populations_sql, (new, old))
+    core.bayesdb_invalidate_catalog(bdb)
 
 def empty_cursor(bdb):
     return None
@@ -954,12 +1013,12 @@ def execute_wound(bdb, winders, unwinders, sql, bindings):
         return bdb.sql_execute(sql, bindings)
     with bdb.savepoint():
         for (wsql, wbindings) in winders:
-            bdb.sql_execute(wsql, wbindings)
+            compiler.bayesdb_execute_winding(bdb, wsql, wbindings)
         try:
             return WoundCursor(bdb, bdb.sql_execute(sql, bindings), unwinders)
         except:
             for (usql, ubindings) in unwinders:
-                bdb.sql_execute(usql, ubindings)
+                compiler.bayesdb_execute_winding(bdb, usql, ubindings)
             raise
 
 class BayesDBCursor(object):
@@ -1002,6 +1061,24 @@ class BayesDBCursor(object):
     def description(self):
         return self._description
 
+class BayesDBRowsCursor(BayesDBCursor):
+    """Cursor for the rows of another cursor, all read at once.
+
+    A worker thread of :meth:`~BayesDB._generator_executor` must not
+    step a statement once it has let go of the SQLite connection, so
+    it gets its rows this way.
+    """
+    def __init__(self, cursor):
+        self._bdb = cursor.connection
+        self._description = cursor.description
+        self._cursor = iter(cursor.fetchall())
+    def fetchone(self):
+        return next(self._cursor, None)
+    def fetchmany(self, size=1):
+        return list(itertools.islice(self._cursor, size))
+    def fetchall(self):
+        return list(self._cursor)
+
 class WoundCursor(BayesDBCursor):
     def __init__(self, bdb, cursor, unwinders):
         self._unwinders = unwinders
@@ -1018,6 +1095,6 @@ class WoundCursor(BayesDBCursor):
         # depend on that, which is not such a great idea.)
         if self._bdb._sqlite3 is not None:
             for sql, bindings in reversed(self._unwinders):
-                self._bdb.sql_execute(sql, bindings)
+                compiler.bayesdb_execute_winding(self._bdb, sql, bindings)
         # Apparently object doesn't have a __del__ method.
         #super(WoundCursor, self).__del__()
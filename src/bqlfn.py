@@ -32,7 +32,16 @@ from bayeslite.util import casefold
 
 def bayesdb_install_bql(db, cookie):
     def function(name, nargs, fn):
-        db.createscalarfunction(name, (lambda *args: fn(cookie, *args)), nargs)
+        def call(*args):
+            # SQLite holds the connection while it calls us, so other
+            # threads cannot use it: call the generators serially.
+            with cookie._serially():
+                profiler = cookie.profiler
+                if profiler is None:
+                    return fn(cookie, *args)
+                with profiler.timing('bql', name):
+                    return fn(cookie, *args)
+        db.createscalarfunction(name, call, nargs)
     function("bql_column_correlation", 5, bql_column_correlation)
     function("bql_column_correlation_pvalue", 5, bql_column_correlation_pvalue)
     function("bql_column_dependence_probability", 5,
@@ -52,22 +61,58 @@ def bayesdb_install_bql(db, cookie):
 ### BayesDB column functions
 
 def bql_variable_stattypes_and_data(bdb, population_id, colno0, colno1):
-    st0 = core.bayesdb_variable_stattype(bdb, population_id, None, colno0)
-    st1 = core.bayesdb_variable_stattype(bdb, population_id, None, colno1)
-    table_name = core.bayesdb_population_table(bdb, population_id)
-    qt = sqlite3_quote_name(table_name)
-    varname0 = core.bayesdb_variable_name(bdb, population_id, None, colno0)
-    varname1 = core.bayesdb_variable_name(bdb, population_id, None, colno1)
-    qvn0 = sqlite3_quote_name(varname0)
-    qvn1 = sqlite3_quote_name(varname1)
-    data_sql = '''
-        SELECT %s, %s FROM %s WHERE %s IS NOT NULL AND %s IS NOT NULL
-    ''' % (qvn0, qvn1, qt, qvn0, qvn1)
-    data = bdb.sql_execute(data_sql).fetchall()
-    data0 = [row[0] for row in data]
-    data1 = [row[1] for row in data]
+    data = _column_data(bdb, population_id, [colno0, colno1])
+    (st0, values0, present0) = data[colno0]
+    (st1, values1, present1) = data[colno1]
+    present = present0 & present1
+    data0 = values0[present].tolist()
+    data1 = values1[present].tolist()
     return (st0, st1, data0, data1)
 
+def _column_data(bdb, population_id, colnos):
+    """Return the data of the population's variables `colnos`.
+
+    Returns a dict mapping each colno to ``(stattype, values,
+    present)``, where `values` is a numpy object array of the column's
+    values in rowid order and `present` is a boolean array that is
+    true where the value is not null.  Columns not yet loaded are read
+    in a single scan of the table.
+
+    Within a transaction the columns are memoized in `bdb.cache`, so
+    that a query over many pairs of variables reads each variable
+    once.  The memo is dropped whenever :func:`total_changes` shows
+    that the connection has written anything since it was filled.
+    """
+    cache = bdb.cache
+    if cache is None:
+        columns = {}
+    else:
+        changes = bdb.sql_execute('SELECT total_changes()').fetchvalue()
+        key = ('bql_column_data', population_id)
+        if key not in cache or cache[key][0] != changes:
+            cache[key] = (changes, {})
+        columns = cache[key][1]
+    missing = sorted(set(colno for colno in colnos if colno not in columns))
+    if missing:
+        table_name = core.bayesdb_population_table(bdb, population_id)
+        qt = sqlite3_quote_name(table_name)
+        qvns = [
+            sqlite3_quote_name(core.bayesdb_variable_name(
+                bdb, population_id, None, colno))
+            for colno in missing
+        ]
+        data_sql = 'SELECT %s FROM %s ORDER BY _rowid_' % (
+            ', '.join(qvns), qt)
+        rows = bdb.sql_execute(data_sql).fetchall()
+        for i, colno in enumerate(missing):
+            values = numpy.empty(len(rows), dtype=object)
+            values[:] = [row[i] for row in rows]
+            present = numpy.array([v is not None for v in values], dtype=bool)
+            stattype = core.bayesdb_variable_stattype(
+                bdb, population_id, None, colno)
+            columns[colno] = (stattype, values, present)
+    return dict((colno, columns[colno]) for colno in colnos)
+
 # Two-column function:  CORRELATION [OF <col0> WITH <col1>]
 def bql_column_correlation(bdb, population_id, generator_id, _modelnos,
         colno0, colno1):
@@ -118,6 +163,11 @@ def correlation_p_pearsonr2(data0, data1):
     if n <= 2:
         return float('NaN')
     r = stats.pearsonr(data0, data1)
+    return pearsonr_pvalue(r, n)
+
+def pearsonr_pvalue(r, n):
+    if n <= 2:
+        return float('NaN')
     if math.isnan(r):
         return float('NaN')
     if r == 1. or r == -1:
@@ -130,16 +180,22 @@ def correlation_p_pearsonr2(data0, data1):
 def correlation_cramerphi(data0, data1):
     # Compute observed chi^2 statistic.
     chi2, n0, n1 = cramerphi_chi2(data0, data1)
-    if math.isnan(chi2):
-        return float('NaN')
     n = len(data0)
     assert n == len(data1)
+    return cramerphi(chi2, n, n0, n1)
+
+def cramerphi(chi2, n, n0, n1):
+    if math.isnan(chi2):
+        return float('NaN')
     # Compute observed correlation.
     return math.sqrt(chi2 / (n * (min(n0, n1) - 1)))
 
 def correlation_p_cramerphi(data0, data1):
     # Compute observed chi^2 statistic.
     chi2, n0, n1 = cramerphi_chi2(data0, data1)
+    return cramerphi_pvalue(chi2, n0, n1)
+
+def cramerphi_pvalue(chi2, n0, n1):
     if math.isnan(chi2):
         return float('NaN')
     # Compute p-value for chi^2 test of independence.
@@ -181,20 +237,26 @@ def cramerphi_chi2(data0, data1):
 def correlation_anovar2(data_group, data_y):
     # Compute observed F-test statistic.
     F, n_groups = anovar2(data_group, data_y)
-    if math.isnan(F):
-        return float('NaN')
     n = len(data_group)
     assert n == len(data_y)
+    return anovar2_correlation(F, n, n_groups)
+
+def anovar2_correlation(F, n, n_groups):
+    if math.isnan(F):
+        return float('NaN')
     # Compute observed correlation.
     return 1 - 1/(1 + F*(float(n_groups - 1) / float(n - n_groups)))
 
 def correlation_p_anovar2(data_group, data_y):
     # Compute observed F-test statistic.
     F, n_groups = anovar2(data_group, data_y)
-    if math.isnan(F):
-        return float('NaN')
     n = len(data_group)
     assert n == len(data_y)
+    return anovar2_pvalue(F, n, n_groups)
+
+def anovar2_pvalue(F, n, n_groups):
+    if math.isnan(F):
+        return float('NaN')
     # Compute p-value for F-test.
     return stats.f_sf(F, n_groups - 1, n - n_groups)
 
@@ -280,6 +342,173 @@ define_correlation_p('cyclic', 'cyclic', correlation_p_pearsonr2)
 define_correlation_p('cyclic', 'nominal', correlation_p_anovar2_cd)
 define_correlation_p('cyclic', 'numerical', correlation_p_pearsonr2)
 
+# Rows of data accumulated at a time into the sufficient statistics of
+# bql_column_correlation_matrices.
+CORRELATION_BLOCK_ROWS = 4096
+
+def bql_column_correlation_matrices(bdb, population_id, generator_id, colnos):
+    """Matrix form of :func:`bql_column_correlation` and
+    :func:`bql_column_correlation_pvalue`.
+
+    Returns a pair of symmetric matrices, as lists of lists, whose
+    entries ``[i][j]`` are the correlation and its p-value for
+    ``colnos[i]`` with ``colnos[j]``.  Each variable is read once, and
+    the sums needed for the Pearson, Cramer phi, and ANOVA statistics
+    of every pair are accumulated by matrix products over blocks of
+    rows, each pair restricted to the rows where both are not null.
+    """
+    for colno in colnos:
+        if colno < 0:
+            varname = core.bayesdb_variable_name(bdb, population_id,
+                generator_id, colno)
+            raise BQLError(bdb, 'No correlation for latent variable: %r'
+                % (varname,))
+    data = _column_data(bdb, population_id, colnos)
+    stattypes = [data[colno][0] for colno in colnos]
+    for st0 in set(stattypes):
+        for st1 in set(stattypes):
+            if (st0, st1) not in correlation_methods:
+                raise NotImplementedError('No correlation method for %s/%s.'
+                    % (st0, st1))
+            if (st0, st1) not in correlation_p_methods:
+                raise NotImplementedError(
+                    'No correlation pvalue method for %s/%s.' % (st0, st1))
+    # XXX Pretend CYCLIC is NUMERICAL, as for the scalar methods.
+    numerical = [i for i, st in enumerate(stattypes) if st != 'nominal']
+    nominal = [i for i, st in enumerate(stattypes) if st == 'nominal']
+    nrows = len(data[colnos[0]][1]) if colnos else 0
+
+    # Numerical columns as floats centred on their means, zero where
+    # null, with their masks of presence.
+    x = numpy.zeros((nrows, len(numerical)))
+    m = numpy.zeros((nrows, len(numerical)))
+    for k, i in enumerate(numerical):
+        (_st, values, present) = data[colnos[i]]
+        x[present, k] = numpy.array(values[present].tolist(), dtype=float)
+        m[present, k] = 1
+    count = numpy.sum(m, axis=0)
+    # Largest magnitude of each column, to tell sums of squares that
+    # are zero up to rounding error from real variation.
+    scale = numpy.zeros(len(numerical))
+    if nrows:
+        scale = numpy.max(numpy.abs(x), axis=0)
+    x -= m * (numpy.sum(x, axis=0) / numpy.maximum(count, 1))
+
+    # Nominal columns as integer codes of their sorted distinct
+    # values, -1 where null, for one-hot blocks at `offsets`.
+    codes = numpy.zeros((nrows, len(nominal)), dtype=int)
+    offsets = [0]
+    for k, i in enumerate(nominal):
+        (_st, values, present) = data[colnos[i]]
+        levels = sorted(set(values[present].tolist()))
+        index = dict((v, c) for c, v in enumerate(levels))
+        codes[:, k] = -1
+        codes[present, k] = [index[v] for v in values[present].tolist()]
+        offsets.append(offsets[-1] + len(levels))
+
+    # Accumulate the sufficient statistics by blocks of rows.
+    a = len(numerical)
+    nlevels = offsets[-1]
+    mm = numpy.zeros((a, a))            # rows with both present
+    xm = numpy.zeros((a, a))            # sum of x_i where x_j present
+    xx = numpy.zeros((a, a))            # sum of x_i x_j
+    x2m = numpy.zeros((a, a))           # sum of x_i^2 where x_j present
+    oo = numpy.zeros((nlevels, nlevels), dtype=int)  # contingencies
+    om = numpy.zeros((nlevels, a))      # group counts
+    ox = numpy.zeros((nlevels, a))      # group sums
+    ox2 = numpy.zeros((nlevels, a))     # group sums of squares
+    for start in xrange(0, nrows, CORRELATION_BLOCK_ROWS):
+        stop = min(start + CORRELATION_BLOCK_ROWS, nrows)
+        xb = x[start:stop]
+        mb = m[start:stop]
+        x2b = xb * xb
+        mm += numpy.dot(mb.T, mb)
+        xm += numpy.dot(xb.T, mb)
+        xx += numpy.dot(xb.T, xb)
+        x2m += numpy.dot(x2b.T, mb)
+        if nominal:
+            ob = numpy.zeros((stop - start, nlevels))
+            for k in xrange(len(nominal)):
+                rows = numpy.nonzero(codes[start:stop, k] >= 0)[0]
+                ob[rows, offsets[k] + codes[start + rows, k]] = 1
+            oo += numpy.dot(ob.T, ob).astype(int)
+            om += numpy.dot(ob.T, mb)
+            ox += numpy.dot(ob.T, xb)
+            ox2 += numpy.dot(ob.T, x2b)
+
+    n = len(colnos)
+    correlations = [[None] * n for _ in xrange(n)]
+    pvalues = [[None] * n for _ in xrange(n)]
+    def set_pair(i, j, correlation, pvalue):
+        correlations[i][j] = correlations[j][i] = correlation
+        pvalues[i][j] = pvalues[j][i] = pvalue
+
+    # Pearson r^2 for numerical/numerical pairs.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        var = _sum_squared_deviations(x2m, xm, mm,
+            scale[:, numpy.newaxis] if a else scale)
+        cov = xx - xm * xm.T / mm
+        r = numpy.clip(cov / numpy.sqrt(var * var.T), -1., +1.)
+    for k0, i in enumerate(numerical):
+        for k1 in xrange(k0, a):
+            r01 = float(r[k0, k1])
+            if mm[k0, k1] == 0 or var[k0, k1] == 0 or var[k1, k0] == 0:
+                r01 = float('NaN')
+            set_pair(i, numerical[k1], r01**2,
+                pearsonr_pvalue(r01, int(mm[k0, k1])))
+
+    # Cramer phi for nominal/nominal pairs.
+    for k0, i in enumerate(nominal):
+        for k1 in xrange(k0, len(nominal)):
+            ct = oo[offsets[k0]:offsets[k0 + 1], offsets[k1]:offsets[k1 + 1]]
+            ct = ct[numpy.sum(ct, axis=1) > 0][:, numpy.sum(ct, axis=0) > 0]
+            (n0, n1) = ct.shape
+            n01 = int(numpy.sum(ct))
+            if n01 == 0 or min(n0, n1) == 1:
+                chi2 = float('NaN')
+            else:
+                chi2 = stats.chi2_contingency(ct)
+            set_pair(i, nominal[k1], cramerphi(chi2, n01, n0, n1),
+                cramerphi_pvalue(chi2, n0, n1))
+
+    # ANOVA R^2 for nominal/numerical pairs.
+    for k0, i in enumerate(nominal):
+        for k1, j in enumerate(numerical):
+            levels = slice(offsets[k0], offsets[k0 + 1])
+            counts = om[levels, k1]
+            groups = counts > 0
+            counts = counts[groups]
+            sums = ox[levels, k1][groups]
+            n_groups = len(counts)
+            n01 = int(numpy.sum(counts))
+            if n_groups in (0, 1, n01):
+                F = float('NaN')
+            else:
+                within = _sum_squared_deviations(ox2[levels, k1][groups],
+                    sums, counts, scale[k1])
+                overall = numpy.sum(sums) / n01
+                bgv = numpy.sum(counts * (sums/counts - overall)**2) \
+                    / (n_groups - 1)
+                wgv = numpy.sum(within) / float(n01 - n_groups)
+                if wgv == 0:
+                    # As in stats.f_oneway.
+                    F = float('NaN') if bgv == 0 else float('+inf')
+                else:
+                    F = bgv / wgv
+            set_pair(i, j, anovar2_correlation(F, n01, n_groups),
+                anovar2_pvalue(F, n01, n_groups))
+
+    return (correlations, pvalues)
+
+def _sum_squared_deviations(sum_squares, sums, counts, scale):
+    # Sum of squared deviations from the mean, given sums of squares,
+    # sums, and counts, treating anything below the rounding error of
+    # values of magnitude `scale` as exactly zero.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ssd = sum_squares - sums * sums / counts
+    tolerance = counts * (16 * numpy.finfo(float).eps * scale)**2
+    return numpy.where(ssd <= tolerance, 0., ssd)
+
 # Two-column function:  DEPENDENCE PROBABILITY [OF <col0> WITH <col1>]
 def bql_column_dependence_probability(
         bdb, population_id, generator_id, modelnos, colno0, colno1):
@@ -290,9 +519,27 @@ def bql_column_dependence_probability(
             bdb, generator_id, modelnos, colno0, colno1)
         return stats.arithmetic_mean(depprob_list)
     generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
-    depprobs = map(generator_depprob, generator_ids)
+    depprobs = _map_generators(bdb, generator_depprob, generator_ids)
     return stats.arithmetic_mean(depprobs)
 
+def bql_column_dependence_probability_matrix(
+        bdb, population_id, generator_id, modelnos, colnos):
+    """Matrix form of :func:`bql_column_dependence_probability`.
+
+    Returns a symmetric matrix, as a list of lists, whose entry
+    ``[i][j]`` is the dependence probability of ``colnos[i]`` with
+    ``colnos[j]``, asking each backend for all pairs in one call.
+    """
+    modelnos = _retrieve_modelnos(modelnos)
+    def generator_depprobs(generator_id):
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        depprob_lists = backend.column_dependence_probability_matrix(
+            bdb, generator_id, modelnos, colnos)
+        return [map(stats.arithmetic_mean, row) for row in depprob_lists]
+    generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
+    depprobs = _map_generators(bdb, generator_depprobs, generator_ids)
+    return _mean_symmetric_matrix(len(colnos), depprobs)
+
 # Two-column function:  MUTUAL INFORMATION [OF <col0> WITH <col1>]
 def bql_column_mutual_information(
         bdb, population_id, generator_id, modelnos, colnos0, colnos1,
@@ -322,7 +569,7 @@ def _bql_column_mutual_information(
             bdb, generator_id, modelnos, colnos0, colnos1,
             constraints=constraints, numsamples=numsamples)
     generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
-    mutinfs = map(generator_mutinf, generator_ids)
+    mutinfs = _map_generators(bdb, generator_mutinf, generator_ids)
     return mutinfs
 
 # One-column function: PROBABILITY DENSITY OF <col>=<value> GIVEN <constraints>
@@ -403,8 +650,9 @@ def _bql_logpdf(bdb, population_id, generator_id, modelnos, targets,
         core.bayesdb_generator_backend(bdb, g)
         for g in generator_ids
     ]
-    loglikelihoods = map(loglikelihood, generator_ids, backends)
-    logpdfs = map(logpdf, generator_ids, backends)
+    loglikelihoods = _map_generators(
+        bdb, loglikelihood, generator_ids, backends)
+    logpdfs = _map_generators(bdb, logpdf, generator_ids, backends)
     return logavgexp_weighted(loglikelihoods, logpdfs)
 
 ### BayesDB row functions
@@ -422,9 +670,50 @@ def bql_row_similarity(
             bdb, generator_id, modelnos, rowid, target_rowid, [colno])
         return stats.arithmetic_mean(similarity_list)
     generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
-    similarities = map(generator_similarity, generator_ids)
+    similarities = _map_generators(bdb, generator_similarity, generator_ids)
     return stats.arithmetic_mean(similarities)
 
+def bql_row_similarity_batch(
+        bdb, population_id, generator_id, modelnos, rowids, target_rowid,
+        colno):
+    """Batched :func:`bql_row_similarity`: one similarity per rowid."""
+    if target_rowid is None:
+        raise BQLError(bdb, 'No such target row for SIMILARITY')
+    modelnos = _retrieve_modelnos(modelnos)
+    def generator_similarities(generator_id):
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        similarity_lists = backend.row_similarity_batch(
+            bdb, generator_id, modelnos, rowids, target_rowid, [colno])
+        return map(stats.arithmetic_mean, similarity_lists)
+    generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
+    similarities = _map_generators(bdb, generator_similarities, generator_ids)
+    return [
+        stats.arithmetic_mean([s[i] for s in similarities])
+        for i in xrange(len(rowids))
+    ]
+
+def bql_row_similarity_matrix(
+        bdb, population_id, generator_id, modelnos, rowids, colno):
+    """Matrix form of :func:`bql_row_similarity`.
+
+    Returns a symmetric matrix, as a list of lists, or as a numpy
+    array if every backend answers with one, whose entry ``[i][j]`` is
+    the similarity of ``rowids[i]`` to ``rowids[j]``, asking each
+    backend for all pairs in one call.
+    """
+    modelnos = _retrieve_modelnos(modelnos)
+    def generator_similarities(generator_id):
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        similarity_lists = backend.row_similarity_matrix(
+            bdb, generator_id, modelnos, rowids, [colno])
+        if isinstance(similarity_lists, numpy.ndarray):
+            # Already averaged over the models.
+            return similarity_lists
+        return [map(stats.arithmetic_mean, row) for row in similarity_lists]
+    generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
+    similarities = _map_generators(bdb, generator_similarities, generator_ids)
+    return _mean_symmetric_matrix(len(rowids), similarities)
+
 # Row function:  PREDICTIVE RELEVANCE TO (<target_row>)
 #  [<AND HYPOTHETICAL ROWS WITH VALUES ((...))] IN THE CONTEXT OF <column>
 def bql_row_predictive_relevance(
@@ -452,7 +741,7 @@ def bql_row_predictive_relevance(
             bdb, generator_id, modelnos, rowid_target, rowid_query,
             hypotheticals, colno)
     generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
-    sims = map(generator_similarity, generator_ids)
+    sims = _map_generators(bdb, generator_similarity, generator_ids)
     return stats.arithmetic_mean([stats.arithmetic_mean(s) for s in sims])
 
 # Row function:  PREDICTIVE PROBABILITY OF <targets> [GIVEN <constraints>]
@@ -481,10 +770,47 @@ def bql_row_column_predictive_probability(
             bdb, generator_id, modelnos, fresh_rowid, cgpm_targets,
             cgpm_constraints)
     generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
-    predprobs = map(generator_predprob, generator_ids)
+    predprobs = _map_generators(bdb, generator_predprob, generator_ids)
     r = logmeanexp(predprobs)
     return ieee_exp(r)
 
+def bql_row_column_predictive_probability_batch(
+        bdb, population_id, generator_id, modelnos, rowids, targets,
+        constraints):
+    """Batched :func:`bql_row_column_predictive_probability`.
+
+    Reads the target and constraint values of all `rowids` at once and
+    scores them with one call to the backend per generator.
+    """
+    targets = json.loads(targets)
+    constraints = json.loads(constraints)
+    modelnos = _retrieve_modelnos(modelnos)
+    fresh_rowid = core.bayesdb_population_fresh_row_id(bdb, population_id)
+    values = _retrieve_row_values(
+        bdb, population_id, rowids, targets + constraints)
+    def retrieve_values(rowid, colnos):
+        return [
+            (colno, values[rowid][colno]) for colno in colnos
+            if values[rowid][colno] is not None
+        ]
+    cgpm_targets = [retrieve_values(rowid, targets) for rowid in rowids]
+    cgpm_constraints = [retrieve_values(rowid, constraints) for rowid in rowids]
+    # Rows whose targets are all NULL get NULL without consulting the
+    # backend.
+    indices = [i for i, t in enumerate(cgpm_targets) if 0 < len(t)]
+    def generator_predprobs(generator_id):
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        return backend.logpdf_joint_batch(
+            bdb, generator_id, modelnos, [fresh_rowid] * len(indices),
+            [cgpm_targets[i] for i in indices],
+            [cgpm_constraints[i] for i in indices])
+    generator_ids = _retrieve_generator_ids(bdb, population_id, generator_id)
+    predprobs = _map_generators(bdb, generator_predprobs, generator_ids)
+    results = [None] * len(rowids)
+    for j, i in enumerate(indices):
+        results[i] = ieee_exp(logmeanexp([p[j] for p in predprobs]))
+    return results
+
 ### Predict and simulate
 
 def bql_predict(
@@ -518,6 +844,61 @@ def bql_predict_confidence(
     # XXX Whattakludge!
     return json.dumps({'value': value, 'confidence': confidence})
 
+def bql_predict_confidence_batch(
+        bdb, population_id, generator_id, modelnos, rowids, colnos,
+        numsamples, missing_only=False):
+    """Batched :func:`bql_predict_confidence` for `colnos` of `rowids`.
+
+    Returns a list with, for each rowid, a dict mapping each colno to
+    the predicted ``(value, confidence)``.  The missing cells of a row
+    are predicted together, by one generator chosen at random per row
+    if `generator_id` is None, with one call to the backend of each
+    generator for the whole batch.  If `missing_only` is true, cells
+    with values are left out of the dicts; otherwise each is
+    predicted on its own, as :func:`bql_predict_confidence` would.
+    """
+    if not rowids:
+        return []
+    modelnos = _retrieve_modelnos(modelnos)
+    values = _retrieve_row_values(bdb, population_id, rowids, colnos)
+    if generator_id is None:
+        generator_ids = core.bayesdb_population_generators(bdb, population_id)
+        indices = bdb.np_prng.randint(0, high=len(generator_ids),
+            size=len(rowids))
+        row_generator_ids = [generator_ids[index] for index in indices]
+    else:
+        row_generator_ids = [generator_id] * len(rowids)
+    # Each request is (row index, rowid, colnos), grouped by generator.
+    requests = {}
+    for i, rowid in enumerate(rowids):
+        missing = [colno for colno in colnos if values[rowid][colno] is None]
+        groups = [missing] if missing else []
+        if not missing_only:
+            groups += [
+                [colno] for colno in colnos
+                if values[rowid][colno] is not None
+            ]
+        for group in groups:
+            requests.setdefault(row_generator_ids[i], []).append(
+                (i, rowid, group))
+    def generator_predictions(generator_id):
+        backend = core.bayesdb_generator_backend(bdb, generator_id)
+        return backend.predict_confidence_batch(
+            bdb, generator_id, modelnos,
+            [rowid for _i, rowid, _group in requests[generator_id]],
+            [group for _i, _rowid, group in requests[generator_id]],
+            numsamples=numsamples)
+    generator_ids = sorted(requests)
+    predictionses = _map_generators(bdb, generator_predictions, generator_ids)
+    results = [{} for _rowid in rowids]
+    for generator_id, predictions in zip(generator_ids, predictionses):
+        assert len(predictions) == len(requests[generator_id])
+        for (i, _rowid, group), prediction in \
+                zip(requests[generator_id], predictions):
+            assert len(prediction) == len(group)
+            results[i].update(zip(group, prediction))
+    return results
+
 # XXX Whattakludge!
 def bql_json_get(bdb, blob, key):
     return json.loads(blob)[key]
@@ -553,7 +934,8 @@ def bayesdb_simulate(
         for generator_id in generator_ids
     ]
     if len(generator_ids) > 1:
-        loglikelihoods = map(loglikelihood, generator_ids, backends)
+        loglikelihoods = _map_generators(
+            bdb, loglikelihood, generator_ids, backends)
         likelihoods = map(math.exp, loglikelihoods)
         total_likelihood = sum(likelihoods)
         if total_likelihood == 0:
@@ -570,7 +952,8 @@ def bayesdb_simulate(
         counts = [numpredictions]
     else:
         counts = []
-    rowses = map(simulate, generator_ids, backends, counts)
+    rowses = _map_generators(
+        bdb, simulate, generator_ids, backends, counts)
     all_rows = [row for rows in rowses for row in rows]
     assert all(isinstance(row, (tuple, list)) for row in all_rows)
     return all_rows
@@ -599,6 +982,74 @@ def _retrieve_rowid_constraints(bdb, population_id, constraints):
         ]
     return rowid, constraints
 
+def _retrieve_row_values(bdb, population_id, rowids, colnos):
+    """Return a dict mapping each of `rowids` to a dict of its values.
+
+    Latent variables, which do not appear in the table, map to None.
+    """
+    table_name = core.bayesdb_population_table(bdb, population_id)
+    qt = sqlite3_quote_name(table_name)
+    colnos = sorted(set(colnos))
+    manifest = [colno for colno in colnos if 0 <= colno]
+    qvs = [
+        sqlite3_quote_name(
+            core.bayesdb_variable_name(bdb, population_id, None, colno))
+        for colno in manifest
+    ]
+    values = {}
+    # Stay well below sqlite3's default limit of 999 parameters.
+    chunk = 500
+    for i in xrange(0, len(rowids), chunk):
+        batch = rowids[i:i + chunk]
+        sql = 'SELECT _rowid_%s FROM %s WHERE _rowid_ IN (%s)' % (
+            ''.join(', %s' % (qv,) for qv in qvs), qt,
+            ', '.join('?' for _ in batch))
+        for row in bdb.sql_execute(sql, batch):
+            values[row[0]] = dict(zip(manifest, row[1:]))
+    for rowid in rowids:
+        if rowid not in values:
+            population = core.bayesdb_population_name(bdb, population_id)
+            raise BQLError(bdb, 'No such individual in population %r: %d'
+                % (population, rowid))
+        for colno in colnos:
+            values[rowid].setdefault(colno, None)
+    return values
+
+def _mean_symmetric_matrix(n, matrices):
+    """Entrywise mean of the symmetric n x n `matrices`."""
+    if matrices and all(isinstance(m, numpy.ndarray) for m in matrices):
+        return numpy.mean(matrices, axis=0)
+    mean = [[None] * n for _ in xrange(n)]
+    for i in xrange(n):
+        for j in xrange(i, n):
+            mean[i][j] = mean[j][i] = \
+                stats.arithmetic_mean([m[i][j] for m in matrices])
+    return mean
+
+def _map_generators(bdb, f, generator_ids, *args):
+    """Apply `f` to each generator id and corresponding elements of `args`.
+
+    Like :func:`map`, the results are returned in the order of
+    `generator_ids`.  If `bdb.generator_threads` is set, the calls are
+    made concurrently in a pool of that many threads.  Each call then
+    gets its own :attr:`BayesDB.py_prng` and :attr:`BayesDB.np_prng`,
+    seeded in generator order from `bdb.np_prng`, so that results are
+    reproducible however the calls are scheduled.
+
+    The threads take turns with the SQLite connection: a call holds it
+    for the whole of any savepoint and for each query it makes, so
+    only a backend's computation outside those runs in parallel.
+    """
+    executor = bdb._generator_executor()
+    if executor is None or len(generator_ids) < 2:
+        return map(f, generator_ids, *args)
+    seeds = bdb.np_prng.randint(0, 2**31, size=len(generator_ids)).tolist()
+    def call(seed_args):
+        seed, f_args = seed_args[0], seed_args[1:]
+        with bdb._serially(seed=seed, worker=True):
+            return f(*f_args)
+    return executor.map(call, zip(seeds, generator_ids, *args), chunksize=1)
+
 def _retrieve_generator_ids(bdb, population_id, generator_id):
     if generator_id is None:
         return core.bayesdb_population_generators(bdb, population_id)
@@ -18,6 +18,10 @@ import apsw
 import json
 
 import bayeslite.bqlfn as bqlfn
+import bayeslite.txn as txn
+
+from bayeslite.sqlite3_util import sqlite3_quote_name
+from bayeslite.util import json_dumps
 
 
 class Mutinf(object):
@@ -202,13 +206,142 @@ class MutinfCursor(object):
         #
         # XXX fsaad@20170624: Setting modelnos = None arbitrarily, figure out
         # how to set the modelnos argument.
-        mis = bqlfn._bql_column_mutual_information(
-            self._bdb, self._population_id, self._generator_id, None,
-            target_vars, reference_vars, self._nsamples,
-            *_flatten2(sorted(conditions.iteritems())))
+        with self._bdb._serially():
+            mis = bqlfn._bql_column_mutual_information(
+                self._bdb, self._population_id, self._generator_id, None,
+                target_vars, reference_vars, self._nsamples,
+                *_flatten2(sorted(conditions.iteritems())))
         self._mi = _flatten2(mis)
 
 
+# Number of rows to ask the backends for at a time in SIMULATE.
+SIMULATE_CHUNK_SIZE = 1000
+
+def simulate_module_argument(population_id, generator_id, modelnos,
+        constraints, colnos, column_names, nsamples, accuracy):
+    """Return the argument to a bql_simulate virtual table, as SQL.
+
+    Virtual tables take no query parameters, so the arguments of
+    :func:`bqlfn.bayesdb_simulate` are passed as a JSON string
+    literal.
+    """
+    argument = json_dumps({
+        'population_id': population_id,
+        'generator_id': generator_id,
+        'modelnos': modelnos,
+        'constraints': constraints,
+        'colnos': colnos,
+        'columns': column_names,
+        'nsamples': nsamples,
+        'accuracy': accuracy,
+    })
+    return "'%s'" % (argument.replace("'", "''"),)
+
+
+class SimulateModule(object):
+    """Virtual tables of rows simulated on demand.
+
+    Created by::
+
+        CREATE VIRTUAL TABLE temp.t USING bql_simulate('<json>')
+
+    with the argument from :func:`simulate_module_argument`.  Each
+    scan of the table simulates fresh rows, `SIMULATE_CHUNK_SIZE` at a
+    time as the scan proceeds, so that neither all the rows nor the
+    SQL to store them need ever be in memory at once.
+
+    Consequently a query that scans the table more than once, e.g. a
+    self-join or a join that rescans it as the inner loop, sees
+    different rows on each scan.
+    """
+
+    def __init__(self, bdb):
+        self._bdb = bdb
+
+    def Create(self, _connection, _modulename, _databasename, _tablename,
+            argument):
+        assert argument.startswith("'") and argument.endswith("'")
+        params = json.loads(argument[1:-1].replace("''", "'"))
+        schema = 'create table t(%s)' % \
+            (','.join(map(sqlite3_quote_name, params['columns'])),)
+        return schema, SimulateTable(self._bdb, params)
+
+    Connect = Create
+
+
+class SimulateTable(object):
+
+    def __init__(self, bdb, params):
+        self._bdb = bdb
+        self._params = params
+
+    def BestIndex(self, _constraints, _orderbys):
+        return None
+
+    def Open(self):
+        return SimulateCursor(self._bdb, self._params)
+
+    def Disconnect(self):
+        pass
+
+    Destroy = Disconnect
+
+
+class SimulateCursor(object):
+
+    def __init__(self, bdb, params):
+        self._bdb = bdb
+        self._params = params
+        self._rowid = None
+        self._rows = None
+        self._offset = None     # rowid of self._rows[0]
+        self._remaining = None  # rows yet to be simulated
+
+    def Close(self):
+        self._rows = None
+
+    def Column(self, number):
+        if number == -1:
+            return self._rowid
+        return self._rows[self._rowid - self._offset][number]
+
+    def Next(self):
+        self._rowid += 1
+        if self._rowid - self._offset == len(self._rows):
+            self._simulate()
+
+    def Rowid(self):
+        return self._rowid
+
+    def Eof(self):
+        return not self._rowid - self._offset < len(self._rows)
+
+    def Filter(self, _indexnum, _indexname, _constraintargs):
+        self._rowid = 0
+        self._rows = []
+        self._offset = 0
+        self._remaining = self._params['nsamples']
+        self._simulate()
+
+    def _simulate(self):
+        # Replace the rows by the next chunk, if there are any left.
+        params = self._params
+        n = min(self._remaining, SIMULATE_CHUNK_SIZE)
+        self._offset += len(self._rows)
+        self._rows = []
+        if n <= 0:
+            return
+        constraints = [tuple(constraint)
+            for constraint in params['constraints']]
+        with txn.bayesdb_caching(self._bdb), self._bdb._serially():
+            self._rows = bqlfn.bayesdb_simulate(
+                self._bdb, params['population_id'], params['generator_id'],
+                params['modelnos'], constraints, params['colnos'],
+                numpredictions=n, accuracy=params['accuracy'])
+        assert len(self._rows) == n
+        self._remaining -= n
+
+
 ### Utilities
 
 def _flatten2(xss):
@@ -34,6 +34,7 @@ import json
 
 import bayeslite.ast as ast
 import bayeslite.bqlfn as bqlfn
+import bayeslite.bqlvtab as bqlvtab
 import bayeslite.core as core
 import bayeslite.macro as macro
 
@@ -63,11 +64,34 @@ class Output(object):
         self._select = []               # map of output index -> input index
         self._winders = []              # list of pre-query (sql, bindings)
         self._unwinders = []            # list of post-query (sql, bindings)
+        self._cacheable = True          # depends only on query and catalog
 
     def subquery(self):
         """Return an output accumulator for a subquery."""
+        # Subqueries are executed at compile time, so the output may
+        # depend on the data and the bindings.
+        self._cacheable = False
         return Output(self._n_numpar, self._nampar_map, self._bindings)
 
+    def cacheable(self):
+        """True if the output can be reused with other bindings.
+
+        That is so unless compiling executed subqueries or queued
+        winders or unwinders, whose results may depend on the bindings
+        or on the data.
+        """
+        return self._cacheable and \
+            len(self._winders) == 0 and len(self._unwinders) == 0
+
+    def rebind(self, bindings):
+        """Return a copy of this output for the bindings `bindings`."""
+        assert self.cacheable()
+        out = Output(self._n_numpar, self._nampar_map, bindings)
+        out.write(self.getvalue())
+        out._renumber = self._renumber
+        out._select = self._select
+        return out
+
     def getvalue(self):
         """Return the accumulated output."""
         return self._stringio.getvalue()
@@ -182,9 +206,37 @@ class Output(object):
 
     def winder(self, sql, bindings):
         self._winders.append((sql, bindings))
+    def winder_many(self, sql, bindings_seq):
+        """Queue `sql` to be executed once for each of `bindings_seq`."""
+        self._winders.append((sql, BindingsSeq(bindings_seq)))
     def unwinder(self, sql, bindings):
         self._unwinders.append((sql, bindings))
 
+class BindingsSeq(object):
+    """Sequence of bindings of a winder executed once for each.
+
+    The bindings are drawn from `iterable` only as the winder is
+    executed, so a generator of them is never materialized.  Winders
+    are executed once, so it need not be iterable more than once.
+    """
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+def bayesdb_execute_winding(bdb, sql, bindings):
+    """Execute a winder or unwinder `sql` with `bindings`.
+
+    If `bindings` is a :class:`BindingsSeq`, execute `sql` once for
+    each of its elements in a single call to `bdb.sql_executemany`.
+    """
+    if isinstance(bindings, BindingsSeq):
+        bdb.sql_executemany(sql, bindings)
+    else:
+        bdb.sql_execute(sql, bindings)
+
 @contextlib.contextmanager
 def bayesdb_wind(bdb, winders, unwinders):
     """Perform queries `winders` before and `unwinders` after.
@@ -195,12 +247,12 @@ def bayesdb_wind(bdb, winders, unwinders):
     if 0 < len(winders) or 0 < len(unwinders):
         with bdb.savepoint():
             for (sql, bindings) in winders:
-                bdb.sql_execute(sql, bindings)
+                bayesdb_execute_winding(bdb, sql, bindings)
             try:
                 yield
             finally:
                 for (sql, bindings) in reversed(unwinders):
-                    bdb.sql_execute(sql, bindings)
+                    bayesdb_execute_winding(bdb, sql, bindings)
     else:
         yield
 
@@ -361,7 +413,13 @@ def compile_infer_explicit_predict(bdb, infer, out):
         named = False
         compile_infer_explicit(bdb, infer, named, out)
 
-def compile_infer_explicit(bdb, infer, named, out):
+def compile_infer_explicit(bdb, infer, named, out, missing_only=False):
+    """Compile an INFER EXPLICIT query.
+
+    If `missing_only` is true, every PREDICT in the query is used only
+    where its column is missing, so when predictions are made in
+    batches, only the missing cells need be predicted.
+    """
     assert isinstance(infer, ast.InferExplicit)
     out.write('SELECT')
     if not core.bayesdb_has_population(bdb, infer.population):
@@ -373,8 +431,18 @@ def compile_infer_explicit(bdb, infer, named, out):
             raise BQLError(bdb, 'No such generator: %s' % (infer.generator,))
         generator_id = core.bayesdb_get_generator(
             bdb, population_id, infer.generator)
-    bql_compiler = BQLCompiler_1Row_Infer(population_id, generator_id,
-        infer.modelnos)
+    # Rows chosen by LIMIT alone can be chosen before predicting: take
+    # them in rowid order, both for the predictions and for the query.
+    limit_rowids = bdb.batch_size is not None and \
+        infer.limit is not None and \
+        limit_takes_rows(infer.columns, infer.grouping, infer.order)
+    if bdb.batch_size is None:
+        bql_compiler = BQLCompiler_1Row_Infer(population_id, generator_id,
+            infer.modelnos)
+    else:
+        bql_compiler = BQLCompiler_1Row_Infer_Batch(population_id,
+            generator_id, infer.modelnos, infer.condition, bdb.batch_size,
+            missing_only, infer.limit if limit_rowids else None)
     columns = expand_select_columns(
         bdb, infer.columns, named, bql_compiler, out)
     compile_select_columns(bdb, columns, named, bql_compiler, out)
@@ -414,12 +482,16 @@ def compile_infer_explicit(bdb, infer, named, out):
                 out.write(' DESC')
             else:
                 assert False, 'Invalid order sense: %s' % (repr(order.sense),)
+    if limit_rowids:
+        out.write(' ORDER BY %s._rowid_' % (qt,))
     if infer.limit is not None:
         out.write(' LIMIT ')
         compile_expression(bdb, infer.limit.limit, bql_compiler, out)
         if infer.limit.offset is not None:
             out.write(' OFFSET ')
             compile_expression(bdb, infer.limit.offset, bql_compiler, out)
+    if isinstance(bql_compiler, BQLCompiler_1Row_Infer_Batch):
+        bql_compiler.compile_predictions(bdb, out)
 
 def compile_infer_auto(bdb, infer, out):
     assert isinstance(infer, ast.InferAuto)
@@ -455,7 +527,10 @@ def compile_infer_auto(bdb, infer, out):
         infer.modelnos, infer.condition, infer.grouping, infer.order,
         infer.limit)
     named = True
-    return compile_infer_explicit(bdb, infer_exp, named, out)
+    # Every PREDICT is in IFNULL(col, PREDICT col), so only the missing
+    # cells need be predicted.
+    missing_only = True
+    return compile_infer_explicit(bdb, infer_exp, named, out, missing_only)
 
 def compile_estimate(bdb, estimate, out):
     assert isinstance(estimate, ast.Estimate)
@@ -475,8 +550,22 @@ def compile_estimate(bdb, estimate, out):
                 (estimate.generator,))
         generator_id = core.bayesdb_get_generator(
             bdb, population_id, estimate.generator)
-    bql_compiler = BQLCompiler_1Row(population_id, generator_id,
-        estimate.modelnos)
+    # Rows chosen by LIMIT alone can be chosen before estimating: take
+    # them in rowid order, both for the estimates and for the query.
+    # Otherwise, LIMIT may depend on estimates for every row, so
+    # estimate row by row as the query needs them.
+    limit_rowids = bdb.batch_size is not None and \
+        estimate.limit is not None and \
+        estimate.quantifier == ast.SELQUANT_ALL and \
+        limit_takes_rows(estimate.columns, estimate.grouping, estimate.order)
+    if bdb.batch_size is None or \
+            (estimate.limit is not None and not limit_rowids):
+        bql_compiler = BQLCompiler_1Row(population_id, generator_id,
+            estimate.modelnos)
+    else:
+        bql_compiler = BQLCompiler_1Row_Batch(population_id, generator_id,
+            estimate.modelnos, estimate.condition, bdb.batch_size,
+            estimate.limit)
     named = True
     columns = expand_select_columns(
         bdb, estimate.columns, named, bql_compiler, out)
@@ -517,6 +606,8 @@ def compile_estimate(bdb, estimate, out):
                 out.write(' DESC')
             else:
                 assert False, 'Invalid order sense: %s' % (repr(order.sense),)
+    if limit_rowids:
+        out.write(' ORDER BY %s._rowid_' % (qt,))
     if estimate.limit is not None:
         out.write(' LIMIT ')
         compile_expression(bdb, estimate.limit.limit, bql_compiler, out)
@@ -659,7 +750,6 @@ def compile_simulate(bdb, simulate, out):
         modelnos = None if simulate.modelnos is None else str(simulate.modelnos)
         qtt = sqlite3_quote_name(temptable)
         column_names = [c.expression.column for c in simulate.columns]
-        qcns = map(sqlite3_quote_name, column_names)
         for column_name in column_names:
             cn = casefold(column_name)
             if not core.bayesdb_has_variable(
@@ -707,17 +797,13 @@ def compile_simulate(bdb, simulate, out):
         constraints = \
             map(map_constraint, zip(simulate.constraints, cursor[0][1:]))
         colnos = map(map_var, column_names)
-        schema = ','.join(qcns)
-        out.winder('CREATE TEMP TABLE %s (%s)' % (qtt, schema), ())
-        insert_sql = '''
-            INSERT INTO %s (%s) VALUES (%s)
-        ''' % (qtt, ','.join(qcns), ','.join('?' for qcn in qcns))
-        for row in bqlfn.bayesdb_simulate(
-                bdb, population_id, generator_id, modelnos,
-                constraints, colnos, numpredictions=nsamples,
-                accuracy=simulate.accuracy
-            ):
-            out.winder(insert_sql, row)
+        # Simulate the rows as they are read, rather than storing them
+        # all in a temporary table up front.
+        argument = bqlvtab.simulate_module_argument(
+            population_id, generator_id, modelnos, constraints, colnos,
+            column_names, nsamples, simulate.accuracy)
+        out.winder('CREATE VIRTUAL TABLE temp.%s USING bql_simulate(%s)' %
+            (qtt, argument), ())
         out.unwinder('DROP TABLE %s' % (qtt,), ())
         out.write('SELECT * FROM %s' % (qtt,))
 
@@ -934,8 +1020,16 @@ def compile_estpaircols(bdb, estpaircols, out):
                 (estpaircols.generator,))
         generator_id = core.bayesdb_get_generator(
             bdb, population_id, estpaircols.generator)
-    bql_compiler = BQLCompiler_2Col(population_id, generator_id,
-        estpaircols.modelnos, colno0_exp, colno1_exp)
+    if bdb.batch_size is not None and \
+            estpaircols.condition is None and estpaircols.limit is None:
+        # Every pair is wanted, so compute whole matrices at once.
+        colnos = compile_estpaircols_colnos(
+            bdb, population_id, generator_id, estpaircols.subcolumns, out)
+        bql_compiler = BQLCompiler_2Col_Matrix(population_id, generator_id,
+            estpaircols.modelnos, colno0_exp, colno1_exp, colnos)
+    else:
+        bql_compiler = BQLCompiler_2Col(population_id, generator_id,
+            estpaircols.modelnos, colno0_exp, colno1_exp)
     out.write('SELECT'
         ' %d AS population_id, v0.name AS name0, v1.name AS name1' %
         (population_id,))
@@ -1003,6 +1097,24 @@ def compile_estpaircols(bdb, estpaircols, out):
             compile_expression(bdb, estpaircols.limit.offset, bql_compiler,
                 out)
 
+def compile_estpaircols_colnos(bdb, population_id, generator_id,
+        subcolumns, out):
+    colnos = core.bayesdb_variable_numbers(bdb, population_id, generator_id)
+    if subcolumns is None:
+        return colnos
+    bql_compiler = BQLCompiler_Const(population_id, generator_id, None)
+    subout = out.subquery()
+    subout.write('SELECT ')
+    compile_column_lists(bdb, population_id, generator_id, subcolumns,
+        bql_compiler, subout)
+    winders, unwinders = subout.getwindings()
+    with bayesdb_wind(bdb, winders, unwinders):
+        cursor = bdb.sql_execute(subout.getvalue(),
+            subout.getbindings()).fetchall()
+    assert len(cursor) == 1
+    selected = set(cursor[0])
+    return [colno for colno in colnos if colno in selected]
+
 def compile_estpairrow(bdb, estpairrow, out):
     assert isinstance(estpairrow, ast.EstPairRow)
     if not core.bayesdb_has_population(bdb, estpairrow.population):
@@ -1019,8 +1131,14 @@ def compile_estpairrow(bdb, estpairrow, out):
             bdb, population_id, estpairrow.generator)
     rowid0_exp = 'r0._rowid_'
     rowid1_exp = 'r1._rowid_'
-    bql_compiler = BQLCompiler_2Row(population_id, generator_id,
-        estpairrow.modelnos, rowid0_exp, rowid1_exp)
+    if bdb.batch_size is not None and \
+            estpairrow.condition is None and estpairrow.limit is None:
+        # Every pair is wanted, so compute whole matrices at once.
+        bql_compiler = BQLCompiler_2Row_Matrix(population_id, generator_id,
+            estpairrow.modelnos, rowid0_exp, rowid1_exp)
+    else:
+        bql_compiler = BQLCompiler_2Row(population_id, generator_id,
+            estpairrow.modelnos, rowid0_exp, rowid1_exp)
     out.write('SELECT %s AS rowid0, %s AS rowid1,' % (rowid0_exp, rowid1_exp))
     named = True
     columns = expand_select_columns(
@@ -1140,6 +1258,84 @@ class BQLCompiler_1Row(BQLCompiler_Const):
     def implicit_reference_var_colno_exp(self, bdb):
         raise BQLError(bdb, 'No implicit BQL population variable')
 
+    def _predprob_colnos(self, bdb, bql):
+        """Return target and constraint colnos of PREDICTIVE PROBABILITY."""
+        population_id = self.population_id
+        generator_id = self.generator_id
+        if not bql.targets:
+            raise BQLError(bdb, 'Predictive probability at row'
+                ' needs targets.')
+        duplicates = [t for t in bql.targets if t in bql.constraints]
+        if duplicates:
+            raise BQLError(bdb,
+                'Duplicate identifiers in targets and constraints: %s.'
+                % (duplicates,))
+        def report_unknown_variables(colnos):
+            """Throws a BQLError if c in colnos is not in the population."""
+            unknown = [
+                colno for colno in colnos
+                if not core.bayesdb_has_variable(
+                    bdb, population_id, generator_id, colno)
+            ]
+            if unknown:
+                population = core.bayesdb_population_name(
+                    bdb, population_id)
+                raise BQLError(bdb,
+                    'No such variables in population %s: %s' %
+                    (population, unknown))
+        # If * in targets, use all variables except those in constraints.
+        if ast.ColListAll() in bql.targets:
+            if len(bql.targets) > 1:
+                raise BQLError(bdb,'Cannot use (*) with other targets.')
+            # Use generator_id as not to retrieve latent variables.
+            constraints = [c.columns[0] for c in bql.constraints]
+            report_unknown_variables(constraints)
+            colnos_all = core.bayesdb_variable_numbers(
+                bdb, population_id, None)
+            colnos_constraints = [
+                core.bayesdb_variable_number(
+                    bdb, population_id, generator_id, constraint)
+                for constraint in constraints
+            ]
+            colnos_targets = [
+                colno for colno in colnos_all
+                if colno not in colnos_constraints
+            ]
+        # If * in constraints, use all variables except those in targets.
+        elif ast.ColListAll() in bql.constraints:
+            if len(bql.constraints) > 1:
+                raise BQLError(bdb,'Cannot use (*) with other constraints.')
+            colnos_all = core.bayesdb_variable_numbers(
+                bdb, population_id, None)
+            targets = [c.columns[0] for c in bql.targets]
+            report_unknown_variables(targets)
+            colnos_targets = [
+                core.bayesdb_variable_number(
+                    bdb, population_id, generator_id, target)
+                for target in targets
+            ]
+            colnos_constraints = [
+                colno for colno in colnos_all
+                if colno not in colnos_targets
+            ]
+        # If no *, use the variables exactly as specified in the query.
+        else:
+            targets = [c.columns[0] for c in bql.targets]
+            constraints = [c.columns[0] for c in bql.constraints]
+            report_unknown_variables(targets)
+            report_unknown_variables(constraints)
+            colnos_targets = [
+                core.bayesdb_variable_number(
+                    bdb, population_id, generator_id, target)
+                for target in targets
+            ]
+            colnos_constraints = [
+                core.bayesdb_variable_number(
+                    bdb, population_id, generator_id, constraint)
+                for constraint in constraints
+            ]
+        return colnos_targets, colnos_constraints
+
     @override(IBQLCompiler)
     def compile_bql(self, bdb, bql, out):
         assert ast.is_bql(bql)
@@ -1148,78 +1344,8 @@ class BQLCompiler_1Row(BQLCompiler_Const):
         modelnos = self.modelnos
         rowid_col = '_rowid_'   # XXX Don't hard-code this.
         if isinstance(bql, ast.ExpBQLPredProb):
-            if not bql.targets:
-                raise BQLError(bdb, 'Predictive probability at row'
-                    ' needs targets.')
-            duplicates = [t for t in bql.targets if t in bql.constraints]
-            if duplicates:
-                raise BQLError(bdb,
-                    'Duplicate identifiers in targets and constraints: %s.'
-                    % (duplicates,))
-            def report_unknown_variables(colnos):
-                """Throws a BQLError if c in colnos is not in the population."""
-                unknown = [
-                    colno for colno in colnos
-                    if not core.bayesdb_has_variable(
-                        bdb, population_id, generator_id, colno)
-                ]
-                if unknown:
-                    population = core.bayesdb_population_name(
-                        bdb, population_id)
-                    raise BQLError(bdb,
-                        'No such variables in population %s: %s' %
-                        (population, unknown))
-            # If * in targets, use all variables except those in constraints.
-            if ast.ColListAll() in bql.targets:
-                if len(bql.targets) > 1:
-                    raise BQLError(bdb,'Cannot use (*) with other targets.')
-                # Use generator_id as not to retrieve latent variables.
-                constraints = [c.columns[0] for c in bql.constraints]
-                report_unknown_variables(constraints)
-                colnos_all = core.bayesdb_variable_numbers(
-                    bdb, population_id, None)
-                colnos_constraints = [
-                    core.bayesdb_variable_number(
-                        bdb, population_id, generator_id, constraint)
-                    for constraint in constraints
-                ]
-                colnos_targets = [
-                    colno for colno in colnos_all
-                    if colno not in colnos_constraints
-                ]
-            # If * in constraints, use all variables except those in targets.
-            elif ast.ColListAll() in bql.constraints:
-                if len(bql.constraints) > 1:
-                    raise BQLError(bdb,'Cannot use (*) with other constraints.')
-                colnos_all = core.bayesdb_variable_numbers(
-                    bdb, population_id, None)
-                targets = [c.columns[0] for c in bql.targets]
-                report_unknown_variables(targets)
-                colnos_targets = [
-                    core.bayesdb_variable_number(
-                        bdb, population_id, generator_id, target)
-                    for target in targets
-                ]
-                colnos_constraints = [
-                    colno for colno in colnos_all
-                    if colno not in colnos_targets
-                ]
-            # If no *, use the variables exactly as specified in the query.
-            else:
-                targets = [c.columns[0] for c in bql.targets]
-                constraints = [c.columns[0] for c in bql.constraints]
-                report_unknown_variables(targets)
-                report_unknown_variables(constraints)
-                colnos_targets = [
-                    core.bayesdb_variable_number(
-                        bdb, population_id, generator_id, target)
-                    for target in targets
-                ]
-                colnos_constraints = [
-                    core.bayesdb_variable_number(
-                        bdb, population_id, generator_id, constraint)
-                    for constraint in constraints
-                ]
+            colnos_targets, colnos_constraints = \
+                self._predprob_colnos(bdb, bql)
             out.write('bql_row_column_predictive_probability(%d, %s, %s' %(
                 population_id, nullor(generator_id), nullorq(modelnos)))
             out.write(', %s, \'%s\', \'%s\')' % (
@@ -1304,6 +1430,270 @@ class BQLCompiler_1Row_Infer(BQLCompiler_1Row):
         else:
             super(BQLCompiler_1Row_Infer, self).compile_bql(bdb, bql, out)
 
+class BQLCompiler_1Row_Batch(BQLCompiler_1Row):
+    """Compile row-wise model functions into lookups of batched results.
+
+    Rather than calling a BQL scalar function once per row, evaluate
+    the function at compile time on all rows satisfying `condition`,
+    `batch_size` rows at a time through the batched backend API, and
+    materialize the results in a temporary table keyed by rowid.  If
+    `limit` is not None, only the rows it selects, in rowid order, are
+    evaluated; the query must take the same rows.
+    """
+
+    def __init__(self, population_id, generator_id, modelnos, condition,
+            batch_size, limit=None):
+        assert isinstance(batch_size, int)
+        assert 0 < batch_size
+        super(BQLCompiler_1Row_Batch, self).__init__(
+            population_id, generator_id, modelnos)
+        self.condition = condition
+        self.batch_size = batch_size
+        self.limit = limit
+        self._rowids = None
+
+    @override(IBQLCompiler)
+    def compile_bql(self, bdb, bql, out):
+        assert ast.is_bql(bql)
+        population_id = self.population_id
+        generator_id = self.generator_id
+        modelnos = None if self.modelnos is None else str(self.modelnos)
+        if isinstance(bql, ast.ExpBQLPredProb):
+            colnos_targets, colnos_constraints = \
+                self._predprob_colnos(bdb, bql)
+            targets = json.dumps(colnos_targets)
+            constraints = json.dumps(colnos_constraints)
+            def evaluate(rowids):
+                return bqlfn.bql_row_column_predictive_probability_batch(
+                    bdb, population_id, generator_id, modelnos, rowids,
+                    targets, constraints)
+            self._compile_batch(bdb, evaluate, out)
+        elif isinstance(bql, ast.ExpBQLSim) and bql.ofcondition is None:
+            assert len(bql.column) == 1
+            if isinstance(bql.column[0], ast.ColListAll):
+                raise BQLError(bdb, 'Cannot use all variables for CONTEXT.')
+            # Determine the target row and the context variable once,
+            # just as the scalar function's arguments would be.
+            bql_compiler = BQLCompiler_1Row(
+                population_id, generator_id, self.modelnos)
+            table_name = core.bayesdb_population_table(bdb, population_id)
+            qt = sqlite3_quote_name(table_name)
+            subout = out.subquery()
+            subout.write('SELECT ')
+            with compiling_paren(bdb, subout, '(', ')'):
+                subout.write('SELECT _rowid_ FROM %s WHERE ' % (qt,))
+                compile_expression(bdb, bql.tocondition, bql_compiler, subout)
+            subout.write(', ')
+            compile_column_lists(
+                bdb, population_id, generator_id, bql.column, bql_compiler,
+                subout)
+            winders, unwinders = subout.getwindings()
+            with bayesdb_wind(bdb, winders, unwinders):
+                cursor = bdb.sql_execute(subout.getvalue(),
+                    subout.getbindings()).fetchall()
+            assert len(cursor) == 1
+            if len(cursor[0]) != 2:
+                raise BQLError(bdb, 'Similarity needs exactly one variable'
+                    ' for CONTEXT.')
+            target_rowid, colno = cursor[0]
+            def evaluate(rowids):
+                return bqlfn.bql_row_similarity_batch(
+                    bdb, population_id, generator_id, modelnos, rowids,
+                    target_rowid, colno)
+            self._compile_batch(bdb, evaluate, out)
+        else:
+            super(BQLCompiler_1Row_Batch, self).compile_bql(bdb, bql, out)
+
+    def _batch_rowids(self, bdb, out):
+        if self._rowids is None:
+            bql_compiler = BQLCompiler_1Row(
+                self.population_id, self.generator_id, self.modelnos)
+            self._rowids = compile_batch_rowids(bdb, self.population_id,
+                self.condition, bql_compiler, out, limit=self.limit)
+        return self._rowids
+
+    def _compile_batch(self, bdb, evaluate, out):
+        table_name = core.bayesdb_population_table(bdb, self.population_id)
+        qt = sqlite3_quote_name(table_name)
+        temptable = bdb.temp_table_name()
+        assert not core.bayesdb_has_table(bdb, temptable)
+        qtt = sqlite3_quote_name(temptable)
+        rowids = self._batch_rowids(bdb, out)
+        out.winder('CREATE TEMP TABLE %s (rowid INTEGER PRIMARY KEY, value)'
+            % (qtt,), ())
+        insert_sql = 'INSERT INTO %s (rowid, value) VALUES (?, ?)' % (qtt,)
+        for i in xrange(0, len(rowids), self.batch_size):
+            batch = rowids[i:i + self.batch_size]
+            values = evaluate(batch)
+            assert len(values) == len(batch)
+            out.winder_many(insert_sql, zip(batch, values))
+        out.unwinder('DROP TABLE %s' % (qtt,), ())
+        out.write('(SELECT value FROM %s WHERE rowid = %s._rowid_)' %
+            (qtt, qt))
+
+class BQLCompiler_1Row_Infer_Batch(BQLCompiler_1Row_Infer):
+    """Compile PREDICT into lookups of predictions made in batches.
+
+    Rather than calling a BQL scalar function once per cell, note the
+    columns to predict, and once the whole query has been compiled,
+    predict them with :meth:`compile_predictions` for all rows
+    satisfying `condition`, `batch_size` rows at a time through the
+    batched backend API, the missing cells of each row together.  The
+    predictions are materialized in a temporary table keyed by rowid
+    and colno.  If `missing_only` is true, only missing cells are
+    predicted.  If `limit` is not None, only the rows it selects, in
+    rowid order, are predicted; the query must take the same rows.
+    """
+
+    def __init__(self, population_id, generator_id, modelnos, condition,
+            batch_size, missing_only, limit=None):
+        assert isinstance(batch_size, int)
+        assert 0 < batch_size
+        super(BQLCompiler_1Row_Infer_Batch, self).__init__(
+            population_id, generator_id, modelnos)
+        self.condition = condition
+        self.batch_size = batch_size
+        self.missing_only = missing_only
+        self.limit = limit
+        # Temporary table and colnos to predict, by number of samples.
+        self._predictions = {}
+
+    @override(IBQLCompiler)
+    def compile_bql(self, bdb, bql, out):
+        assert ast.is_bql(bql)
+        population_id = self.population_id
+        generator_id = self.generator_id
+        if isinstance(bql, (ast.ExpBQLPredict, ast.ExpBQLPredictConf)):
+            assert bql.column is not None
+            if not core.bayesdb_has_variable(bdb, population_id, generator_id,
+                    bql.column):
+                population = core.bayesdb_population_name(bdb, population_id)
+                raise BQLError(bdb, 'No such %s in population %s: %s' %
+                    ('column' if isinstance(bql, ast.ExpBQLPredict)
+                        else 'variable', population, bql.column))
+            colno = core.bayesdb_variable_number(bdb, population_id,
+                generator_id, bql.column)
+            nsamples = None
+            if bql.nsamples is not None:
+                subout = out.subquery()
+                subout.write('SELECT ')
+                compile_nobql_expression(bdb, bql.nsamples, subout)
+                nsamples = bdb.sql_execute(subout.getvalue(),
+                    subout.getbindings()).fetchvalue()
+            if nsamples not in self._predictions:
+                temptable = bdb.temp_table_name()
+                assert not core.bayesdb_has_table(bdb, temptable)
+                self._predictions[nsamples] = (temptable, [])
+            temptable, colnos = self._predictions[nsamples]
+            if colno not in colnos:
+                colnos.append(colno)
+            table_name = core.bayesdb_population_table(bdb, population_id)
+            qt = sqlite3_quote_name(table_name)
+            qtt = sqlite3_quote_name(temptable)
+            if isinstance(bql, ast.ExpBQLPredict):
+                # As BayesDB_Backend.predict, no value if the
+                # confidence is below the threshold.
+                out.write('(SELECT CASE WHEN confidence < (')
+                compile_expression(bdb, bql.confidence, self, out)
+                out.write(') THEN NULL ELSE value END')
+            else:
+                out.write('(SELECT json')
+            out.write(' FROM %s WHERE rowid = %s._rowid_ AND colno = %d)' %
+                (qtt, qt, colno))
+        else:
+            super(BQLCompiler_1Row_Infer_Batch, self).compile_bql(
+                bdb, bql, out)
+
+    def compile_predictions(self, bdb, out):
+        """Make the predictions the compiled query looks up."""
+        if not self._predictions:
+            return
+        population_id = self.population_id
+        modelnos = None if self.modelnos is None else str(self.modelnos)
+        bql_compiler = BQLCompiler_1Row_Infer(
+            population_id, self.generator_id, self.modelnos)
+        rowids = compile_batch_rowids(bdb, population_id, self.condition,
+            bql_compiler, out, limit=self.limit)
+        for nsamples in sorted(self._predictions):
+            temptable, colnos = self._predictions[nsamples]
+            qtt = sqlite3_quote_name(temptable)
+            out.winder('CREATE TEMP TABLE %s (rowid INTEGER NOT NULL,'
+                ' colno INTEGER NOT NULL, value, confidence, json,'
+                ' PRIMARY KEY(rowid, colno))' % (qtt,), ())
+            insert_sql = 'INSERT INTO %s (rowid, colno, value, confidence,' \
+                ' json) VALUES (?, ?, ?, ?, ?)' % (qtt,)
+            for i in xrange(0, len(rowids), self.batch_size):
+                batch = rowids[i:i + self.batch_size]
+                predictions = bqlfn.bql_predict_confidence_batch(
+                    bdb, population_id, self.generator_id, modelnos, batch,
+                    colnos, nsamples, missing_only=self.missing_only)
+                assert len(predictions) == len(batch)
+                rows = []
+                for rowid, row_predictions in zip(batch, predictions):
+                    for colno in colnos:
+                        if colno not in row_predictions:
+                            continue
+                        value, confidence = row_predictions[colno]
+                        # XXX Whattakludge, as bql_predict_confidence.
+                        blob = json.dumps(
+                            {'value': value, 'confidence': confidence})
+                        rows.append((rowid, colno, value, confidence, blob))
+                out.winder_many(insert_sql, rows)
+            out.unwinder('DROP TABLE %s' % (qtt,), ())
+
+def compile_batch_rowids(bdb, population_id, condition, bql_compiler, out,
+        limit=None):
+    """Return the rowids of the population's table satisfying `condition`.
+
+    The condition, if not None, is compiled with `bql_compiler` and
+    evaluated at compile time.  If `limit` is not None, return only
+    the rowids it selects in rowid order.
+    """
+    table_name = core.bayesdb_population_table(bdb, population_id)
+    qt = sqlite3_quote_name(table_name)
+    subout = out.subquery()
+    subout.write('SELECT _rowid_ FROM %s' % (qt,))
+    if condition is not None:
+        subout.write(' WHERE ')
+        compile_expression(bdb, condition, bql_compiler, subout)
+    if limit is not None:
+        subout.write(' ORDER BY _rowid_ LIMIT ')
+        compile_expression(bdb, limit.limit, bql_compiler, subout)
+        if limit.offset is not None:
+            subout.write(' OFFSET ')
+            compile_expression(bdb, limit.offset, bql_compiler, subout)
+    winders, unwinders = subout.getwindings()
+    with bayesdb_wind(bdb, winders, unwinders):
+        cursor = bdb.sql_execute(subout.getvalue(), subout.getbindings())
+        return [rowid for (rowid,) in cursor]
+
+_AGGREGATE_FUNCTIONS = frozenset([
+    'avg', 'count', 'group_concat', 'max', 'min', 'sum', 'total',
+])
+
+def limit_takes_rows(columns, grouping, order):
+    """True if a query's LIMIT takes rows without looking at them.
+
+    That is so if the query neither groups, nor orders, nor aggregates
+    its selected `columns`: then LIMIT takes the first rows satisfying
+    the condition, which may as well be in rowid order.
+    """
+    if grouping is not None or order is not None:
+        return False
+    return not any(_has_aggregate(col) for col in columns)
+
+def _has_aggregate(exp):
+    # Conservatively, an aggregate anywhere in a subexpression counts,
+    # even in a subquery, where it may not aggregate the query's rows.
+    if isinstance(exp, ast.ExpAppStar):
+        return True
+    if isinstance(exp, ast.ExpApp) and \
+            exp.operator.lower() in _AGGREGATE_FUNCTIONS:
+        return True
+    if isinstance(exp, (tuple, list)):
+        return any(_has_aggregate(sub) for sub in exp)
+    return False
+
 class BQLCompiler_2Row(IBQLCompiler):
     def __init__(self, population_id, generator_id, modelnos, rowid0_exp,
             rowid1_exp):
@@ -1366,6 +1756,51 @@ class BQLCompiler_2Row(IBQLCompiler):
         else:
             assert False, 'Invalid BQL function: %s' % (repr(bql),)
 
+class BQLCompiler_2Row_Matrix(BQLCompiler_2Row):
+    """Compile pairwise row similarity into lookups of a matrix.
+
+    When every pair of rows is wanted, ask each backend for the whole
+    similarity matrix at compile time, rather than calling a BQL scalar
+    function once per pair.  The cgpm and loom backends compute the
+    matrix from their row partitions at once; a backend without a
+    matrix method of its own is still asked pair by pair.
+    """
+
+    @override(IBQLCompiler)
+    def compile_bql(self, bdb, bql, out):
+        assert ast.is_bql(bql)
+        if isinstance(bql, ast.ExpBQLSim) and \
+                bql.ofcondition is None and bql.tocondition is None:
+            population_id = self.population_id
+            generator_id = self.generator_id
+            modelnos = None if self.modelnos is None else str(self.modelnos)
+            assert len(bql.column) == 1
+            if isinstance(bql.column[0], ast.ColListAll):
+                raise BQLError(bdb, 'Cannot use all variables for CONTEXT.')
+            subout = out.subquery()
+            subout.write('SELECT ')
+            compile_column_lists(bdb, population_id, generator_id,
+                bql.column, self, subout)
+            winders, unwinders = subout.getwindings()
+            with bayesdb_wind(bdb, winders, unwinders):
+                cursor = bdb.sql_execute(subout.getvalue(),
+                    subout.getbindings()).fetchall()
+            assert len(cursor) == 1
+            if len(cursor[0]) != 1:
+                raise BQLError(bdb, 'Similarity needs exactly one variable'
+                    ' for CONTEXT.')
+            (colno,) = cursor[0]
+            table_name = core.bayesdb_population_table(bdb, population_id)
+            qt = sqlite3_quote_name(table_name)
+            cursor = bdb.sql_execute('SELECT _rowid_ FROM %s' % (qt,))
+            rowids = sorted(rowid for (rowid,) in cursor)
+            matrix = bqlfn.bql_row_similarity_matrix(
+                bdb, population_id, generator_id, modelnos, rowids, colno)
+            compile_symmetric_matrix_lookup(bdb, rowids, matrix,
+                self.rowid0_exp, self.rowid1_exp, out)
+        else:
+            super(BQLCompiler_2Row_Matrix, self).compile_bql(bdb, bql, out)
+
 class BQLCompiler_1Col(BQLCompiler_Const):
     def __init__(self, population_id, generator_id, modelnos, colno_exp):
         assert isinstance(population_id, int)
@@ -1472,6 +1907,75 @@ class BQLCompiler_2Col(BQLCompiler_Const):
         else:
             super(BQLCompiler_2Col, self).compile_bql(bdb, bql, out)
 
+class BQLCompiler_2Col_Matrix(BQLCompiler_2Col):
+    """Compile pairwise dependence probability and correlation into
+    lookups of a matrix.
+
+    When every pair of `colnos` is wanted, ask each backend for the
+    whole dependence probability matrix, and compute the whole
+    correlation and p-value matrices together, at compile time, rather
+    than calling a BQL scalar function once per pair.
+    """
+
+    def __init__(self, population_id, generator_id, modelnos,
+            colno0_exp, colno1_exp, colnos):
+        assert isinstance(colnos, list)
+        super(BQLCompiler_2Col_Matrix, self).__init__(population_id,
+            generator_id, modelnos, colno0_exp, colno1_exp)
+        self.colnos = colnos
+        self.correlation_matrices = None
+
+    @override(IBQLCompiler)
+    def compile_bql(self, bdb, bql, out):
+        assert ast.is_bql(bql)
+        if isinstance(bql, ast.ExpBQLDepProb) and \
+                bql.column0 is None and bql.column1 is None:
+            modelnos = None if self.modelnos is None else str(self.modelnos)
+            matrix = bqlfn.bql_column_dependence_probability_matrix(
+                bdb, self.population_id, self.generator_id, modelnos,
+                self.colnos)
+            compile_symmetric_matrix_lookup(bdb, self.colnos, matrix,
+                self.colno0_exp, self.colno1_exp, out)
+        elif isinstance(bql, (ast.ExpBQLCorrel, ast.ExpBQLCorrelPval)) and \
+                bql.column0 is None and bql.column1 is None:
+            # CORRELATION and CORRELATION PVALUE in the same query
+            # share one pass over the data.
+            if self.correlation_matrices is None:
+                self.correlation_matrices = \
+                    bqlfn.bql_column_correlation_matrices(bdb,
+                        self.population_id, self.generator_id, self.colnos)
+            (correlations, pvalues) = self.correlation_matrices
+            matrix = correlations if isinstance(bql, ast.ExpBQLCorrel) \
+                else pvalues
+            compile_symmetric_matrix_lookup(bdb, self.colnos, matrix,
+                self.colno0_exp, self.colno1_exp, out)
+        else:
+            super(BQLCompiler_2Col_Matrix, self).compile_bql(bdb, bql, out)
+
+def compile_symmetric_matrix_lookup(bdb, keys, matrix, key0_exp, key1_exp,
+        out):
+    """Compile a lookup of the `matrix` entry for `key0_exp`, `key1_exp`.
+
+    `keys` must be sorted, and `matrix` must be symmetric, so that only
+    its upper triangle need be materialized in the temporary table.
+    The triangle is streamed into the table entry by entry as the
+    winder is executed.
+    """
+    temptable = bdb.temp_table_name()
+    assert not core.bayesdb_has_table(bdb, temptable)
+    qtt = sqlite3_quote_name(temptable)
+    out.winder('CREATE TEMP TABLE %s'
+        ' (key0 NOT NULL, key1 NOT NULL, value, PRIMARY KEY(key0, key1))'
+        % (qtt,), ())
+    insert_sql = 'INSERT INTO %s (key0, key1, value) VALUES (?, ?, ?)' % (qtt,)
+    out.winder_many(insert_sql, ((key0, keys[j], matrix[i][j])
+        for i, key0 in enumerate(keys)
+        for j in xrange(i, len(keys))))
+    out.unwinder('DROP TABLE %s' % (qtt,), ())
+    out.write('(SELECT value FROM %s WHERE key0 = min(%s, %s)'
+        ' AND key1 = max(%s, %s))'
+        % (qtt, key0_exp, key1_exp, key0_exp, key1_exp))
+
 def compile_pdf_joint(bdb, population_id, generator_id, modelnos,
         targets, constraints, bql_compiler, out):
     out.write('bql_pdf_joint(%d, %s, %s' % (population_id,
@@ -39,13 +39,47 @@ representing a particular choice of parameters for the parametrized
 generative model.  Models are numbered consecutively for the
 generator, and may be identified uniquely by ``(generator_id,
 modelno)`` or ``(generator_name, modelno)``.
+
+Within a transaction, lookups of population, variable, and generator
+metadata by id are memoized in `bdb.cache`.  Anything that changes
+those must call :func:`bayesdb_invalidate_catalog`.
 """
 
+import functools
+
 from bayeslite.exception import BQLError
 from bayeslite.sqlite3_util import sqlite3_quote_name
 from bayeslite.util import casefold
 from bayeslite.util import cursor_value
 
+def _catalog_memoized(f):
+    # Memoize f(bdb, *args) in bdb.cache, if we are in a transaction.
+    name = f.__name__
+    @functools.wraps(f)
+    def memoized(bdb, *args):
+        cache = bdb.cache
+        if cache is None:
+            return f(bdb, *args)
+        if 'catalog' not in cache:
+            cache['catalog'] = {}
+        catalog = cache['catalog']
+        key = (name,) + args
+        if key not in catalog:
+            catalog[key] = f(bdb, *args)
+        return catalog[key]
+    return memoized
+
+def bayesdb_invalidate_catalog(bdb):
+    """Forget the population, variable, and generator metadata memoized
+    in the current transaction, and the SQL compiled from BQL.
+
+    Call this after any change to ``bayesdb_population``,
+    ``bayesdb_variable``, or ``bayesdb_generator``.
+    """
+    if bdb.cache is not None and 'catalog' in bdb.cache:
+        del bdb.cache['catalog']
+    bdb.sql_cache.clear()
+
 def bayesdb_has_table(bdb, name):
     """True if there is a table named `name` in `bdb`.
 
@@ -224,6 +258,7 @@ def bayesdb_get_population(bdb, name):
         assert isinstance(row[0], int)
         return row[0]
 
+@_catalog_memoized
 def bayesdb_population_name(bdb, population_id):
     """Return the name of the population with given `population_id`."""
     sql = 'SELECT name FROM bayesdb_population WHERE id = ?'
@@ -235,6 +270,7 @@ def bayesdb_population_name(bdb, population_id):
     else:
         return row[0]
 
+@_catalog_memoized
 def bayesdb_population_table(bdb, population_id):
     """Return the name of table of the population with id `id`."""
     sql = 'SELECT tabname FROM bayesdb_population WHERE id = ?'
@@ -301,6 +337,7 @@ def bayesdb_add_variable(bdb, population_id, name, stattype):
             (population_id, name, colno, stattype)
             VALUES (?, ?, ?, ?)
     ''', (population_id, name, colno, stattype))
+    bayesdb_invalidate_catalog(bdb)
 
 def bayesdb_has_variable(bdb, population_id, generator_id, name):
     """True if the population has a given variable.
@@ -342,6 +379,7 @@ def bayesdb_variable_numbers(bdb, population_id, generator_id):
     ''', (population_id, generator_id))
     return [colno for (colno,) in cursor]
 
+@_catalog_memoized
 def bayesdb_variable_name(bdb, population_id, generator_id, colno):
     """Return the name a population variable."""
     cursor = bdb.sql_execute('''
@@ -352,6 +390,7 @@ def bayesdb_variable_name(bdb, population_id, generator_id, colno):
     ''', (population_id, generator_id, colno))
     return cursor_value(cursor)
 
+@_catalog_memoized
 def bayesdb_variable_stattype(bdb, population_id, generator_id, colno):
     """Return the statistical type of a population variable."""
     sql = '''
@@ -402,6 +441,7 @@ def bayesdb_add_latent(bdb, population_id, generator_id, var, stattype):
                 (population_id, generator_id, colno, name, stattype)
                 VALUES (?, ?, ?, ?, ?)
         ''', (population_id, generator_id, colno, var, stattype))
+        bayesdb_invalidate_catalog(bdb)
         return colno
 
 def bayesdb_has_latent(bdb, population_id, var):
@@ -489,6 +529,7 @@ def bayesdb_get_generator(bdb, population_id, name):
         assert isinstance(row[0], int)
         return row[0]
 
+@_catalog_memoized
 def bayesdb_generator_name(bdb, generator_id):
     """Return the name of the generator with given `generator_id`."""
     sql = 'SELECT name FROM bayesdb_generator WHERE id = ?'
@@ -502,6 +543,18 @@ def bayesdb_generator_name(bdb, generator_id):
 
 def bayesdb_generator_backend(bdb, generator_id):
     """Return the backend of the generator with given `generator_id`."""
+    backend_name = _generator_backend_name(bdb, generator_id)
+    if backend_name not in bdb.backends:
+        name = bayesdb_generator_name(bdb, generator_id)
+        raise ValueError('Backend of generator %s not registered: %s' %
+            (repr(name), repr(backend_name)))
+    backend = bdb.backends[backend_name]
+    if bdb.profiler is not None:
+        backend = bdb.profiler.backend(backend)
+    return backend
+
+@_catalog_memoized
+def _generator_backend_name(bdb, generator_id):
     sql = 'SELECT backend FROM bayesdb_generator WHERE id = ?'
     cursor = bdb.sql_execute(sql, (generator_id,))
     try:
@@ -509,17 +562,14 @@ def bayesdb_generator_backend(bdb, generator_id):
     except StopIteration:
         raise ValueError('No such generator: %s' % (repr(generator_id),))
     else:
-        if row[0] not in bdb.backends:
-            name = bayesdb_generator_name(bdb, generator_id)
-            raise ValueError('Backend of generator %s not registered: %s' %
-                (repr(name), repr(row[0])))
-        return bdb.backends[row[0]]
+        return row[0]
 
 def bayesdb_generator_table(bdb, generator_id):
     """Return name of table of the generator with given `generator_id`."""
     population_id = bayesdb_generator_population(bdb, generator_id)
     return bayesdb_population_table(bdb, population_id)
 
+@_catalog_memoized
 def bayesdb_generator_population(bdb, generator_id):
     """Return id of population of the generator with given `generator_id`."""
     sql = 'SELECT population_id FROM bayesdb_generator WHERE id = ?'
@@ -587,6 +637,7 @@ def bayesdb_population_row_values(bdb, population_id, rowid):
             % (repr(table_name), repr(population), rowid))
     return row
 
+@_catalog_memoized
 def bayesdb_rowid_tokens(bdb):
     """Return list of built-in tokens that identify rowids (e.g. oid)."""
     tokens = bdb.sql_execute('''
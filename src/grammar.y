@@ -177,6 +177,9 @@ command(analyze_models) ::= K_ANALYZE generator_name(generator)
                                 analysis_program_opt(program).
 command(drop_models)    ::= K_DROP model_token modelset_opt(models)
                                 K_FROM generator_name(generator).
+command(incorporate_rows) ::= K_INCORPORATE K_NEW K_ROWS K_INTO
+                                generator_name(generator)
+                                anlimit_opt(anlimit).
 
 temp_opt(none)          ::= .
 temp_opt(some)          ::= K_TEMP|K_TEMPORARY.
@@ -205,6 +208,9 @@ modelrange(multi)       ::= L_INTEGER(minno) T_MINUS L_INTEGER(maxno).
 anlimit(one)      ::= K_FOR anduration(duration).
 anlimit(two)      ::= K_FOR anduration(duration0) K_OR anduration(duration1).
 
+anlimit_opt(none)       ::= .
+anlimit_opt(some)       ::= anlimit(anlimit).
+
 anckpt_opt(none)        ::= .
 anckpt_opt(some)        ::= K_CHECKPOINT anduration(duration).
 
@@ -811,9 +817,11 @@ typearg(negative)       ::= T_MINUS L_INTEGER(i).
         K_IF
         K_IGNORE
         K_IN
+        K_INCORPORATE
         K_INFER
         K_INFORMATION
         K_INITIALIZE
+        K_INTO
         K_IS
         K_ISNULL
         K_ITERATION
@@ -829,6 +837,7 @@ typearg(negative)       ::= T_MINUS L_INTEGER(i).
         K_MODELLED
         K_MODELS
         K_MUTUAL
+        K_NEW
         K_NOT
         K_NOTNULL
         K_NULL
@@ -21,6 +21,11 @@ sort of Bayesian model selection.  They are based on crude attempts to
 parse data as numbers, and on fixed parameters for distinguishing
 nominal and numerical data.  No columns are ever guessed to be
 cyclic.
+
+:func:`bayesdb_guess_stattypes` holds all the data in memory.
+:func:`bayesdb_guess_stattypes_streaming` makes a single pass over
+the data, keeping only a bounded sketch of each column, and gives the
+same answers as long as no column has too many distinct values.
 """
 
 import collections
@@ -33,7 +38,7 @@ from bayeslite.util import casefold
 from bayeslite.util import unique
 
 def bayesdb_guess_population(bdb, population, table,
-        ifnotexists=None, **kwargs):
+        ifnotexists=None, sample_size=None, **kwargs):
     """Heuristically guess a population schema for `table`.
 
     Based on the data in `table`, create a population named
@@ -41,7 +46,11 @@ def bayesdb_guess_population(bdb, population, table,
 
     :param bool ifnotexists: if true or ``None`` and `population`
         already exists, do nothing.
-    :param dict kwargs: options to pass through to bayesdb_guess_stattypes.
+    :param int sample_size: if not ``None``, guess from a uniform
+        random sample of this many rows rather than from all of them.
+    :param dict kwargs: options to pass through to
+        bayesdb_guess_stattypes_streaming, or to bayesdb_guess_stattypes
+        if `sample_size` is specified.
 
     In addition to statistical types, the overrides may specify
     ``key`` or ``ignore``, in which case those columns will not be
@@ -62,9 +71,13 @@ def bayesdb_guess_population(bdb, population, table,
         qt = sqlite3_quote_name(table)
         cursor = bdb.sql_execute('SELECT * FROM %s' % (qt,))
         column_names = [d[0] for d in cursor.description]
-        rows = cursor.fetchall()
-        stattypes = [st[0] for st in
-            bayesdb_guess_stattypes(column_names, rows, **kwargs)]
+        if sample_size is None:
+            guesses = bayesdb_guess_stattypes_streaming(
+                column_names, cursor, **kwargs)
+        else:
+            rows = reservoir_sample(cursor, sample_size, bdb.py_prng)
+            guesses = bayesdb_guess_stattypes(column_names, rows, **kwargs)
+        stattypes = [st[0] for st in guesses]
         # Convert the `key` column to an `ignore`.
         replace = lambda s: 'ignore' if s == 'key' else s
         column_names, stattypes = unzip([
@@ -131,41 +144,7 @@ def bayesdb_guess_stattypes(column_names, rows, null_values=None,
     if overrides is None:
         overrides = []
 
-    # Build a set of the column names.
-    column_name_set = set()
-    duplicates = set()
-    for name in column_names:
-        if casefold(name) in column_name_set:
-            duplicates.add(name)
-        column_name_set.add(casefold(name))
-    if 0 < len(duplicates):
-        raise ValueError(
-            'Duplicate column names: %s'
-            % (repr(list(duplicates),)))
-
-    # Build a map for the overrides.
-    #
-    # XXX Support more than just stattype: allow arbitrary column
-    # descriptions.
-    override_map = {}
-    unknown = set()
-    duplicates = set()
-    for name, stattype in overrides:
-        if casefold(name) not in column_name_set:
-            unknown.add(name)
-            continue
-        if casefold(name) in override_map:
-            duplicates.add(name)
-            continue
-        override_map[casefold(name)] = casefold(stattype)
-    if 0 < len(unknown):
-        raise ValueError(
-            'Unknown columns overridden: %s'
-            % (repr(list(unknown)),))
-    if 0 < len(duplicates):
-        raise ValueError(
-            'Duplicate columns overridden: %s'
-            % (repr(list(duplicates)),))
+    override_map = _override_map(column_names, overrides)
 
     # Sanity-check the inputs.
     ncols = len(column_names)
@@ -224,26 +203,179 @@ def bayesdb_guess_stattypes(column_names, rows, null_values=None,
         stattypes.append([stattype, reason])
     return stattypes
 
+def bayesdb_guess_stattypes_streaming(column_names, rows, null_values=None,
+        numcat_count=None, numcat_ratio=None, distinct_ratio=None,
+        nullify_ratio=None, overrides=None, max_distinct=None):
+    """Heuristically guess statistical types in one pass over `rows`.
+
+    Like :func:`bayesdb_guess_stattypes`, but `rows` may be any
+    iterable, e.g. a cursor, and is traversed only once.  Rather than
+    the data, we keep for each column the counts of its distinct
+    values, and if there are more than `max_distinct` of those, only
+    a Misra-Gries summary of the most numerous values together with
+    HyperLogLog estimates of the number of distinct values.  The
+    guesses are the same as those of :func:`bayesdb_guess_stattypes`
+    unless a column has more than `max_distinct` distinct values, in
+    which case they are based on these estimates.
+
+    :param int max_distinct: number of distinct values per column to
+        count exactly (default 10000).
+
+    The other parameters are as for :func:`bayesdb_guess_stattypes`.
+    """
+
+    # Fill in default arguments.
+    if null_values is None:
+        null_values = set(("", "N/A", "none", "None"))
+    if numcat_count is None:
+        numcat_count = 20
+    if numcat_ratio is None:
+        numcat_ratio = 0.02
+    if distinct_ratio is None:
+        distinct_ratio = 0.9
+    if nullify_ratio is None:
+        nullify_ratio = 0.9
+    if overrides is None:
+        overrides = []
+    if max_distinct is None:
+        max_distinct = 10000
+
+    override_map = _override_map(column_names, overrides)
+
+    # Sketch the columns we must guess, and the raw values of any
+    # columns overridden as keys.
+    ncols = len(column_names)
+    assert ncols == len(unique(map(casefold, column_names)))
+    sketches = [None] * ncols
+    key_sketches = [None] * ncols
+    for ci, column_name in enumerate(column_names):
+        stattype = override_map.get(casefold(column_name))
+        if stattype is None:
+            sketches[ci] = _ColumnSketch(max_distinct)
+        elif stattype == 'key':
+            key_sketches[ci] = _ColumnSketch(max_distinct)
+    for ri, row in enumerate(rows):
+        if len(row) < ncols:
+            raise ValueError(
+                'Row %d: Too few columns: %d < %d'
+                % (ri, len(row), ncols))
+        if len(row) > ncols:
+            raise ValueError(
+                'Row %d: Too many columns: %d > %d'
+                % (ri, len(row), ncols))
+        for ci, v in enumerate(row):
+            if sketches[ci] is not None:
+                sketches[ci].add(v if v not in null_values else None)
+            elif key_sketches[ci] is not None:
+                key_sketches[ci].add(v)
+
+    # Find a key first, if it has been specified as an override.
+    key = None
+    duplicate_keys = set()
+    for ci, column_name in enumerate(column_names):
+        if key_sketches[ci] is not None:
+            if key is not None:
+                duplicate_keys.add(column_name)
+                continue
+            if not _sketch_keyable_raw_p(key_sketches[ci]):
+                raise ValueError(
+                    'Column non-unique but specified as key: %s'
+                    % (repr(column_name),))
+            key = column_name
+    if 0 < len(duplicate_keys):
+        raise ValueError(
+            'Multiple columns overridden as keys: %s'
+            % (repr(list(duplicate_keys)),))
+
+    # Now go through and guess the other column stattypes or use the override.
+    stattypes = []
+    for ci, column_name in enumerate(column_names):
+        if casefold(column_name) in override_map:
+            stattype = override_map[casefold(column_name)]
+            reason = 'User override.'
+        else:
+            [stattype, reason] = guess_sketch_stattype(
+                sketches[ci],
+                distinct_ratio=distinct_ratio,
+                nullify_ratio=nullify_ratio,
+                numcat_count=numcat_count,
+                numcat_ratio=numcat_ratio,
+                have_key=(key is not None)
+            )
+            if stattype == 'key':
+                key = column_name
+        stattypes.append([stattype, reason])
+    return stattypes
+
+def reservoir_sample(rows, size, prng):
+    """Return a uniform random sample of `size` of the `rows`.
+
+    `rows` may be any iterable and is traversed once.  If it has
+    `size` or fewer elements, return all of them.
+    """
+    if size < 1:
+        raise ValueError('Invalid sample size: %r' % (size,))
+    sample = []
+    for i, row in enumerate(rows):
+        if i < size:
+            sample.append(row)
+        else:
+            j = prng.randint(0, i)
+            if j < size:
+                sample[j] = row
+    return sample
+
+def _override_map(column_names, overrides):
+    # Build a set of the column names.
+    column_name_set = set()
+    duplicates = set()
+    for name in column_names:
+        if casefold(name) in column_name_set:
+            duplicates.add(name)
+        column_name_set.add(casefold(name))
+    if 0 < len(duplicates):
+        raise ValueError(
+            'Duplicate column names: %s'
+            % (repr(list(duplicates),)))
+
+    # Build a map for the overrides.
+    #
+    # XXX Support more than just stattype: allow arbitrary column
+    # descriptions.
+    override_map = {}
+    unknown = set()
+    duplicates = set()
+    for name, stattype in overrides:
+        if casefold(name) not in column_name_set:
+            unknown.add(name)
+            continue
+        if casefold(name) in override_map:
+            duplicates.add(name)
+            continue
+        override_map[casefold(name)] = casefold(stattype)
+    if 0 < len(unknown):
+        raise ValueError(
+            'Unknown columns overridden: %s'
+            % (repr(list(unknown)),))
+    if 0 < len(duplicates):
+        raise ValueError(
+            'Duplicate columns overridden: %s'
+            % (repr(list(duplicates)),))
+    return override_map
+
+
 def guess_column_stattype(column, reason='', **kwargs):
     counts = count_values(column)
     if None in counts:
         del counts[None]
     if len(counts) < 2:
-        return [
-            'ignore',
-            '%s There is only one unique value.' % (reason,)
-        ]
+        return stattype_reason('ignore-unique', reason, **kwargs)
     (most_numerous_key, most_numerous_count) = sorted(
         counts.items(), key=lambda item: item[1], reverse=True)[0]
     if most_numerous_count / float(len(column)) > kwargs['nullify_ratio']:
         column = [None if v == most_numerous_key else v for v in column]
         return guess_column_stattype(
-            column,
-            '%s More than %d percent of the values are the same, so the '
-                'statistical type was guessed based on the remainder of the '
-                'values.' % (reason, int(100 * kwargs['nullify_ratio']),),
-            **kwargs
-        )
+            column, nullified_reason(reason, **kwargs), **kwargs)
     numericable = True
     ints = integerify(column)
     if ints:
@@ -255,13 +387,78 @@ def guess_column_stattype(column, reason='', **kwargs):
         else:
             numericable = False
     if not kwargs['have_key'] and keyable_p(column):
+        return stattype_reason('key', reason, **kwargs)
+    elif numericable and \
+        numerical_p(column, kwargs['numcat_count'], kwargs['numcat_ratio']):
+        return stattype_reason('numerical', reason, **kwargs)
+    elif (len(counts) > kwargs['numcat_count'] and
+        len(counts) / float(len(column)) > kwargs['distinct_ratio']):
+        return stattype_reason('ignore-pseudokey', reason, **kwargs)
+    elif numericable:
+        return stattype_reason('nominal-numerical', reason, **kwargs)
+    else:
+        return stattype_reason('nominal', reason, **kwargs)
+
+def guess_sketch_stattype(sketch, **kwargs):
+    """Guess a stattype as :func:`guess_column_stattype` would.
+
+    `sketch` is a :class:`_ColumnSketch` of the column's values.
+    """
+    n = sketch.n
+    reason = ''
+    removed = []
+    while True:
+        distinct = sketch.distinct() - len(removed)
+        if distinct < 2:
+            return stattype_reason('ignore-unique', reason, **kwargs)
+        (most_numerous_key, most_numerous_count) = sketch.most_numerous(
+            removed)
+        if most_numerous_count / float(n) <= kwargs['nullify_ratio']:
+            break
+        removed.append(most_numerous_key)
+        reason = nullified_reason(reason, **kwargs)
+    # Nullified values count as nulls, which rule out integers.
+    if sketch.nulls == 0 and len(removed) == 0 and sketch.int_p():
+        numeric = 'int'
+    elif sketch.float_p(removed):
+        numeric = 'float'
+    else:
+        numeric = None
+    if not kwargs['have_key'] and sketch.nulls == 0 and len(removed) == 0 \
+            and _sketch_keyable_p(sketch, numeric):
+        return stattype_reason('key', reason, **kwargs)
+    nu = None if numeric is None else \
+        sketch.numeric_distinct(removed, numeric)
+    if numeric is not None and \
+        nu > kwargs['numcat_count'] and \
+        float(nu) / float(n) > kwargs['numcat_ratio']:
+        return stattype_reason('numerical', reason, **kwargs)
+    elif (distinct > kwargs['numcat_count'] and
+        distinct / float(n) > kwargs['distinct_ratio']):
+        return stattype_reason('ignore-pseudokey', reason, **kwargs)
+    elif numeric is not None:
+        return stattype_reason('nominal-numerical', reason, **kwargs)
+    else:
+        return stattype_reason('nominal', reason, **kwargs)
+
+def nullified_reason(reason, **kwargs):
+    return '%s More than %d percent of the values are the same, so the ' \
+        'statistical type was guessed based on the remainder of the ' \
+        'values.' % (reason, int(100 * kwargs['nullify_ratio']),)
+
+def stattype_reason(guess, reason, **kwargs):
+    if guess == 'ignore-unique':
+        return [
+            'ignore',
+            '%s There is only one unique value.' % (reason,)
+        ]
+    elif guess == 'key':
         return [
             'key',
             '%s This was the first column in the table with all distinct '
             'integers or strings.' % (reason,)
         ]
-    elif numericable and \
-        numerical_p(column, kwargs['numcat_count'], kwargs['numcat_ratio']):
+    elif guess == 'numerical':
         return [
             'numerical',
             '%s There are at least %d unique numerical values, '
@@ -270,8 +467,7 @@ def guess_column_stattype(column, reason='', **kwargs):
                 % (reason, kwargs['numcat_count'],
                     int(100 * kwargs['numcat_ratio']))
         ]
-    elif (len(counts) > kwargs['numcat_count'] and
-        len(counts) / float(len(column)) > kwargs['distinct_ratio']):
+    elif guess == 'ignore-pseudokey':
         return [
             'ignore',
             '%s There are more than %d distinct values and they account '
@@ -280,21 +476,22 @@ def guess_column_stattype(column, reason='', **kwargs):
                 % (reason, kwargs['numcat_count'],
                     int(100 * kwargs['distinct_ratio']))
         ]
+    elif guess == 'nominal-numerical':
+        return [
+            'nominal',
+            '%s There are fewer than %d distinct numerical '
+                'values, or the ratio of distinct values to total values '
+                'is less than %d percent.'
+                % (reason, kwargs['numcat_count'],
+                    int(100 * kwargs['numcat_ratio']),)
+        ]
+    elif guess == 'nominal':
+        return [
+            'nominal',
+            '%s The values are nonnumerical.' % (reason,)
+        ]
     else:
-        if numericable:
-            return [
-                'nominal',
-                '%s There are fewer than %d distinct numerical '
-                    'values, or the ratio of distinct values to total values '
-                    'is less than %d percent.'
-                    % (reason, kwargs['numcat_count'],
-                        int(100 * kwargs['numcat_ratio']),)
-            ]
-        else:
-            return [
-                'nominal',
-                '%s The values are nonnumerical.' % (reason,)
-            ]
+        assert False, 'Invalid guess: %r' % (guess,)
 
 
 def nullify(null_values, rows, ci):
@@ -344,3 +541,231 @@ def count_values(column):
     for v in column:
         counts[v] += 1
     return counts
+
+def _sketch_keyable_p(sketch, numeric):
+    # As keyable_p on the integers, floats, or raw values of a column
+    # without nulls.
+    if numeric == 'int':
+        return sketch.count_p(sketch.numeric_distinct([], numeric))
+    elif numeric == 'float':
+        if sketch.nonintegral_p():
+            return False
+        return sketch.count_p(sketch.numeric_distinct([], numeric))
+    else:
+        if sketch.nan_p():
+            return False
+        return sketch.count_p(sketch.distinct())
+
+def _sketch_keyable_raw_p(sketch):
+    # As keyable_p on a column overridden as a key, which is not
+    # nullified and whose values are either integers or raw.
+    if sketch.nulls != 0:
+        return False
+    if sketch.int_p():
+        return _sketch_keyable_p(sketch, 'int')
+    if sketch.nan_p():
+        return False
+    if sketch.float_p([]) and sketch.nonintegral_p():
+        return False
+    return sketch.count_p(sketch.distinct())
+
+class _ColumnSketch(object):
+    """Bounded-memory summary of the values in a column.
+
+    Counts distinct values exactly until there are more than
+    `max_distinct` of them.  Thereafter, keeps between `max_distinct`
+    and twice as many Misra-Gries counters for the most numerous
+    values, HyperLogLog sketches of the distinct
+    values and of the distinct numbers they parse as, and flags for
+    the properties of the values that the guessing heuristics need.
+    """
+
+    # Number of values that fail to parse as numbers to remember
+    # after we stop counting exactly.  If more fail, no number of
+    # nullified values can make the column numerical.
+    _MAX_UNFLOATABLE = 16
+
+    def __init__(self, max_distinct):
+        assert 0 < max_distinct
+        self.max_distinct = max_distinct
+        self.n = 0
+        self.nulls = 0
+        self.counts = {}
+        self.exact = True
+        self.float_class = False
+        self._distinct = None
+        self._numeric = None
+        self._int_fail = False
+        self._unfloatable = None
+        self._nan = False
+        self._nonintegral = False
+
+    def add(self, v):
+        self.n += 1
+        if v is None:
+            self.nulls += 1
+            return
+        # Equal values of different types share a counter, so note
+        # floats as they come.
+        if v.__class__ is float:
+            self.float_class = True
+        counts = self.counts
+        if v in counts:
+            counts[v] += 1
+        elif self.exact:
+            counts[v] = 1
+            if len(counts) > self.max_distinct:
+                self._spill()
+        else:
+            self._observe(v)
+            counts[v] = 1
+            if len(counts) > 2*self.max_distinct:
+                self._prune()
+
+    def _spill(self):
+        self.exact = False
+        self._distinct = _HyperLogLog()
+        self._numeric = _HyperLogLog()
+        self._unfloatable = set()
+        for k in self.counts:
+            self._observe(k)
+
+    def _prune(self):
+        # Misra-Gries, decrementing in bulk: charge the median count
+        # against every counter and forget those that run out.  Each
+        # count remains a lower bound on the number of occurrences of
+        # its value, short by at most n/max_distinct.
+        counts = self.counts
+        median = sorted(counts.itervalues())[len(counts) // 2]
+        for k in counts.keys():
+            if counts[k] <= median:
+                del counts[k]
+            else:
+                counts[k] -= median
+
+    def _observe(self, v):
+        self._distinct.add(v)
+        i = None
+        if v.__class__ is not float:
+            try:
+                i = int(v)
+            except (ValueError, TypeError):
+                self._int_fail = True
+        try:
+            f = float(v)
+        except (ValueError, TypeError):
+            if len(self._unfloatable) <= self._MAX_UNFLOATABLE:
+                self._unfloatable.add(v)
+            return
+        if math.isnan(f):
+            self._nan = self._nan or v.__class__ is float
+            self._nonintegral = True
+            return
+        if not f.is_integer():
+            self._nonintegral = True
+        self._numeric.add(f if i is None else i)
+
+    def distinct(self):
+        """Number of distinct non-null values."""
+        if self.exact:
+            return len(self.counts)
+        return self._distinct.estimate()
+
+    def count_p(self, count):
+        """True if `count` distinct values means all values are distinct."""
+        if self.exact:
+            return count == self.n
+        if any(c > 1 for c in self.counts.itervalues()):
+            return False
+        # Three standard errors of the HyperLogLog estimate.
+        return abs(count - self.n) <= 3*_HyperLogLog.ERROR*self.n
+
+    def most_numerous(self, removed):
+        """(value, count) of the most numerous value not in `removed`."""
+        best = (None, 0)
+        for k, c in self.counts.iteritems():
+            if c > best[1] and k not in removed:
+                best = (k, c)
+        return best
+
+    def int_p(self):
+        """True if every value parses as an integer and none is a float."""
+        if self.float_class:
+            return False
+        if self.exact:
+            return integerify(self.counts.keys()) is not None
+        return not self._int_fail
+
+    def float_p(self, removed):
+        """True if every value not in `removed` parses as a float."""
+        if self.exact:
+            return floatify(
+                [k for k in self.counts if k not in removed]) is not None
+        if len(self._unfloatable) > self._MAX_UNFLOATABLE:
+            return False
+        return all(v in removed for v in self._unfloatable)
+
+    def nan_p(self):
+        """True if any value is a floating-point NaN."""
+        if self.exact:
+            return any(isinstance(k, float) and math.isnan(k)
+                for k in self.counts)
+        return self._nan
+
+    def nonintegral_p(self):
+        """True if any value parses as a float that is not an integer."""
+        if self.exact:
+            for k in self.counts:
+                try:
+                    if not float(k).is_integer():
+                        return True
+                except (ValueError, TypeError):
+                    pass
+            return False
+        return self._nonintegral
+
+    def numeric_distinct(self, removed, numeric):
+        """Number of distinct numbers, excluding NaN, parsed from the
+        values not in `removed`, as integers or floats per `numeric`.
+        """
+        if self.exact:
+            values = [k for k in self.counts if k not in removed]
+            if numeric == 'int':
+                return len(unique(integerify(values)))
+            floats = floatify(values)
+            return len(unique([v for v in floats if not math.isnan(v)]))
+        return max(0, self._numeric.estimate() - len(removed))
+
+class _HyperLogLog(object):
+    """HyperLogLog estimate of the number of distinct hashable values.
+
+    Values that compare equal, such as ``1`` and ``1.0``, count once.
+    """
+
+    P = 14
+    M = 1 << P
+    ERROR = 1.04 / math.sqrt(M)
+
+    def __init__(self):
+        self.registers = bytearray(self.M)
+
+    def add(self, v):
+        # Spread Python's hash over 64 bits with the splitmix64 finalizer.
+        z = (hash(v) + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+        z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+        z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+        z ^= z >> 31
+        i = z >> (64 - self.P)
+        w = z & ((1 << (64 - self.P)) - 1)
+        rank = 64 - self.P - w.bit_length() + 1
+        if self.registers[i] < rank:
+            self.registers[i] = rank
+
+    def estimate(self):
+        m = self.M
+        alpha = 0.7213 / (1 + 1.079/m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(b'\0')
+        if estimate <= 2.5*m and zeros != 0:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
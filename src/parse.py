@@ -260,10 +260,7 @@ class BQLSemantics(object):
         return ast.InitModels(ifnotexists, generator, n)
     def p_command_analyze_models(
             self, generator, models, anlimit, anckpt, program):
-        iters = [lim[1] for lim in anlimit if lim and lim[0] == 'iterations']
-        secs = [lim[1] for lim in anlimit if lim and lim[0] == 'seconds']
-        iterations = min(iters) if iters else None
-        seconds = min(secs) if secs else None
+        iterations, seconds = self._anlimit(anlimit)
         ckpt_iterations = None
         ckpt_seconds = None
         if anckpt is not None:
@@ -273,6 +270,16 @@ class BQLSemantics(object):
             ckpt_iterations, ckpt_seconds, program)
     def p_command_drop_models(self, models, generator):
         return ast.DropModels(generator, models)
+    def p_command_incorporate_rows(self, generator, anlimit):
+        iterations, seconds = self._anlimit(anlimit)
+        return ast.IncorporateRows(generator, iterations, seconds)
+
+    def _anlimit(self, anlimit):
+        iters = [lim[1] for lim in anlimit if lim and lim[0] == 'iterations']
+        secs = [lim[1] for lim in anlimit if lim and lim[0] == 'seconds']
+        iterations = min(iters) if iters else None
+        seconds = min(secs) if secs else None
+        return (iterations, seconds)
 
     def p_temp_opt_none(self):                  return False
     def p_temp_opt_some(self):                  return True
@@ -294,6 +301,8 @@ class BQLSemantics(object):
 
     def p_anlimit_one(self, duration):             return (duration, None)
     def p_anlimit_two(self, duration0, duration1): return (duration0, duration1)
+    def p_anlimit_opt_none(self):               return (None, None)
+    def p_anlimit_opt_some(self, anlimit):      return anlimit
     def p_anckpt_opt_none(self):                return None
     def p_anckpt_opt_some(self, duration):      return duration
 
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+
+"""Profile where the time of BQL queries goes.
+
+Establish a profiler on a BayesDB with :meth:`BayesDB.profile`::
+
+    profiler = bdb.profile()
+    bdb.execute('ESTIMATE DEPENDENCE PROBABILITY FROM PAIRWISE VARIABLES'
+        ' OF p').fetchall()
+    bdb.unprofile(profiler)
+    profiler.dump(sys.stdout)
+
+The profiler accumulates the wall time and number of calls of each
+parse of BQL, each compilation of a BQL query to SQL, each SQL
+statement, each BQL function called by SQLite, and each backend
+method, per generator.
+
+Times are inclusive: the time of a SQL statement includes the time
+of the BQL functions it called, which includes the time of the
+backend methods they called.
+"""
+
+import contextlib
+import threading
+import timeit
+
+from bayeslite.util import json_dumps
+
+CATEGORIES = ('parse', 'compile', 'sql', 'bql', 'backend')
+
+class BayesDBProfiler(object):
+    """Accumulated wall time and call counts by category and name.
+
+    The categories are ``'parse'``, ``'compile'``, ``'sql'``, ``'bql'``
+    for BQL functions, and ``'backend'`` for backend methods, which
+    are also distinguished by generator id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._entries.clear()
+
+    def record(self, category, name, seconds, generator_id=None):
+        """Record a call of `name` in `category` taking `seconds`."""
+        assert category in CATEGORIES
+        key = (category, name, generator_id)
+        # Backend methods may be called concurrently, one thread per
+        # generator.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    @contextlib.contextmanager
+    def timing(self, category, name, generator_id=None):
+        """Record the time spent in the body of a `with` statement."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.record(category, name, timeit.default_timer() - start,
+                generator_id)
+
+    def backend(self, backend):
+        """Return a proxy for `backend` recording its method calls."""
+        return ProfiledBackend(self, backend)
+
+    def stats(self):
+        """Return the entries recorded, slowest first.
+
+        Each entry is a tuple ``(category, name, generator_id, calls,
+        seconds)``.
+        """
+        with self._lock:
+            entries = [
+                key + tuple(value) for key, value in self._entries.iteritems()
+            ]
+        entries.sort(key=lambda entry: (-entry[4], entry[:3]))
+        return entries
+
+    def dump(self, f, format='table'):
+        """Write the entries recorded to `f` as a table or as JSON."""
+        entries = self.stats()
+        if format == 'json':
+            f.write(json_dumps([
+                {
+                    'category': category,
+                    'name': name,
+                    'generator_id': generator_id,
+                    'calls': calls,
+                    'seconds': seconds,
+                }
+                for category, name, generator_id, calls, seconds in entries
+            ]))
+            f.write('\n')
+        elif format == 'table':
+            f.write('%12s %8s %10s %9s  %s\n'
+                % ('seconds', 'calls', 'category', 'generator', 'name'))
+            for category, name, generator_id, calls, seconds in entries:
+                f.write('%12.6f %8d %10s %9s  %s\n' % (seconds, calls,
+                    category, '' if generator_id is None else generator_id,
+                    ' '.join(name.split())))
+        else:
+            raise ValueError('Unknown profile format: %r' % (format,))
+
+class ProfiledBackend(object):
+    """Proxy for a backend recording the time of its method calls.
+
+    Backend methods take the BayesDB and the generator id as their
+    first two arguments, so calls are recorded per generator.
+    """
+
+    def __init__(self, profiler, backend):
+        self._profiler = profiler
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr):
+            return attr
+        profiler = self._profiler
+        method_name = '%s.%s' % (self._backend.name(), name)
+        def method(*args, **kwargs):
+            generator_id = None
+            if 1 < len(args) and isinstance(args[1], int):
+                generator_id = args[1]
+            with profiler.timing('backend', method_name, generator_id):
+                return attr(*args, **kwargs)
+        return method
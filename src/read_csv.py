@@ -14,15 +14,21 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import contextlib
 import csv
+import itertools
+import time
 
 import bayeslite.core as core
 
 from bayeslite.sqlite3_util import sqlite3_quote_name
 from bayeslite.util import casefold
 
+# Number of rows to parse before inserting them all at once.
+CHUNK_SIZE = 10000
+
 def bayesdb_read_csv_file(bdb, table, pathname, header=False, create=False,
-        ifnotexists=False):
+        ifnotexists=False, progress=None, bulk_pragmas=False):
     """Read CSV data from a file into a table.
 
     :param bayeslite.BayesDB bdb: BayesDB instance
@@ -31,21 +37,34 @@ def bayesdb_read_csv_file(bdb, table, pathname, header=False, create=False,
     :param bool header: if true, first line specifies column names
     :param bool create: if true and `table` does not exist, create it
     :param bool ifnotexists: if true and `table` exists, do it anyway
+    :param function progress: called with the number of rows read and
+        the elapsed time in seconds after each chunk of rows
+    :param bool bulk_pragmas: if true, set the SQLite PRAGMAs for bulk
+        loading while reading: see :func:`bayesdb_bulk_load_pragmas`
     """
     with open(pathname, 'rU') as f:
         bayesdb_read_csv(bdb, table, f, header=header, create=create,
-            ifnotexists=ifnotexists)
+            ifnotexists=ifnotexists, progress=progress,
+            bulk_pragmas=bulk_pragmas)
 
 def bayesdb_read_csv(bdb, table, f, header=False,
-        create=False, ifnotexists=False):
+        create=False, ifnotexists=False, progress=None, bulk_pragmas=False):
     """Read CSV data from a line iterator into a table.
 
+    Rows are inserted in chunks of :data:`CHUNK_SIZE`, all in a single
+    transaction.
+
     :param bayeslite.BayesDB bdb: BayesDB instance
     :param str table: name of table
     :param iterable f: iterator returning lines as :class:`str`
     :param bool header: if true, first line specifies column names
     :param bool create: if true and `table` does not exist, create it
     :param bool ifnotexists: if true and `table` exists, do it anyway
+    :param function progress: called with the number of rows read and
+        the elapsed time in seconds after each chunk of rows
+    :param bool bulk_pragmas: if true, set the SQLite PRAGMAs for bulk
+        loading while reading, at the risk of corrupting the database
+        in a crash: see :func:`bayesdb_bulk_load_pragmas`
     """
     if not header:
         if create:
@@ -53,6 +72,13 @@ def bayesdb_read_csv(bdb, table, f, header=False,
     if not create:
         if ifnotexists:
             raise ValueError('Not creating table whether or not exists!')
+    if bulk_pragmas:
+        with bayesdb_bulk_load_pragmas(bdb):
+            _read_csv(bdb, table, f, header, create, ifnotexists, progress)
+    else:
+        _read_csv(bdb, table, f, header, create, ifnotexists, progress)
+
+def _read_csv(bdb, table, f, header, create, ifnotexists, progress):
     with bdb.savepoint():
         if core.bayesdb_has_table(bdb, table):
             if create and not ifnotexists:
@@ -111,11 +137,59 @@ def bayesdb_read_csv(bdb, table, f, header=False,
         # execute a cursor, which also binds and steps the statement.
         sql = 'INSERT INTO %s (%s) VALUES (%s)' % \
             (qt, ','.join(qcns), ','.join('?' for _qcn in qcns))
-        for row in reader:
-            if len(row) < ncols:
-                raise IOError('Line %d: Too few columns: %d < %d' %
-                    (line, len(row), ncols))
-            if len(row) > ncols:
-                raise IOError('Line %d: Too many columns: %d > %d' %
-                    (line, len(row), ncols))
-            bdb.sql_execute(sql, [unicode(v, 'utf8').strip() for v in row])
+        start = time.time()
+        nrows = 0
+        while True:
+            chunk = list(itertools.islice(reader, CHUNK_SIZE))
+            if not chunk:
+                break
+            for i, row in enumerate(chunk):
+                if len(row) < ncols:
+                    raise IOError('Line %d: Too few columns: %d < %d' %
+                        (line + i, len(row), ncols))
+                if len(row) > ncols:
+                    raise IOError('Line %d: Too many columns: %d > %d' %
+                        (line + i, len(row), ncols))
+            bdb.sql_executemany(sql, [
+                [unicode(v, 'utf8').strip() for v in row]
+                for row in chunk
+            ])
+            line += len(chunk)
+            nrows += len(chunk)
+            if progress is not None:
+                progress(nrows, time.time() - start)
+
+@contextlib.contextmanager
+def bayesdb_bulk_load_pragmas(bdb):
+    """Context in which SQLite is configured for fast bulk loading.
+
+    Disables synchronous writes, enlarges the page cache, and keeps the
+    rollback journal in memory, restoring the previous settings on
+    exit.  A crash during the context may corrupt the database.  The
+    settings cannot be changed in a transaction, so if one is in
+    progress, this does nothing.
+    """
+    if bdb._txn_depth != 0:
+        yield
+        return
+    def pragma(name, value=None):
+        if value is None:
+            return bdb.sql_execute('PRAGMA %s' % (name,)).fetchvalue()
+        # Some assignments return the new value and some return nothing;
+        # run the statement to completion either way.
+        bdb.sql_execute('PRAGMA %s = %s' % (name, value)).fetchall()
+    synchronous = pragma('synchronous')
+    cache_size = pragma('cache_size')
+    journal_mode = pragma('journal_mode')
+    pragma('synchronous', 'OFF')
+    pragma('cache_size', -65536)        # 64 MB
+    # Don't leave WAL mode, which other connections may rely on.
+    if journal_mode in ('delete', 'truncate', 'persist'):
+        pragma('journal_mode', 'MEMORY')
+    try:
+        yield
+    finally:
+        if journal_mode in ('delete', 'truncate', 'persist'):
+            pragma('journal_mode', journal_mode.upper())
+        pragma('cache_size', cache_size)
+        pragma('synchronous', synchronous)
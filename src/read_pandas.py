@@ -14,14 +14,20 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-"""Reading data from pandas dataframes."""
+"""Reading data from and into pandas dataframes."""
+
+import itertools
 
 import bayeslite.core as core
 
+from bayeslite.read_csv import bayesdb_bulk_load_pragmas
 from bayeslite.sqlite3_util import sqlite3_quote_name
 
+# Number of rows to convert and insert, or fetch, at once.
+CHUNK_SIZE = 10000
+
 def bayesdb_read_pandas_df(bdb, table, df, create=False, ifnotexists=False,
-        index=None):
+        index=None, bulk_pragmas=False):
     """Read data from a pandas dataframe into a table.
 
     :param bayeslite.BayesDB bdb: BayesDB instance
@@ -31,15 +37,29 @@ def bayesdb_read_pandas_df(bdb, table, df, create=False, ifnotexists=False,
     :param bool ifnotexists: if true, and `create` is true` and `table`
         exists, read data into it anyway
     :param str index: name of column for index
+    :param bool bulk_pragmas: if true, set the SQLite PRAGMAs for bulk
+        loading while reading, at the risk of corrupting the database
+        in a crash: see :func:`bayeslite.read_csv.bayesdb_bulk_load_pragmas`
 
     If `index` is `None`, then the dataframe's index dtype must be
     convertible to int64, and it is mapped to the table's rowids.  If
     the dataframe's index dtype is not convertible to int64, you must
     specify `index` to give a primary key for the table.
+
+    The columns are converted to Python values in chunks of
+    :data:`CHUNK_SIZE` rows, which are inserted all at once, in a
+    single transaction.
     """
     if not create:
         if ifnotexists:
             raise ValueError('Not creating table whether or not exists!')
+    if bulk_pragmas:
+        with bayesdb_bulk_load_pragmas(bdb):
+            _read_pandas_df(bdb, table, df, create, ifnotexists, index)
+    else:
+        _read_pandas_df(bdb, table, df, create, ifnotexists, index)
+
+def _read_pandas_df(bdb, table, df, create, ifnotexists, index):
     column_names = [str(column) for column in df.columns]
     if index is None:
         create_column_names = column_names
@@ -82,5 +102,47 @@ def bayesdb_read_pandas_df(bdb, table, df, create=False, ifnotexists=False,
         qicns = map(sqlite3_quote_name, insert_column_names)
         sql = 'INSERT INTO %s (%s) VALUES (%s)' % \
             (qt, ','.join(qicns), ','.join('?' for _qicn in qicns))
-        for key, i in zip(key_index, df.index):
-            bdb.sql_execute(sql, (key,) + tuple(df.ix[i]))
+        # Convert each column to a NumPy array once, and then to Python
+        # values a chunk at a time, which the database can bind.
+        keys = key_index.values
+        arrays = [df.iloc[:, j].values for j in xrange(len(df.columns))]
+        for start in xrange(0, len(df.index), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            chunk = [keys[start:end].tolist()] + \
+                [array[start:end].tolist() for array in arrays]
+            bdb.sql_executemany(sql, itertools.izip(*chunk))
+
+def bayesdb_to_pandas_df(bdb, query, bindings=None):
+    """Return a pandas dataframe of the results of a BQL query.
+
+    :param bayeslite.BayesDB bdb: BayesDB instance
+    :param str query: BQL query
+    :param bindings: bindings for parameters in `query`, as for
+        :meth:`bayeslite.BayesDB.execute`
+
+    The columns of the dataframe are named by the columns of the
+    query, and its index is the default integer index.  Results are
+    fetched :data:`CHUNK_SIZE` rows at a time and accumulated column
+    by column, so each column's dtype is inferred once at the end.
+
+    A query with no results yields an empty dataframe.  It has no
+    columns either, because a BayesDB cursor describes no columns
+    once it has found there are no rows.
+    """
+    # Import here: pandas is needed only for this feature, and we take
+    # dataframes from, but do not otherwise depend on, pandas.
+    import pandas
+    cursor = bdb.execute(query, bindings)
+    names = [d[0] for d in cursor.description]
+    columns = [[] for _name in names]
+    while True:
+        rows = list(itertools.islice(cursor, CHUNK_SIZE))
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    # Key the columns by position, since names may repeat.
+    df = pandas.DataFrame(dict(enumerate(columns)),
+        columns=range(len(columns)))
+    df.columns = names
+    return df
@@ -79,9 +79,11 @@ keywords = {
     "if": grammar.K_IF,
     "ignore": grammar.K_IGNORE,
     "in": grammar.K_IN,
+    "incorporate": grammar.K_INCORPORATE,
     "infer": grammar.K_INFER,
     "information": grammar.K_INFORMATION,
     "initialize": grammar.K_INITIALIZE,
+    "into": grammar.K_INTO,
     "is": grammar.K_IS,
     "isnull": grammar.K_ISNULL,
     "iteration": grammar.K_ITERATION,
@@ -97,6 +99,7 @@ keywords = {
     "modelled": grammar.K_MODELLED,
     "models": grammar.K_MODELS,
     "mutual": grammar.K_MUTUAL,
+    "new": grammar.K_NEW,
     "not": grammar.K_NOT,
     "notnull": grammar.K_NOTNULL,
     "null": grammar.K_NULL,
@@ -14,12 +14,20 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import apsw
+import struct
+
 from bayeslite.exception import BayesDBException
 from bayeslite.util import cursor_value
 
 APPLICATION_ID = 0x42594442
 STALE_VERSIONS = (1,)
-USABLE_VERSIONS = (11, 12)
+USABLE_VERSIONS = (11, 12, 13)
+
+# Integrity check levels for bayesdb_install_schema, from weakest to
+# strongest, and the SQLite PRAGMA for each.
+CHECK_LEVELS = ('none', 'quick', 'full')
+CHECK_PRAGMAS = {'quick': 'quick_check', 'full': 'integrity_check'}
 
 LATEST_VERSION = USABLE_VERSIONS[-1]
 
@@ -147,9 +155,24 @@ BEGIN
 END;
 '''
 
+bayesdb_schema_12to13 = '''
+PRAGMA user_version = 13;
+
+CREATE TABLE bayesdb_check (
+    level           TEXT NOT NULL PRIMARY KEY
+                        CHECK (level IN ('quick', 'full')),
+    change_counter  INTEGER NOT NULL
+);
+'''
+
 ### BayesDB SQLite setup
 
-def bayesdb_install_schema(bdb, version=None, compatible=None):
+def bayesdb_install_schema(bdb, version=None, compatible=None, check=None):
+    if check is None:
+        check = 'full'
+    if check not in CHECK_LEVELS:
+        raise ValueError('Invalid integrity check level: %r' % (check,))
+
     # Get the application id.
     cursor = bdb.sql_execute('PRAGMA application_id')
     application_id = 0
@@ -194,8 +217,7 @@ def bayesdb_install_schema(bdb, version=None, compatible=None):
     if install or not compatible:
         _upgrade_schema(bdb, user_version, desired_version=version)
     bdb.sql_execute('PRAGMA foreign_keys = ON')
-    bdb.sql_execute('PRAGMA integrity_check')
-    bdb.sql_execute('PRAGMA foreign_key_check')
+    _check_integrity(bdb, check)
 
 def _upgrade_schema(bdb, current_version=None, desired_version=None):
     if current_version is None:
@@ -215,12 +237,73 @@ def _upgrade_schema(bdb, current_version=None, desired_version=None):
         with bdb.transaction():
             bdb.sql_execute(bayesdb_schema_11to12)
         current_version = 12
-    bdb.sql_execute('PRAGMA integrity_check')
-    bdb.sql_execute('PRAGMA foreign_key_check')
+    if current_version == 12 and current_version < desired_version:
+        with bdb.transaction():
+            bdb.sql_execute(bayesdb_schema_12to13)
+        current_version = 13
 
 def _schema_version(bdb):
     return cursor_value(bdb.sql_execute('PRAGMA user_version'))
 
+def _check_integrity(bdb, level):
+    """Check the database's integrity at `level` unless done already.
+
+    A successful check of a database file is recorded in it, with the
+    value the file's change counter will have once the record is
+    committed.  SQLite increments the change counter whenever it
+    commits changes to the file, so if the counter still matches when
+    the file is next opened, the file has not changed and the check
+    need not be repeated.  In WAL mode the counter is not maintained,
+    so checks are not recorded.
+    """
+    if level == 'none':
+        return
+    counter = _change_counter(bdb)
+    if counter is not None:
+        cursor = bdb.sql_execute('''
+            SELECT level FROM bayesdb_check WHERE change_counter = ?
+        ''', (counter,))
+        checked = set(checked_level for (checked_level,) in cursor)
+        if 'full' in checked or level in checked:
+            return
+    _run_integrity_check(bdb, level)
+    if counter is not None:
+        try:
+            with bdb.transaction():
+                bdb.sql_execute('DELETE FROM bayesdb_check')
+                bdb.sql_execute('''
+                    INSERT INTO bayesdb_check (level, change_counter)
+                        VALUES (?, ?)
+                ''', (level, (counter + 1) & 0xffffffff))
+        except apsw.ReadOnlyError:
+            pass
+
+def _run_integrity_check(bdb, level):
+    pragma = CHECK_PRAGMAS[level]
+    results = bdb.sql_execute('PRAGMA %s' % (pragma,)).fetchall()
+    if results != [('ok',)]:
+        raise IOError('Database failed %s: %s' %
+            (pragma, '; '.join(str(result) for (result,) in results)))
+    violations = bdb.sql_execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise IOError('Database failed foreign_key_check: %r' %
+            (violations,))
+
+def _change_counter(bdb):
+    # Return the file change counter from the database file header,
+    # or None if checks cannot be recorded for this database.
+    if bdb.pathname == ':memory:' or _schema_version(bdb) < 13:
+        return None
+    journal_mode = cursor_value(bdb.sql_execute('PRAGMA journal_mode'))
+    if journal_mode == 'wal':
+        return None
+    with open(bdb.pathname, 'rb') as f:
+        f.seek(24)
+        header = f.read(4)
+    if len(header) != 4:
+        return None
+    return struct.unpack('>I', header)[0]
+
 def bayesdb_upgrade_schema(bdb, version=None):
     """Upgrade the BayesDB internal database schema.
 
@@ -229,6 +312,7 @@ def bayesdb_upgrade_schema(bdb, version=None):
     version number.
     """
     _upgrade_schema(bdb, current_version=None, desired_version=version)
+    _run_integrity_check(bdb, 'full')
 
 def bayesdb_schema_version(bdb):
     """Return the version number for the BayesDB internal database schema."""
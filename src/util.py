@@ -16,6 +16,7 @@
 
 """Miscellaneous utilities."""
 
+import collections
 import json
 import math
 
@@ -114,3 +115,45 @@ def override(interface):
         assert method.__name__ in dir(interface)
         return method
     return wrap
+
+class LRUCache(object):
+    """Map of at most `capacity` entries, evicting the least recently used.
+
+    Counts the `hits` and `misses` of :meth:`get`.  A capacity of zero
+    disables the cache.
+    """
+
+    def __init__(self, capacity):
+        assert 0 <= capacity
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the entry for `key`, or None if there is none."""
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Set the entry for `key` to `value`, which must not be None."""
+        assert value is not None
+        self._entries.pop(key, None)
+        if self.capacity == 0:
+            return
+        while self.capacity <= len(self._entries):
+            self._entries.popitem(last=False)
+        self._entries[key] = value
+
+    def clear(self):
+        """Forget all entries, but not the counts of hits and misses."""
+        self._entries.clear()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+#   Copyright (c) 2010-2016, MIT Probabilistic Computing Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+
+import json
+
+from StringIO import StringIO
+
+import pytest
+
+from bayeslite.bench import STAGES
+from bayeslite.bench import dump_benchmarks
+from bayeslite.bench import run_benchmarks
+from bayeslite.bench import synthetic_table
+
+def test_synthetic_table():
+    names, stattypes, data = synthetic_table(20, 5, seed=1)
+    assert names == ['c0', 'c1', 'c2', 'c3', 'c4']
+    assert stattypes == ['numerical', 'nominal'] * 2 + ['numerical']
+    assert len(data) == 20
+    assert all(len(row) == 5 for row in data)
+    assert all(isinstance(row[0], float) for row in data)
+    assert all(row[1].startswith('s') for row in data)
+    assert synthetic_table(20, 5, seed=1) == (names, stattypes, data)
+    assert synthetic_table(20, 5, seed=2) != (names, stattypes, data)
+    with pytest.raises(ValueError):
+        synthetic_table(20, 5, stattypes=['cyclic'])
+
+def test_run_benchmarks():
+    results = run_benchmarks(backends=['nig_normal', 'std_normal'],
+        rows=20, columns=4, models=2, iterations=1, pairwise_rows=10,
+        simulate_rows=10, repeat=2)
+    assert results['parameters']['rows'] == 20
+    seconds = results['seconds']
+    assert sorted(seconds) == ['nig_normal', 'std_normal']
+    assert sorted(seconds['nig_normal']) == sorted(STAGES)
+    assert 'infer' not in seconds['std_normal']
+    assert all(s >= 0 for s in seconds['nig_normal'].itervalues())
+    f = StringIO()
+    dump_benchmarks(results, f)
+    assert json.loads(f.getvalue()) == json.loads(json.dumps(results))
+    with pytest.raises(ValueError):
+        run_benchmarks(backends=['nonesuch'])
@@ -16,11 +16,14 @@
 
 import StringIO
 import apsw
+import json
 import pytest
 import struct
+import time
 
 import bayeslite
 import bayeslite.ast as ast
+import bayeslite.bqlfn as bqlfn
 import bayeslite.compiler as compiler
 import bayeslite.core as core
 import bayeslite.guess as guess
@@ -30,6 +33,7 @@ import bayeslite.parse as parse
 from bayeslite.exception import BQLError
 from bayeslite.math_util import relerr
 from bayeslite.backends.cgpm_backend import CGPM_Backend
+from bayeslite.backends.nig_normal import NIGNormalBackend
 from bayeslite.util import cursor_value
 
 import test_core
@@ -438,6 +442,11 @@ def test_select_trivial():
         'SELECT CASE "f"("a") WHEN ("b" + "c") THEN "d" ELSE "e" END FROM "t";'
 
 def test_estimate_bql():
+    # LIMIT without batching keeps the query as written.
+    assert bql2sql('estimate age from p1 limit 3;') == \
+        'SELECT "age" FROM "t1" LIMIT 3;'
+    assert bql2sql('estimate age from p1 where weight > 1 limit 3;') == \
+        'SELECT "age" FROM "t1" WHERE ("weight" > 1) LIMIT 3;'
     # PREDICTIVE PROBABILITY
     assert bql2sql('estimate predictive probability of weight from p1;') == \
         'SELECT bql_row_column_predictive_probability(1, NULL, NULL, _rowid_, '\
@@ -1511,6 +1520,53 @@ def test_trivial_deadline():
         bdb.execute('initialize 1 model for p1_cc')
         bdb.execute('analyze p1_cc for 1 second')
 
+def test_query_caches():
+    with test_core.t1() as (bdb, population_id, _generator_id):
+        sql = []
+        def trace(string, _bindings):
+            sql.append(string)
+        bdb.sql_trace(trace)
+        # The fixture has already executed BQL, so count from here.
+        phrase_cache = bdb.phrase_cache
+        sql_cache = bdb.sql_cache
+        phrase_hits, phrase_misses = phrase_cache.hits, phrase_cache.misses
+        sql_hits, sql_misses = sql_cache.hits, sql_cache.misses
+        def phrase_counts():
+            return (phrase_cache.hits - phrase_hits,
+                phrase_cache.misses - phrase_misses)
+        def sql_counts():
+            return (sql_cache.hits - sql_hits, sql_cache.misses - sql_misses)
+        query = 'estimate age from p1 where _rowid_ = ?'
+        assert bdb.execute(query, (1,)).fetchall() == [(12,)]
+        assert (phrase_counts()[1], sql_counts()[1]) == (1, 1)
+        assert len(sql) > 1
+        # The second time, we neither parse nor compile the query.
+        del sql[:]
+        assert bdb.execute(query, (2,)).fetchall() == [(14,)]
+        assert (phrase_counts()[0], sql_counts()[0]) == (1, 1)
+        assert len(sql) == 1
+        query = 'estimate age + :x from p1 where _rowid_ = :r'
+        assert bdb.execute(query, {':x': 1, ':r': 1}).fetchall() == [(13,)]
+        assert bdb.execute(query, {':r': 2, ':x': 2}).fetchall() == [(16,)]
+        with pytest.raises(ValueError):
+            bdb.execute(query, {':x': 1})
+        assert sql_counts()[0] == 3
+        # Changing the schema invalidates the compiled SQL.
+        misses = sql_counts()[1]
+        bdb.sql_execute('create table u (x)')
+        assert bdb.execute(query, {':x': 1, ':r': 1}).fetchall() == [(13,)]
+        assert sql_counts() == (3, misses + 1)
+        # Queries evaluated partly at compile time, as pairwise queries
+        # are in batches, are not cached.
+        bdb.batch_size = 2
+        query = 'estimate correlation from pairwise variables of p1' \
+            ' for age, weight'
+        assert len(bdb.execute(query).fetchall()) == 4
+        assert len(bdb.execute(query).fetchall()) == 4
+        assert phrase_counts()[0] == 5
+        assert sql_counts()[0] == 3
+        bdb.sql_untrace(trace)
+
 def test_parametrized():
     assert bql2sqlparam('select * from t where id = ?') == \
         'SELECT * FROM "t" WHERE ("id" = ?1);'
@@ -1605,8 +1661,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT tabname FROM bayesdb_population'
-                ' WHERE id = ?',
             'SELECT bql_row_similarity(1, NULL, NULL, _rowid_,'
                 ' (SELECT _rowid_ FROM "t" WHERE ("rowid" = 1)), 0) FROM "t"',
             'SELECT id FROM bayesdb_generator WHERE population_id = ?',
@@ -1642,7 +1696,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT tabname FROM bayesdb_population WHERE id = ?',
             # ESTIMATE SIMILARITY TO (rowid=1):
             'SELECT bql_row_similarity(1, NULL, NULL, _rowid_,'
                 ' (SELECT _rowid_ FROM "t" WHERE ("rowid" = 1)), 0) FROM "t"',
@@ -1689,7 +1742,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT COUNT(*) FROM bayesdb_variable'
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
@@ -1698,7 +1750,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT COUNT(*) FROM bayesdb_variable'
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
@@ -1707,7 +1758,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT COUNT(*) FROM bayesdb_variable'
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
@@ -1716,94 +1766,28 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
+            'CREATE VIRTUAL TABLE temp."bayesdb_temp_0" USING bql_simulate('
+                '\'{"accuracy": null, "colnos": [0, 5, 4],'
+                ' "columns": ["age", "RANK", "division"],'
+                ' "constraints": [[1, "F"]], "generator_id": null,'
+                ' "modelnos": null, "nsamples": 4, "population_id": 1}\')',
+            'CREATE TEMP TABLE IF NOT EXISTS "sim" AS'
+                ' SELECT * FROM (SELECT * FROM "bayesdb_temp_0") LIMIT 0',
+            'SELECT * FROM "bayesdb_temp_0"',
             'SELECT tabname FROM bayesdb_population WHERE id = ?',
             'SELECT MAX(_rowid_) FROM "t"',
-            'SELECT token FROM bayesdb_rowid_tokens',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT id FROM bayesdb_generator'
                 ' WHERE population_id = ?',
             'SELECT backend FROM bayesdb_generator WHERE id = ?',
             'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT tabname FROM bayesdb_population WHERE id = ?',
             'SELECT 1 FROM "t" WHERE oid = ?',
             'SELECT 1 FROM bayesdb_cgpm_individual'
                 ' WHERE generator_id = ? AND table_rowid = ? LIMIT 1',
             'SELECT cgpm_rowid FROM bayesdb_cgpm_individual'
                 ' WHERE generator_id = ? AND table_rowid = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ? AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT code FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND value = ?',
             'SELECT engine_stamp FROM bayesdb_cgpm_generator'
                 ' WHERE generator_id = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ? AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ? AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ? AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ? AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'CREATE TEMP TABLE "bayesdb_temp_0"'
-                ' ("age","RANK","division")',
-            'INSERT INTO "bayesdb_temp_0" ("age","RANK","division")'
-                ' VALUES (?,?,?)',
-            'INSERT INTO "bayesdb_temp_0" ("age","RANK","division")'
-                ' VALUES (?,?,?)',
-            'INSERT INTO "bayesdb_temp_0" ("age","RANK","division")'
-                ' VALUES (?,?,?)',
-            'INSERT INTO "bayesdb_temp_0" ("age","RANK","division")'
-                ' VALUES (?,?,?)',
-            'CREATE TEMP TABLE IF NOT EXISTS "sim" AS'
-                ' SELECT * FROM "bayesdb_temp_0"',
+            'INSERT INTO "sim" VALUES (?, ?, ?)',
             'DROP TABLE "bayesdb_temp_0"'
         ]
         assert sqltraced_execute(
@@ -1830,7 +1814,6 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT COUNT(*) FROM bayesdb_variable'
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
@@ -1839,52 +1822,23 @@ def test_parametrized():
                 ' WHERE population_id = ?'
                     ' AND (generator_id IS NULL OR generator_id = ?)'
                     ' AND name = ?',
+            'CREATE VIRTUAL TABLE temp."bayesdb_temp_1" USING bql_simulate('
+                '\'{"accuracy": null, "colnos": [0], "columns": ["age"],'
+                ' "constraints": [[1, "F"]], "generator_id": null,'
+                ' "modelnos": null, "nsamples": 4, "population_id": 1}\')',
+            'SELECT * FROM (SELECT * FROM "bayesdb_temp_1")',
             'SELECT tabname FROM bayesdb_population WHERE id = ?',
             'SELECT MAX(_rowid_) FROM "t"',
-            'SELECT token FROM bayesdb_rowid_tokens',
-            'SELECT token FROM bayesdb_rowid_tokens',
             'SELECT id FROM bayesdb_generator WHERE population_id = ?',
             'SELECT backend FROM bayesdb_generator WHERE id = ?',
             'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT tabname FROM bayesdb_population WHERE id = ?',
             'SELECT 1 FROM "t" WHERE oid = ?',
             'SELECT 1 FROM bayesdb_cgpm_individual'
                 ' WHERE generator_id = ? AND table_rowid = ? LIMIT 1',
             'SELECT cgpm_rowid FROM bayesdb_cgpm_individual'
                 ' WHERE generator_id = ? AND table_rowid = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT code FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND value = ?',
             'SELECT engine_stamp FROM bayesdb_cgpm_generator'
                 ' WHERE generator_id = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'SELECT population_id FROM bayesdb_generator WHERE id = ?',
-            'SELECT stattype FROM bayesdb_variable WHERE population_id = ?'
-                ' AND (generator_id IS NULL OR generator_id = ?) AND colno = ?',
-            'SELECT value FROM bayesdb_cgpm_category'
-                ' WHERE generator_id = ? AND colno = ? AND code = ?',
-            'CREATE TEMP TABLE "bayesdb_temp_1" ("age")',
-            'INSERT INTO "bayesdb_temp_1" ("age") VALUES (?)',
-            'INSERT INTO "bayesdb_temp_1" ("age") VALUES (?)',
-            'INSERT INTO "bayesdb_temp_1" ("age") VALUES (?)',
-            'INSERT INTO "bayesdb_temp_1" ("age") VALUES (?)',
-            'SELECT * FROM (SELECT * FROM "bayesdb_temp_1")',
             'DROP TABLE "bayesdb_temp_1"',
         ]
         bdb.execute('''
@@ -1903,14 +1857,27 @@ def test_parametrized():
             'SELECT COUNT(*) FROM bayesdb_generator WHERE name = ?',
             'SELECT id FROM bayesdb_generator WHERE name = ?',
             'SELECT backend FROM bayesdb_generator WHERE id = ?',
-            'SELECT engine_json, engine_stamp FROM bayesdb_cgpm_generator'
+            'SELECT engine_blob, engine_stamp FROM bayesdb_cgpm_generator'
                 ' WHERE generator_id = ?',
+            'SELECT COUNT(*) FROM bayesdb_cgpm_modelno WHERE generator_id = ?',
+            'SELECT m.cgpm_modelno, s.state_blob'
+                ' FROM bayesdb_cgpm_modelno AS m, bayesdb_cgpm_state AS s'
+                ' WHERE m.generator_id = :generator_id'
+                ' AND s.generator_id = :generator_id'
+                ' AND m.modelno = s.modelno AND m.cgpm_modelno IN (0)'
+                ' ORDER BY m.cgpm_modelno ASC',
             'SELECT population_id FROM bayesdb_generator WHERE id = ?',
             'SELECT engine_stamp FROM bayesdb_cgpm_generator'
                 ' WHERE generator_id = ?',
             'UPDATE bayesdb_cgpm_generator'
-                ' SET engine_json = :engine_json, engine_stamp = :engine_stamp'
-                ' WHERE generator_id = :generator_id']
+                ' SET engine_blob = :engine_blob, engine_stamp = :engine_stamp'
+                ' WHERE generator_id = :generator_id',
+            'INSERT OR REPLACE INTO bayesdb_cgpm_state'
+                ' (generator_id, modelno, state_blob)'
+                ' SELECT generator_id, modelno, :state_blob'
+                ' FROM bayesdb_cgpm_modelno'
+                ' WHERE generator_id = :generator_id'
+                ' AND cgpm_modelno = :cgpm_modelno']
 
 def test_create_table_ifnotexists_as_simulate():
     with test_csv.bayesdb_csv_file(test_csv.csv_data) as (bdb, fname):
@@ -2652,6 +2619,204 @@ def test_tracing_execution_error_smoke():
         assert tracer.finished_calls == 0
         assert tracer.abandoned_calls == 0
 
+def test_profiling_smoke():
+    with test_core.t1() as (bdb, _population_id, generator_id):
+        bdb.execute('INITIALIZE 1 MODEL FOR p1_cc')
+        q = 'ESTIMATE PREDICTIVE PROBABILITY OF age FROM p1'
+        profiler = bdb.profile()
+        assert bdb.profiler is profiler
+        bdb.execute(q).fetchall()
+        bdb.unprofile(profiler)
+        assert bdb.profiler is None
+        entries = profiler.stats()
+        categories = set(entry[0] for entry in entries)
+        assert categories == set(['parse', 'compile', 'sql', 'bql', 'backend'])
+        for category, name, generator, calls, seconds in entries:
+            assert 0 < calls
+            assert 0 <= seconds
+            if category == 'backend':
+                assert name.startswith('cgpm.')
+                assert generator == generator_id
+            else:
+                assert generator is None
+        assert [entry[4] for entry in entries] == \
+            sorted((entry[4] for entry in entries), reverse=True)
+        out = StringIO.StringIO()
+        profiler.dump(out, format='json')
+        assert len(json.loads(out.getvalue())) == len(entries)
+        out = StringIO.StringIO()
+        profiler.dump(out)
+        assert len(out.getvalue().splitlines()) == 1 + len(entries)
+        with pytest.raises(ValueError):
+            profiler.dump(out, format='xml')
+        # Nothing more is recorded once the profiler is removed.
+        bdb.execute(q).fetchall()
+        assert profiler.stats() == entries
+        profiler.reset()
+        assert profiler.stats() == []
+
+class RecordingBackend(NIGNormalBackend):
+    """NIG-Normal backend that records the batches asked of it."""
+
+    def __init__(self):
+        super(RecordingBackend, self).__init__()
+        self.calls = []
+
+    def recorded(self, name):
+        """Return the arguments of each recorded call of method `name`."""
+        return [arguments for n, arguments in self.calls if n == name]
+
+    def logpdf_joint_batch(self, bdb, generator_id, modelnos, rowids,
+            targets_list, constraints_list):
+        self.calls.append(('logpdf_joint_batch', (rowids, targets_list)))
+        return super(RecordingBackend, self).logpdf_joint_batch(
+            bdb, generator_id, modelnos, rowids, targets_list,
+            constraints_list)
+
+    def predict_confidence_batch(self, bdb, generator_id, modelnos,
+            rowids, colnos_list, numsamples=None):
+        self.calls.append(('predict_confidence_batch', (rowids, colnos_list)))
+        return super(RecordingBackend, self).predict_confidence_batch(
+            bdb, generator_id, modelnos, rowids, colnos_list,
+            numsamples=numsamples)
+
+    def simulate_joint(self, bdb, generator_id, modelnos, rowid, targets,
+            constraints, num_samples=1, accuracy=None):
+        self.calls.append(('simulate_joint', num_samples))
+        return super(RecordingBackend, self).simulate_joint(
+            bdb, generator_id, modelnos, rowid, targets, constraints,
+            num_samples=num_samples, accuracy=accuracy)
+
+def test_batch_limit():
+    with bayeslite.bayesdb_open(':memory:') as bdb:
+        backend = RecordingBackend()
+        bayeslite.bayesdb_register_backend(bdb, backend)
+        bdb.sql_execute('create table t(x)')
+        for x in xrange(30):
+            bdb.sql_execute('insert into t(x) values(?)', (x,))
+        bdb.execute('create population p for t(x numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        bdb.execute('initialize 1 model for g')
+        bdb.execute('analyze g for 1 iteration')
+        queries = [
+            'estimate x, predictive probability of x from p where x > 4'
+                ' limit 5 offset 2',
+            'estimate x, predictive probability of x from p'
+                ' order by predictive probability of x desc, x limit 3',
+            'estimate distinct x > 20 from p where'
+                ' predictive probability of x > 0 limit 2',
+            'estimate count(predictive probability of x) from p limit 1',
+        ]
+        expected = [bdb.execute(query).fetchall() for query in queries]
+        bdb.batch_size = 4
+        del backend.calls[:]
+        actual = [bdb.execute(queries[0]).fetchall()]
+        # With LIMIT but no ORDER BY, only the rows taken are estimated.
+        assert [row[0] for row in actual[0]] == [7, 8, 9, 10, 11]
+        assert [[value for _colno, value in targets]
+                for _rowids, targets_list
+                    in backend.recorded('logpdf_joint_batch')
+                for targets in targets_list] == \
+            [[7], [8], [9], [10], [11]]
+        actual += [bdb.execute(query).fetchall() for query in queries[1:]]
+        assert expected == actual
+        assert actual[3] == [(30,)]
+
+def test_infer_batch():
+    with bayeslite.bayesdb_open(':memory:') as bdb:
+        backend = RecordingBackend()
+        bayeslite.bayesdb_register_backend(bdb, backend)
+        bdb.sql_execute('create table t(x, y, z)')
+        for x in xrange(30):
+            bdb.sql_execute('insert into t(x, y, z) values(?, ?, ?)',
+                (x, None if x % 3 == 0 else x*x - 100,
+                    None if x % 5 == 0 else -x))
+        bdb.execute('create population p for t(x numerical; y numerical;'
+            ' z numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        bdb.execute('initialize 1 model for g')
+        bdb.execute('analyze g for 1 iteration')
+        queries = [
+            'infer x, y, z from p order by x',
+            'infer x, y, z with confidence 0.5 from p where x > 10'
+                ' order by x',
+            'infer explicit x, predict y confidence yc,'
+                ' predict z with confidence 2 using 3 samples'
+                ' from p order by x',
+        ]
+        expected = [bdb.execute(query).fetchall() for query in queries]
+        assert backend.recorded('predict_confidence_batch') == []
+        bdb.batch_size = 4
+        actual = [bdb.execute(queries[0]).fetchall()]
+        batches = backend.recorded('predict_confidence_batch')
+        actual += [bdb.execute(query).fetchall() for query in queries[1:]]
+        assert expected == actual
+        # Auto-imputation asks for the missing cells only, those of a
+        # row together, in batches of up to 4 rows.
+        ycolno = core.bayesdb_variable_number(bdb, 1, None, 'y')
+        zcolno = core.bayesdb_variable_number(bdb, 1, None, 'z')
+        assert all(len(rowids) <= 4 for rowids, _colnos_list in batches)
+        requests = [
+            (rowid, colnos)
+            for rowids, colnos_list in batches
+            for rowid, colnos in zip(rowids, colnos_list)
+        ]
+        assert requests == [
+            (x + 1, [ycolno, zcolno] if x % 15 == 0
+                else [ycolno] if x % 3 == 0 else [zcolno])
+            for x in xrange(30)
+            if x % 3 == 0 or x % 5 == 0
+        ]
+        # With LIMIT but no ORDER BY, only the rows taken are predicted.
+        query = 'infer x, y, z from p where x > 4 limit 5 offset 2'
+        del backend.calls[:]
+        actual = bdb.execute(query).fetchall()
+        assert [row[0] for row in actual] == [7, 8, 9, 10, 11]
+        assert [rowids for rowids, _colnos_list
+                in backend.recorded('predict_confidence_batch')] == \
+            [[10, 11]]
+        bdb.batch_size = None
+        assert bdb.execute(query).fetchall() == actual
+        # An aggregate counts every row, even with LIMIT.
+        query = 'infer explicit count(predict y with confidence 0)' \
+            ' from p limit 1'
+        expected = bdb.execute(query).fetchall()
+        assert expected == [(30,)]
+        bdb.batch_size = 4
+        assert bdb.execute(query).fetchall() == expected
+
+def test_generator_threads_seeds():
+    def draw(generator_threads):
+        with bayeslite.bayesdb_open(':memory:') as bdb:
+            bdb.generator_threads = generator_threads
+            return bqlfn._map_generators(
+                bdb, lambda _g, k: bdb.np_prng.uniform() + k,
+                [1, 2, 3, 4], [0, 10, 20, 30])
+    serial = draw(None)
+    parallel = draw(2)
+    assert [int(u) for u in serial] == [0, 10, 20, 30]
+    assert [int(u) for u in parallel] == [0, 10, 20, 30]
+    assert parallel == draw(3)
+    assert len(set(u % 1 for u in parallel)) == 4
+
+def test_generator_threads_savepoints():
+    with bayeslite.bayesdb_open(':memory:') as bdb:
+        bdb.sql_execute('create table t(g, k)')
+        def f(generator_id):
+            with bdb.savepoint():
+                depth = bdb._txn_depth
+                for k in xrange(3):
+                    bdb.sql_execute('insert into t(g, k) values(?, ?)',
+                        (generator_id, k))
+                    time.sleep(0.001)
+                assert bdb._txn_depth == depth
+            return bdb.sql_execute('select count(*) from t where g = ?',
+                (generator_id,)).fetchvalue()
+        bdb.generator_threads = 4
+        assert bqlfn._map_generators(bdb, f, range(8)) == [3] * 8
+        assert bdb._txn_depth == 0
+        assert bdb.sql_execute('select count(*) from t').fetchvalue() == 24
+
 def test_pdf_var():
     with test_core.t1() as (bdb, population_id, _generator_id):
         bdb.execute('initialize 6 models for p1_cc;')
@@ -2661,3 +2826,14 @@ def test_pdf_var():
         assert bql2sql(
                 'estimate probability density of label = label from p1') == \
             'SELECT bql_pdf_joint(1, NULL, NULL, 1, "label") FROM "t1";'
+
+def test_incorporate_rows_unsupported():
+    with bayeslite.bayesdb_open(':memory:') as bdb:
+        bayeslite.bayesdb_register_backend(bdb, troll.TrollBackend())
+        bdb.sql_execute('create table t(x)')
+        bdb.sql_execute('insert into t(x) values (1)')
+        bdb.execute('create population p for t(x numerical)')
+        bdb.execute('create generator g for p using troll_rng')
+        bdb.sql_execute('insert into t(x) values (2)')
+        with pytest.raises(BQLError):
+            bdb.execute('incorporate new rows into g')
@@ -41,6 +41,10 @@ from bayeslite.core import bayesdb_get_population
 from bayeslite.exception import BQLError
 from bayeslite.backends.cgpm_backend import CGPM_Backend
 from bayeslite.util import cursor_value
+from bayeslite.util import json_dumps
+
+import bayeslite.backends.cgpm_backend as cgpm_backend
+import bayeslite.backends.cgpm_codec as cgpm_codec
 
 import test_csv
 
@@ -1226,3 +1230,340 @@ def test_using_modelnos():
                 ESTIMATE PREDICTIVE PROBABILITY OF period FROM satellites
                 USING MODELS 0-8 LIMIT 2;
             ''')
+
+def test_estimand_cache():
+    with cgpm_dummy_satellites_bdb() as bdb:
+        bdb.execute('''
+            CREATE POPULATION satellites FOR satellites_ucs WITH SCHEMA(
+                SET STATTYPE OF apogee              TO NUMERICAL;
+                SET STATTYPE OF class_of_orbit      TO NOMINAL;
+                SET STATTYPE OF country_of_operator TO NOMINAL;
+                SET STATTYPE OF launch_mass         TO NUMERICAL;
+                SET STATTYPE OF perigee             TO NUMERICAL;
+                SET STATTYPE OF period              TO NUMERICAL
+            )
+        ''')
+        backend = CGPM_Backend(dict(), multiprocess=0, estimand_cache_size=3)
+        bayesdb_register_backend(bdb, backend)
+        bdb.execute('''
+            CREATE GENERATOR g0 FOR satellites USING cgpm(
+                SUBSAMPLE 10
+            );
+        ''')
+        bdb.execute('INITIALIZE 2 MODELS FOR g0')
+
+        def cached():
+            return cursor_value(bdb.sql_execute('''
+                SELECT COUNT(*) FROM bayesdb_cgpm_estimand_cache
+            '''))
+
+        def mi(variable):
+            return cursor_value(bdb.execute('''
+                ESTIMATE MUTUAL INFORMATION OF apogee WITH %s
+                    USING 10 SAMPLES
+                BY satellites
+            ''' % (variable,)))
+
+        # Repeated queries are served from the cache.
+        assert cached() == 0
+        mi_perigee = mi('perigee')
+        assert cached() == 1
+        def entries():
+            return bdb.sql_execute('''
+                SELECT * FROM bayesdb_cgpm_estimand_cache
+            ''').fetchall()
+        stored = entries()
+        sql = []
+        trace = lambda string, _bindings: sql.append(' '.join(string.split()))
+        bdb.sql_trace(trace)
+        assert mi('perigee') == mi_perigee
+        bdb.sql_untrace(trace)
+        # Hits do not write to the database, and take one lookup.
+        assert entries() == stored
+        assert len([s for s in sql if 'estimand_cache' in s]) == 1
+
+        # Dependence probability is cheaper to compute than to look up.
+        bdb.execute('''
+            ESTIMATE DEPENDENCE PROBABILITY OF apogee WITH perigee
+                BY satellites
+        ''').fetchall()
+        assert cached() == 1
+
+        # The least recently used entries are evicted beyond capacity.
+        mi('period')
+        mi('launch_mass')
+        mi('perigee')
+        mi('class_of_orbit')
+        assert cached() == 3
+        assert cursor_value(bdb.sql_execute('''
+            SELECT COUNT(*) FROM bayesdb_cgpm_estimand_cache
+                WHERE arguments_json = '[[0], [5], null]'
+        ''')) == 0
+
+        # Analysis invalidates the cache.
+        bdb.execute('ANALYZE g0 FOR 1 ITERATION')
+        mi('perigee')
+        assert cached() == 1
+
+        # So do new models, even with the engine already loaded.
+        stored = entries()
+        bdb.execute('INITIALIZE 3 MODELS IF NOT EXISTS FOR g0')
+        mi('perigee')
+        assert cached() == 1
+        assert entries() != stored
+
+        # Dropping the models or the generator clears the cache.
+        bdb.execute('DROP MODELS FROM g0')
+        assert cached() == 0
+        bdb.execute('INITIALIZE 1 MODEL FOR g0')
+        mi('perigee')
+        assert cached() == 1
+        bdb.execute('DROP GENERATOR g0')
+        assert cached() == 0
+
+        # The cache can be disabled.
+        assert backend.set_estimand_cache_size(None) == 3
+
+def test_engine_blob_migration():
+    with cgpm_dummy_satellites_bdb() as bdb:
+        bdb.execute('''
+            CREATE POPULATION satellites FOR satellites_ucs WITH SCHEMA(
+                GUESS STATTYPES OF (*);
+            )
+        ''')
+        backend = CGPM_Backend(dict(), multiprocess=0)
+        bayesdb_register_backend(bdb, backend)
+        bdb.execute('CREATE GENERATOR g0 FOR satellites (SUBSAMPLE 10);')
+        bdb.execute('INITIALIZE 2 MODELS FOR g0')
+        population_id = bayesdb_get_population(bdb, 'satellites')
+        generator_id = bayesdb_get_generator(bdb, population_id, 'g0')
+
+        def stored_metadata():
+            engine_json, engine_blob = bdb.sql_execute('''
+                SELECT engine_json, engine_blob FROM bayesdb_cgpm_generator
+                    WHERE generator_id = ?
+            ''', (generator_id,)).fetchall()[0]
+            assert engine_json is None
+            states = bdb.sql_execute('''
+                SELECT s.state_blob
+                    FROM bayesdb_cgpm_state AS s, bayesdb_cgpm_modelno AS m
+                    WHERE s.generator_id = ? AND m.generator_id = ?
+                        AND s.modelno = m.modelno
+                    ORDER BY m.cgpm_modelno
+            ''', (generator_id, generator_id))
+            metadata = lists(cgpm_codec.decode(engine_blob))
+            metadata['states'] = [
+                lists(cgpm_codec.decode(blob)) for blob, in states
+            ]
+            return metadata
+
+        def lists(metadata):
+            # The data matrix decodes as an array.
+            if 'X' in metadata:
+                assert isinstance(metadata['X'], np.ndarray)
+                metadata['X'] = metadata['X'].tolist()
+            return metadata
+
+        # New engines are stored only in the binary encoding, one state
+        # per model.
+        metadata = stored_metadata()
+        assert len(metadata['states']) == 2
+
+        # Downgrade to a JSON engine, as stored by schema version 4.
+        bdb.sql_execute('''
+            UPDATE bayesdb_cgpm_generator
+                SET engine_json = ?, engine_blob = NULL
+                WHERE generator_id = ?
+        ''', (json_dumps(metadata), generator_id))
+        bdb.sql_execute('''
+            DELETE FROM bayesdb_cgpm_state WHERE generator_id = ?
+        ''', (generator_id,))
+
+        # Upgrading converts it back.  Compare JSON rather than trees,
+        # since nan != nan.
+        cgpm_backend._migrate_engine_json(bdb)
+        assert json_dumps(stored_metadata()) == json_dumps(metadata)
+
+        bdb.execute('''
+            ESTIMATE PROBABILITY DENSITY OF apogee = 1 BY satellites
+        ''').fetchall()
+
+def test_lazy_states():
+    with cgpm_dummy_satellites_bdb() as bdb:
+        bdb.execute('''
+            CREATE POPULATION satellites FOR satellites_ucs WITH SCHEMA(
+                GUESS STATTYPES OF (*);
+            )
+        ''')
+        backend = CGPM_Backend(dict(), multiprocess=0)
+        bayesdb_register_backend(bdb, backend)
+        bdb.execute('CREATE GENERATOR g0 FOR satellites (SUBSAMPLE 10);')
+        bdb.execute('INITIALIZE 4 MODELS FOR g0')
+        population_id = bayesdb_get_population(bdb, 'satellites')
+        generator_id = bayesdb_get_generator(bdb, population_id, 'g0')
+
+        def loaded():
+            engine = backend._engine_latest(bdb, generator_id)
+            return [s for s, state in enumerate(engine.states)
+                if state is not None]
+
+        # Only the states queried are loaded.
+        bdb.execute('''
+            ESTIMATE PROBABILITY DENSITY OF apogee = 1 BY satellites
+            USING MODELS 1-2
+        ''').fetchall()
+        assert loaded() == [1, 2]
+
+        # Analysis updates only the states it transitions.
+        bdb.execute('ANALYZE g0 MODELS 2 FOR 1 ITERATION')
+        assert loaded() == [1, 2]
+
+        # Dropping models loads no states.
+        bdb.execute('DROP MODELS 0-1 FROM g0')
+        assert loaded() == [0]
+        bdb.execute('''
+            ESTIMATE PROBABILITY DENSITY OF apogee = 1 BY satellites
+        ''').fetchall()
+        assert loaded() == [0, 1]
+        assert cursor_value(bdb.sql_execute('''
+            SELECT COUNT(*) FROM bayesdb_cgpm_state WHERE generator_id = ?
+        ''', (generator_id,))) == 2
+
+def test_category_cache():
+    with bayesdb_open() as bdb:
+        bayesdb_read_csv(
+            bdb, 't', StringIO.StringIO(test_csv.csv_data),
+            header=True, create=True)
+        bdb.execute('''
+            CREATE POPULATION p FOR t WITH SCHEMA(
+                age         numerical;
+                gender      nominal;
+                salary      numerical;
+                height      ignore;
+                division    ignore;
+                rank        ignore;
+            )
+        ''')
+        backend = bdb.backends['cgpm']
+        backend.set_multiprocess(False)
+        bdb.execute('CREATE GENERATOR m0 FOR p;')
+        bdb.execute('INITIALIZE 1 MODELS FOR m0;')
+        population_id = bayesdb_get_population(bdb, 'p')
+        generator_id = bayesdb_get_generator(bdb, population_id, 'm0')
+        sql = []
+        bdb.sql_trace(lambda string, _bindings: sql.append(string))
+        # Nominal values convert in both directions without queries.
+        samples = bdb.execute('''
+            SIMULATE gender FROM p GIVEN age = 30 LIMIT 10
+        ''').fetchall()
+        assert set(samples) <= set([('F',), ('M',)])
+        assert not any('bayesdb_cgpm_category' in s for s in sql)
+        assert backend._to_numeric(bdb, generator_id, 1, 'F') == \
+            backend._to_numeric(bdb, generator_id, 1, u'F')
+        assert math.isnan(backend._to_numeric(bdb, generator_id, 1, 'X'))
+        assert backend._to_numeric(bdb, generator_id, 0, 42) == 42
+        with pytest.raises(BQLError):
+            backend._from_numeric(bdb, generator_id, 1, 1234.)
+        # Adding a nominal variable loads its categories.
+        bdb.execute('ALTER POPULATION p ADD VARIABLE division nominal;')
+        samples = bdb.execute('''
+            SIMULATE division FROM p GIVEN gender = 'F' LIMIT 10
+        ''').fetchall()
+        assert set(samples) <= set(bdb.sql_execute('''
+            SELECT DISTINCT division FROM t
+        ''').fetchall())
+        assert backend._from_numeric(bdb, generator_id, 4,
+            backend._to_numeric(bdb, generator_id, 4, 'sales')) == 'sales'
+
+def test_row_similarity_matrix():
+    with bayesdb_open() as bdb:
+        bayesdb_read_csv(
+            bdb, 't', StringIO.StringIO(test_csv.csv_data),
+            header=True, create=True)
+        bdb.execute('''
+            CREATE POPULATION p FOR t WITH SCHEMA(
+                age         numerical;
+                gender      nominal;
+                salary      numerical;
+                height      ignore;
+                division    ignore;
+                rank        ignore;
+            )
+        ''')
+        backend = bdb.backends['cgpm']
+        backend.set_multiprocess(False)
+        bdb.execute('CREATE GENERATOR m0 FOR p;')
+        bdb.execute('INITIALIZE 2 MODELS FOR m0;')
+        bdb.execute('ANALYZE m0 FOR 2 ITERATIONS (QUIET);')
+        population_id = bayesdb_get_population(bdb, 'p')
+        generator_id = bayesdb_get_generator(bdb, population_id, 'm0')
+        # Row 1000 is not incorporated, so it is similar to nothing.
+        rowids = [1, 2, 3, 5, 8, 1000]
+        for colnos in [[0], [0, 1, 2]]:
+            matrix = backend.row_similarity_matrix(
+                bdb, generator_id, None, rowids, colnos)
+            for i, rowid in enumerate(rowids):
+                for j, target_rowid in enumerate(rowids):
+                    if 1000 in (rowid, target_rowid):
+                        assert np.isnan(matrix[i][j])
+                        continue
+                    assert np.allclose(matrix[i][j], np.mean(
+                        backend.row_similarity(
+                            bdb, generator_id, None, rowid, target_rowid,
+                            colnos)))
+
+def test_incorporate_new_rows():
+    with bayesdb_open() as bdb:
+        bayesdb_read_csv(
+            bdb, 't', StringIO.StringIO(test_csv.csv_data),
+            header=True, create=True)
+        bdb.execute('''
+            CREATE POPULATION p FOR t WITH SCHEMA(
+                age         numerical;
+                gender      nominal;
+                salary      numerical;
+                height      ignore;
+                division    ignore;
+                rank        ignore;
+            )
+        ''')
+        bdb.backends['cgpm'].set_multiprocess(False)
+        bdb.execute('CREATE GENERATOR m0 FOR p;')
+        bdb.execute('INITIALIZE 2 MODELS FOR m0;')
+        bdb.execute('ANALYZE m0 FOR 1 ITERATION (QUIET);')
+        population_id = bayesdb_get_population(bdb, 'p')
+        generator_id = bayesdb_get_generator(bdb, population_id, 'm0')
+        def individuals():
+            return bdb.sql_execute('''
+                SELECT table_rowid, cgpm_rowid FROM bayesdb_cgpm_individual
+                    WHERE generator_id = ? ORDER BY cgpm_rowid
+            ''', (generator_id,)).fetchall()
+        n = len(individuals())
+        # Nothing new yet.
+        bdb.execute('INCORPORATE NEW ROWS INTO m0;')
+        assert len(individuals()) == n
+        bdb.sql_execute('''
+            INSERT INTO t (age, gender, salary) VALUES (29, 'F', 70000)
+        ''')
+        bdb.sql_execute('INSERT INTO t (age, gender) VALUES (51, NULL)')
+        bdb.execute('INCORPORATE NEW ROWS INTO m0 FOR 1 ITERATION;')
+        assert individuals()[n:] == [(n + 1, n), (n + 2, n + 1)]
+        engine = bdb.backends['cgpm']._engine(bdb, generator_id)
+        assert all(state.n_rows() == n + 2 for state in engine.states)
+        # The new rows are modeled like any other.
+        similarity = bdb.execute('''
+            ESTIMATE SIMILARITY TO (_rowid_ = ?) IN THE CONTEXT OF age
+                FROM p WHERE _rowid_ = ?
+        ''', (n + 1, n + 2)).fetchvalue()
+        assert 0 <= similarity <= 1
+        # A category unknown to the models is refused, atomically.
+        bdb.sql_execute("INSERT INTO t (age, gender) VALUES (40, 'X')")
+        with pytest.raises(BQLError):
+            bdb.execute('INCORPORATE NEW ROWS INTO m0;')
+        assert len(individuals()) == n + 2
+        # So is a value a numerical variable cannot take.
+        bdb.sql_execute("UPDATE t SET age = 'forty', gender = 'F'"
+            " WHERE gender = 'X'")
+        with pytest.raises(BQLError):
+            bdb.execute('INCORPORATE NEW ROWS INTO m0;')
+        assert len(individuals()) == n + 2
@@ -682,3 +682,43 @@ def test_bayesdb_implicit_population_generator_rename():
         assert not core.bayesdb_has_generator(bdb, population_id, 't')
         assert core.bayesdb_has_generator(bdb, population_id2, 't2')
         assert generator_id2 == generator_id
+
+def test_catalog_memoized():
+    with bayesdb() as bdb:
+        bdb.sql_execute('create table t (a real, b real)')
+        bdb.sql_execute('create table u (a real, b real)')
+        bdb.execute('create population p for t (a numerical; b ignore)')
+        population_id = core.bayesdb_get_population(bdb, 'p')
+        sql = []
+        bdb.sql_trace(lambda string, _bindings: sql.append(string))
+        # Outside a transaction, nothing is memoized.
+        assert core.bayesdb_population_table(bdb, population_id) == 't'
+        assert core.bayesdb_population_table(bdb, population_id) == 't'
+        assert len(sql) == 2
+        with bdb.savepoint():
+            del sql[:]
+            assert core.bayesdb_population_table(bdb, population_id) == 't'
+            assert core.bayesdb_variable_stattype(
+                bdb, population_id, None, 0) == 'numerical'
+            assert core.bayesdb_population_table(bdb, population_id) == 't'
+            assert core.bayesdb_variable_stattype(
+                bdb, population_id, None, 0) == 'numerical'
+            assert len(sql) == 2
+            # DDL invalidates the memoized metadata.
+            bdb.execute('alter population p set stattype of a to nominal')
+            assert core.bayesdb_variable_stattype(
+                bdb, population_id, None, 0) == 'nominal'
+            bdb.execute('alter table t rename to t2')
+            assert core.bayesdb_population_table(bdb, population_id) == 't2'
+            # So does rolling back.
+            with pytest.raises(ValueError):
+                with bdb.savepoint():
+                    bdb.execute('alter table t2 rename to t3')
+                    assert core.bayesdb_population_table(
+                        bdb, population_id) == 't3'
+                    raise ValueError
+            assert core.bayesdb_population_table(bdb, population_id) == 't2'
+            # Missing entries raise every time rather than being memoized.
+            for _ in xrange(2):
+                with pytest.raises(ValueError):
+                    core.bayesdb_population_table(bdb, population_id + 1)
@@ -141,3 +141,39 @@ def test_correlation():
         assert (xpd_corr == obs_corr
             or abserr(xpd_corr_p, obs_corr_p) < 1e-10
             or relerr(xpd_corr_p, obs_corr_p) < 1e-1)
+
+def test_correlation_matrix():
+    with bayeslite.bayesdb_open() as bdb:
+        bdb.sql_execute('CREATE TABLE t(id, c0, c1, n0, n1, nx)')
+        data = [
+            ('foo', 'x', 0, -1, 0),
+            ('bar', 'y', 87, None, 0),
+            ('baz', None, 92.1, -3, 0),
+            (None, 'x', 3, -4, 0),
+            ('foo', 'y', None, 7, 0),
+        ] * 4
+        for i, row in enumerate(data):
+            bdb.sql_execute('INSERT INTO t VALUES (?,?,?,?,?,?)',
+                (i + 1,) + row)
+        bdb.execute('''
+            CREATE POPULATION p FOR t (
+                id IGNORE;
+                c0 NOMINAL;
+                c1 NOMINAL;
+                n0 NUMERICAL;
+                n1 NUMERICAL;
+                nx NUMERICAL
+            )
+        ''')
+        query = 'ESTIMATE CORRELATION, CORRELATION PVALUE' \
+            ' FROM PAIRWISE VARIABLES OF p'
+        expected = sorted(bdb.execute(query).fetchall())
+        bdb.batch_size = 4
+        result = sorted(bdb.execute(query).fetchall())
+        assert len(expected) == 25
+        assert len(expected) == len(result)
+        for expected_item, observed_item in zip(expected, result):
+            assert expected_item[:3] == observed_item[:3]
+            for xpd, obs in zip(expected_item[3:], observed_item[3:]):
+                assert xpd == obs or abserr(xpd, obs) < 1e-10 \
+                    or relerr(xpd, obs) < 1e-10
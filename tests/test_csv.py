@@ -21,7 +21,9 @@ import pytest
 import tempfile
 
 import bayeslite
+import bayeslite.core
 import bayeslite.guess
+import bayeslite.read_csv
 
 from bayeslite import bql_quote_name
 
@@ -218,3 +220,29 @@ def test_csv_missing():
             (100.0, 200.0, None),
             (4.0, 5.0, 6.0),
         ]
+
+def test_csv_import_chunked(monkeypatch):
+    monkeypatch.setattr(bayeslite.read_csv, 'CHUNK_SIZE', 3)
+    reports = []
+    def progress(nrows, elapsed):
+        assert 0 <= elapsed
+        reports.append(nrows)
+    with bayesdb_csv_stream(csv_data) as (bdb, f):
+        bayeslite.bayesdb_read_csv(bdb, 'employees', f, header=True,
+            create=True, progress=progress, bulk_pragmas=True)
+        assert reports == [3, 6, 7]
+        assert bdb.execute('select count(*) from employees').fetchvalue() == 7
+        assert bdb.execute('''
+            select division from employees where age = 23
+        ''').fetchvalue() == 'data science'
+        # The PRAGMAs for bulk loading are restored.
+        assert bdb.sql_execute('PRAGMA synchronous').fetchvalue() != 0
+
+def test_csv_import_chunked_badline(monkeypatch):
+    monkeypatch.setattr(bayeslite.read_csv, 'CHUNK_SIZE', 2)
+    with bayesdb_csv_stream('foo,bar\n0,1\n2,3\n4,5\n6\n') as (bdb, f):
+        with pytest.raises(IOError) as exc:
+            bayeslite.bayesdb_read_csv(bdb, 'bad', f, header=True,
+                create=True)
+        assert 'Line 5:' in str(exc.value)
+        assert not bayeslite.core.bayesdb_has_table(bdb, 'bad')
@@ -22,6 +22,7 @@ import bayeslite
 
 from bayeslite.guess import bayesdb_guess_population
 from bayeslite.guess import bayesdb_guess_stattypes
+from bayeslite.guess import bayesdb_guess_stattypes_streaming
 from bayeslite.exception import BQLError
 
 def test_guess_stattypes():
@@ -128,6 +129,36 @@ def test_guess_stattypes():
     assert [st[0] for st in bayesdb_guess_stattypes(n, rows)] == \
         ['numerical', 'numerical']
 
+@pytest.mark.parametrize('max_distinct', [None, 1, 3])
+def test_guess_stattypes_streaming(monkeypatch, max_distinct):
+    # The streaming guesser must agree with the exact one on all the
+    # cases above, even when it counts only a few values exactly.
+    guess_exact = bayesdb_guess_stattypes
+    def guess_both(column_names, rows, **kwargs):
+        try:
+            expected = guess_exact(column_names, rows, **kwargs)
+        except ValueError as e:
+            with pytest.raises(ValueError) as excinfo:
+                bayesdb_guess_stattypes_streaming(column_names, iter(rows),
+                    max_distinct=max_distinct, **kwargs)
+            assert str(excinfo.value) == str(e)
+            raise e
+        assert bayesdb_guess_stattypes_streaming(column_names, iter(rows),
+                max_distinct=max_distinct, **kwargs) == expected
+        return expected
+    monkeypatch.setitem(
+        test_guess_stattypes.__globals__, 'bayesdb_guess_stattypes',
+        guess_both)
+    test_guess_stattypes()
+
+def test_guess_stattypes_streaming_sketch():
+    rows = ([i, i % 7, 'k%d' % (i,), math.sqrt(i), 'x' if i % 20 else i]
+        for i in xrange(20000))
+    assert [st[0] for st in
+        bayesdb_guess_stattypes_streaming(
+            ['a', 'b', 'c', 'd', 'e'], rows, max_distinct=100)] == \
+        ['key', 'nominal', 'ignore', 'numerical', 'numerical']
+
 def test_guess_population():
     with bayeslite.bayesdb_open() as bdb:
         bdb.sql_execute('CREATE TABLE t(x NUMERIC, y NUMERIC, z NUMERIC)')
@@ -149,6 +180,14 @@ def test_guess_population():
             (1, None, 1, 'y', 'nominal'),
             (1, None, 2, 'z', 'numerical'),
         ]
+        bayesdb_guess_population(bdb, 'q', 't', sample_size=100)
+        assert bdb.sql_execute('SELECT * FROM bayesdb_variable'
+                ' WHERE population_id = 2').fetchall() == [
+            (2, None, 1, 'y', 'nominal'),
+            (2, None, 2, 'z', 'numerical'),
+        ]
+        with pytest.raises(ValueError):
+            bayesdb_guess_population(bdb, 'r', 't', sample_size=0)
 
 def test_guess_schema():
     with bayeslite.bayesdb_open() as bdb:
@@ -167,7 +206,11 @@ def test_guess_schema():
         assert guess.description[1][0] == u'stattype'
         assert guess.description[2][0] == u'num_distinct'
         assert guess.description[3][0] == u'reason'
-        assert len(guess.fetchall()) == 3
+        assert [row[:3] for row in guess.fetchall()] == [
+            ('x', 'key', 676),
+            ('y', 'nominal', 2),
+            ('z', 'numerical', 51),
+        ]
 
 def isqrt(n):
     x = n
@@ -27,6 +27,7 @@ from bayeslite import bayesdb_register_backend
 from bayeslite.core import bayesdb_get_generator
 from bayeslite.core import bayesdb_get_population
 from bayeslite.exception import BQLError
+from bayeslite.stats import arithmetic_mean
 
 try:
     from bayeslite.backends.loom_backend import LoomBackend
@@ -360,3 +361,168 @@ def test_population_two_generators():
             bdb.execute('create population p for t (x numerical)')
             bdb.execute('create generator g0 for p using loom')
             bdb.execute('create generator g1 for p using loom')
+
+
+def test_logpdf_joint_batch():
+    with tempdir('bayeslite-loom') as loom_store_path:
+        with bayesdb_open(':memory:') as bdb:
+            backend = LoomBackend(loom_store_path=loom_store_path)
+            bayesdb_register_backend(bdb, backend)
+            bdb.sql_execute('create table t(x, z)')
+            for x in xrange(20):
+                bdb.sql_execute('insert into t (x, z) values (?, ?)',
+                    (x, 'a' if x % 2 else 'b'))
+            bdb.execute('create population p for t(x numerical; z nominal)')
+            bdb.execute('create generator g for p using loom')
+            bdb.execute('initialize 2 models for g')
+            bdb.execute('analyze g for 5 iterations')
+            generator_id = bayesdb_get_generator(bdb, None, 'g')
+            targets_list = [[(0, float(x))] for x in xrange(5)] + \
+                [[(1, 'a')], [(1, 'b')]]
+            constraints_list = [[] for _ in xrange(5)] + \
+                [[(0, 3.)], [(0, 3.)]]
+            rowids = [None] * len(targets_list)
+            singles = [
+                backend.logpdf_joint(
+                    bdb, generator_id, None, None, targets, constraints)
+                for targets, constraints in zip(targets_list, constraints_list)
+            ]
+            server = backend._get_query_server(bdb, generator_id)
+            rows = []
+            score = server.score
+            def counting_score(row):
+                rows.append(row)
+                return score(row)
+            server.score = counting_score
+            try:
+                batch = backend.logpdf_joint_batch(
+                    bdb, generator_id, None, rowids, targets_list,
+                    constraints_list)
+            finally:
+                del server.score
+            assert batch == singles
+            # Five distinct and cases share one unconstrained conditional
+            # case; the last two share the conditional case x = 3.
+            assert len(rows) == 5 + 1 + 2 + 1
+            with pytest.raises(ValueError):
+                backend.logpdf_joint(
+                    bdb, generator_id, None, None, [(1, 'c')], [])
+
+
+def test_partition_cache():
+    with tempdir('bayeslite-loom') as loom_store_path:
+        with bayesdb_open(':memory:') as bdb:
+            backend = LoomBackend(loom_store_path=loom_store_path)
+            bayesdb_register_backend(bdb, backend)
+            bdb.sql_execute('create table t(x, y)')
+            for x in xrange(10):
+                bdb.sql_execute('insert into t (x, y) values (?, ?)',
+                    (x, 2*x))
+            bdb.execute('create population p for t(x numerical; y numerical)')
+            bdb.execute('create generator g for p using loom')
+            bdb.execute('initialize 2 models for g')
+            bdb.execute('analyze g for 2 iterations')
+            generator_id = bayesdb_get_generator(bdb, None, 'g')
+            rowids = range(1, 11)
+            matrix = backend.row_similarity_matrix(
+                bdb, generator_id, None, rowids, [0])
+            for i, rowid in enumerate(rowids):
+                for j, target_rowid in enumerate(rowids):
+                    assert matrix[i][j] == backend.row_similarity(
+                        bdb, generator_id, None, rowid, target_rowid, [0])
+            relevances = backend.predictive_relevance(
+                bdb, generator_id, None, 1, rowids, [], 0)
+            assert relevances == [arithmetic_mean(row) for row in matrix[0]]
+            dependence = backend.column_dependence_probability_matrix(
+                bdb, generator_id, None, [0, 1])
+            assert dependence[0][1] == backend.column_dependence_probability(
+                bdb, generator_id, None, 0, 1)
+            # Partitions are memoized within a transaction, until the
+            # models change.
+            with bdb.transaction():
+                partitions = backend._get_partitions(bdb, generator_id)
+                assert backend._get_partitions(bdb, generator_id) \
+                    is partitions
+                bdb.execute('analyze g for 1 iteration')
+                assert backend._get_partitions(bdb, generator_id) \
+                    is not partitions
+            # Rolling back an analysis rolls back the partitions read.
+            with bdb.transaction():
+                before = backend._get_partitions(bdb, generator_id)
+            bdb.execute('begin')
+            bdb.execute('analyze g for 1 iteration')
+            bdb.execute('estimate similarity in the context of x'
+                ' from pairwise p').fetchall()
+            bdb.execute('rollback')
+            with bdb.transaction():
+                after = backend._get_partitions(bdb, generator_id)
+            assert after is not before
+            assert (after.kinds == before.kinds).all()
+            assert (after.clusters == before.clusters).all()
+
+
+def test_chunked_ingest(monkeypatch):
+    from bayeslite.backends import loom_backend
+    monkeypatch.setattr(loom_backend, 'INSERT_CHUNK_SIZE', 7)
+    with tempdir('bayeslite-loom') as loom_store_path:
+        with bayesdb_open(':memory:') as bdb:
+            bayesdb_register_backend(bdb,
+                LoomBackend(loom_store_path=loom_store_path))
+            bdb.sql_execute('create table t(x, z)')
+            for x in xrange(30):
+                bdb.sql_execute('insert into t (x, z) values (?, ?)',
+                    (x, 'abc'[x % 3]))
+            bdb.sql_execute('delete from t where x % 4 = 1')
+            bdb.execute('create population p for t(x numerical; z nominal)')
+            bdb.execute('create generator g for p using loom')
+            bdb.execute('initialize 2 models for g')
+            bdb.execute('analyze g for 2 iterations')
+            rowids = [rowid for (rowid,) in
+                bdb.sql_execute('select oid from t order by oid')]
+            assert bdb.sql_execute('''
+                select table_rowid from bayesdb_loom_rowid_mapping
+                    order by loom_rowid
+            ''').fetchall() == [(rowid,) for rowid in rowids]
+            assert bdb.sql_execute('''
+                select count(*) from bayesdb_loom_column_kind_partition
+            ''').fetchall() == [(2*2,)]
+            assert bdb.sql_execute('''
+                select count(distinct table_rowid)
+                    from bayesdb_loom_row_kind_partition
+            ''').fetchall() == [(len(rowids),)]
+
+
+def test_analyze_models():
+    with tempdir('bayeslite-loom') as loom_store_path:
+        with bayesdb_open(':memory:') as bdb:
+            bayesdb_register_backend(bdb,
+                LoomBackend(loom_store_path=loom_store_path,
+                    analyze_workers=2))
+            bdb.sql_execute('create table t(x, y)')
+            for x in xrange(10):
+                bdb.sql_execute('insert into t (x, y) values (?, ?)',
+                    (x, x % 3))
+            bdb.execute('create population p for t(x numerical; y nominal)')
+            bdb.execute('create generator g for p using loom')
+            bdb.execute('initialize 3 models for g')
+            def analyzed_models():
+                return [modelno for (modelno,) in bdb.sql_execute('''
+                    select distinct modelno
+                        from bayesdb_loom_column_kind_partition
+                        order by modelno
+                ''')]
+            bdb.execute('analyze g models 1 for 2 iterations')
+            assert analyzed_models() == [1]
+            with pytest.raises(BQLError):
+                bdb.execute('''
+                    analyze g models 0, 2 for 2 iterations
+                        checkpoint 1 iteration
+                ''')
+            assert analyzed_models() == [1]
+            bdb.execute('analyze g models 0, 2 for 2 iterations')
+            assert analyzed_models() == [0, 1, 2]
+            with pytest.raises(BQLError):
+                bdb.execute('analyze g for 1 second')
+            bdb.execute('estimate probability density of x = 5 by p')
+            with pytest.raises(BQLError):
+                bdb.execute('analyze g model 3 for 1 iteration')
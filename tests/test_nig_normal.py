@@ -535,3 +535,169 @@ def test_nig_normal_latent_2var2lat_conditional_smoke():
         bdb.execute('drop generator g1')
         bdb.execute('drop population p')
         bdb.execute('drop table t')
+
+def test_nig_normal_batch():
+    with bayesdb_open(':memory:') as bdb:
+        bayesdb_register_backend(bdb, NIGNormalBackend())
+        bdb.sql_execute('create table t(x, y)')
+        for x in xrange(100):
+            bdb.sql_execute('insert into t(x, y) values(?, ?)',
+                (x, None if x % 7 == 0 else x*x - 100))
+        bdb.execute('create population p for t(x numerical; y numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        bdb.execute('initialize 2 models for g')
+        bdb.execute('analyze g for 1 iteration')
+        queries = [
+            'estimate predictive probability of y from p where x > 10',
+            'estimate predictive probability of (x, y) from p order by x',
+            'estimate similarity to (x = 3) in the context of x from p',
+        ]
+        expected = [bdb.execute(query).fetchall() for query in queries]
+        bdb.batch_size = 8
+        actual = [bdb.execute(query).fetchall() for query in queries]
+        assert len(expected) == len(actual)
+        for rows_e, rows_a in zip(expected, actual):
+            assert len(rows_e) == len(rows_a)
+            for (e,), (a,) in zip(rows_e, rows_a):
+                if e is None:
+                    assert a is None
+                else:
+                    assert abs(e - a) <= 1e-9 * abs(e)
+
+def test_nig_normal_pairwise_matrix():
+    with bayesdb_open(':memory:') as bdb:
+        bayesdb_register_backend(bdb, NIGNormalBackend())
+        bdb.sql_execute('create table t(x, y, z)')
+        for x in xrange(10):
+            bdb.sql_execute('insert into t(x, y, z) values(?, ?, ?)',
+                (x, x*x - 100, -x))
+        bdb.execute('create population p for t(x numerical; y numerical;'
+            ' z numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        bdb.execute('initialize 2 models for g')
+        queries = [
+            'estimate dependence probability from pairwise variables of p',
+            'estimate dependence probability from pairwise variables of p'
+                ' for x, z order by value desc',
+            'estimate similarity in the context of x from pairwise p',
+        ]
+        expected = [bdb.execute(query).fetchall() for query in queries]
+        bdb.batch_size = 4
+        actual = [bdb.execute(query).fetchall() for query in queries]
+        assert expected == actual
+
+def test_nig_normal_generator_threads():
+    with bayesdb_open(':memory:') as bdb:
+        bayesdb_register_backend(bdb, NIGNormalBackend())
+        bdb.sql_execute('create table t(x, y)')
+        for x in xrange(20):
+            bdb.sql_execute('insert into t(x, y) values(?, ?)',
+                (x, x*x - 100))
+        bdb.execute('create population p for t(x numerical; y numerical)')
+        for g in ['g0', 'g1', 'g2']:
+            bdb.execute('create generator %s for p using nig_normal' % (g,))
+            bdb.execute('initialize 2 models for %s' % (g,))
+        queries = [
+            'estimate probability density of x = 3 given (y = 2) by p',
+            'estimate dependence probability of x with y by p',
+            'estimate predictive probability of y from p order by x',
+            'estimate dependence probability from pairwise variables of p',
+        ]
+        expected = [bdb.execute(query).fetchall() for query in queries]
+        bdb.generator_threads = 2
+        actual = [bdb.execute(query).fetchall() for query in queries]
+        assert expected == actual
+        bdb.batch_size = 4
+        actual = [bdb.execute(query).fetchall() for query in queries]
+        assert len(expected) == len(actual)
+        for rows_e, rows_a in zip(expected, actual):
+            assert len(rows_e) == len(rows_a)
+            for row_e, row_a in zip(rows_e, rows_a):
+                for e, a in zip(row_e, row_a):
+                    if isinstance(e, float):
+                        assert abs(e - a) <= 1e-9 * abs(e)
+                    else:
+                        assert e == a
+        assert len(bdb.execute('simulate x, y from p limit 10').fetchall()) \
+            == 10
+
+def test_nig_normal_params_cache():
+    with bayesdb_open(':memory:') as bdb:
+        backend = NIGNormalBackend()
+        bayesdb_register_backend(bdb, backend)
+        bdb.sql_execute('create table t(x)')
+        for x in range(10) + [None]:
+            bdb.sql_execute('insert into t(x) values(?)', (x,))
+        bdb.execute('create population p for t(x numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        generator_id = core.bayesdb_get_generator(bdb, None, 'g')
+        # Missing values are not counted in the sufficient statistics.
+        assert bdb.sql_execute('''
+            select count, sum, sumsq from bayesdb_nig_normal_column
+        ''').fetchall() == [(10, 45, 285)]
+        # Other values must be numbers, even if added to the table
+        # after the population was created.
+        bdb.sql_execute('create table u(x)')
+        bdb.sql_execute('insert into u(x) values (1), (NULL)')
+        bdb.execute('create population q for u(x numerical)')
+        bdb.sql_execute("insert into u(x) values ('one')")
+        with pytest.raises(BQLError):
+            bdb.execute('create generator h for q using nig_normal')
+        bdb.execute('initialize 2 models for g')
+        with bdb.transaction():
+            params = backend._params(bdb, generator_id)
+            assert params.mus.shape == (2, 1)
+            assert backend._params(bdb, generator_id) is params
+            bdb.execute('analyze g for 1 iteration')
+            assert backend._params(bdb, generator_id) is not params
+            samples = backend.simulate_joint(
+                bdb, generator_id, None, None, [0], [], num_samples=5)
+            assert len(samples) == 5
+            assert all(len(sample) == 1 for sample in samples)
+            logpdf = backend.logpdf_joint(
+                bdb, generator_id, None, None, [(0, 4.5)], [])
+            assert [logpdf] == backend.logpdf_joint_batch(
+                bdb, generator_id, None, [None], [[(0, 4.5)]], [[]])
+
+def test_nig_normal_incorporate_rows():
+    with bayesdb_open(':memory:') as bdb:
+        backend = NIGNormalBackend()
+        bayesdb_register_backend(bdb, backend)
+        bdb.sql_execute('create table t(x, y)')
+        def insert(rows):
+            for x in rows:
+                bdb.sql_execute('insert into t(x, y) values(?, ?)',
+                    (x, None if x % 4 == 0 else x/2.))
+        insert(xrange(20))
+        bdb.execute('create population p for t(x numerical; y numerical)')
+        bdb.execute('create generator g for p using nig_normal')
+        bdb.execute('initialize 2 models for g')
+        generator_id = core.bayesdb_get_generator(bdb, None, 'g')
+        def stats(generator_id):
+            return bdb.sql_execute('''
+                select colno, count, sum, sumsq from bayesdb_nig_normal_column
+                    where generator_id = ? order by colno
+            ''', (generator_id,)).fetchall()
+        assert backend.incorporate_rows(bdb, generator_id) == []
+        insert(xrange(20, 30))
+        bdb.execute('incorporate new rows into g for 1 iteration')
+        # The statistics count the new rows as if they had been there
+        # all along, and only once.
+        bdb.execute('create generator h for p using nig_normal')
+        assert stats(generator_id) == \
+            stats(core.bayesdb_get_generator(bdb, None, 'h'))
+        bdb.execute('incorporate new rows into g')
+        assert stats(generator_id) == \
+            stats(core.bayesdb_get_generator(bdb, None, 'h'))
+        bdb.execute('estimate probability density of x = 25 from p'
+            ' modeled by g').fetchall()
+        # A new value that is not a number is refused, and nothing of
+        # its row is incorporated.
+        before = stats(generator_id)
+        bdb.sql_execute("insert into t(x, y) values (30, 'fifteen')")
+        with pytest.raises(BQLError):
+            bdb.execute('incorporate new rows into g')
+        assert stats(generator_id) == before
+        bdb.execute('drop generator g')
+        with pytest.raises(BQLError):
+            bdb.execute('incorporate new rows into g')
@@ -916,6 +916,23 @@ def test_analyze():
             ' checkpoint 3 seconds') == \
         [ast.AnalyzeModels('t', None, 10, None, None, 3, None)]
 
+def test_incorporate_rows():
+    assert parse_bql_string('incorporate new rows into g;') == \
+        [ast.IncorporateRows('g', None, None)]
+    assert parse_bql_string('incorporate new rows into g for 3 iterations;') \
+        == [ast.IncorporateRows('g', 3, None)]
+    assert parse_bql_string('incorporate new rows into g'
+            ' for 10 iterations or 1 minute;') == \
+        [ast.IncorporateRows('g', 10, 60)]
+    assert parse_bql_string('select new, into from incorporate;') == \
+        [ast.Select(ast.SELQUANT_ALL,
+            [
+                ast.SelColExp(ast.ExpCol(None, 'new'), None),
+                ast.SelColExp(ast.ExpCol(None, 'into'), None),
+            ],
+            [ast.SelTab('incorporate', None)],
+            None, None, None, None)]
+
 def test_altergen():
     assert parse_bql_string('alter generator g '
             'rename to rumba') == \
@@ -15,13 +15,17 @@
 #   limitations under the License.
 
 import apsw
+import numpy
 import pandas
 import pytest
 
+import bayeslite.read_pandas as read_pandas
+
 from bayeslite import bayesdb_open
 from bayeslite import bql_quote_name
 from bayeslite.core import bayesdb_has_table
 from bayeslite.read_pandas import bayesdb_read_pandas_df
+from bayeslite.read_pandas import bayesdb_to_pandas_df
 
 def do_test(bdb, t, df, index=None):
     qt = bql_quote_name(t)
@@ -69,3 +73,32 @@ def test_nonintegral_index():
         df = pandas.DataFrame([(1,2,'foo'),(4,5,6),(7,8,9),(10,11,12)],
             index=[42, 78, 62, 43])
         do_test(bdb, 't', df, index='eland')
+
+def test_chunked_round_trip(monkeypatch):
+    monkeypatch.setattr(read_pandas, 'CHUNK_SIZE', 3)
+    with bayesdb_open() as bdb:
+        df = pandas.DataFrame({
+            'x': numpy.arange(10, dtype='int64'),
+            'y': [0.5*i if i % 4 else numpy.nan for i in xrange(10)],
+            'z': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j'],
+        }, columns=['x', 'y', 'z'], index=range(100, 110))
+        bayesdb_read_pandas_df(bdb, 't', df, create=True)
+        assert bdb.sql_execute('select _rowid_, x, y, z from t'
+                ' where _rowid_ in (100, 101, 109)').fetchall() == [
+            (100, 0, None, 'a'),
+            (101, 1, 0.5, 'b'),
+            (109, 9, 4.5, 'j'),
+        ]
+        df1 = bayesdb_to_pandas_df(bdb,
+            'select x, y, z, x from t where x >= ? order by x', (2,))
+        assert list(df1.columns) == ['x', 'y', 'z', 'x']
+        assert len(df1) == 8
+        assert df1.iloc[:, 0].dtype == numpy.int64
+        assert df1.iloc[:, 0].tolist() == range(2, 10)
+        assert df1.iloc[:, 3].tolist() == range(2, 10)
+        assert df1.iloc[:, 2].tolist() == list('cdefghij')
+        assert numpy.isnan(df1.iloc[2, 1])
+        assert df1.iloc[3, 1] == 2.5
+        df2 = bayesdb_to_pandas_df(bdb, 'select * from t where 0')
+        assert df2.empty
+        assert len(df2.columns) == 0
@@ -100,3 +100,37 @@ def test_schema_compatible():
                     for v in USABLE_VERSIONS:
                         bayesdb_schema_required(
                             bdb, v, 'after explicit upgrade, needs%s ok' % (v,))
+
+def test_integrity_check(monkeypatch):
+    import bayeslite.schema as schema
+    checks = []
+    run_integrity_check = schema._run_integrity_check
+    def trace_integrity_check(bdb, level):
+        checks.append(level)
+        return run_integrity_check(bdb, level)
+    monkeypatch.setattr(schema, '_run_integrity_check', trace_integrity_check)
+    def opened(check=None, pathname=None):
+        del checks[:]
+        with bayesdb_open(pathname=pathname, check=check):
+            pass
+        return checks
+    with pytest.raises(ValueError):
+        bayesdb_open(check='thorough')
+    # In-memory databases are checked every time.
+    assert opened() == ['full']
+    assert opened(check='quick') == ['quick']
+    assert opened(check='none') == []
+    with tempfile.NamedTemporaryFile(prefix='bayeslite') as f:
+        # Create the database, and install the backends' schemas.
+        assert opened(pathname=f.name, check='none') == []
+        # Checks are recorded, and not repeated until the file changes.
+        assert opened(pathname=f.name) == ['full']
+        assert opened(pathname=f.name) == []
+        assert opened(pathname=f.name, check='quick') == []
+        with bayesdb_open(pathname=f.name, check='none') as bdb:
+            test_core.t1_schema(bdb)
+        assert opened(pathname=f.name, check='quick') == ['quick']
+        assert opened(pathname=f.name, check='quick') == []
+        assert opened(pathname=f.name, check='full') == ['full']
+        assert opened(pathname=f.name, check='quick') == []
+        assert opened(pathname=f.name, check='none') == []
@@ -14,6 +14,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import itertools
 import os
 
 import pytest
@@ -23,6 +24,8 @@ import bayeslite.read_csv as read_csv
 
 from bayeslite.guess import bayesdb_guess_population
 
+from test_bql import RecordingBackend
+
 
 root = os.path.dirname(os.path.abspath(__file__))
 dha_csv = os.path.join(root, 'dha.csv')
@@ -251,3 +254,39 @@ def test_simulate_given_rowid_unincorporated():
             GIVEN rowid = 12, y = 1
             LIMIT 10
         ''').fetchall()
+
+
+def test_simulate_streaming(monkeypatch):
+    import bayeslite.bqlvtab as bqlvtab
+    monkeypatch.setattr(bqlvtab, 'SIMULATE_CHUNK_SIZE', 3)
+    with bayeslite.bayesdb_open() as bdb:
+        backend = RecordingBackend()
+        def calls():
+            return backend.recorded('simulate_joint')
+        bayeslite.bayesdb_register_backend(bdb, backend)
+        bdb.sql_execute('CREATE TABLE t(x, y)')
+        for x in xrange(10):
+            bdb.sql_execute('INSERT INTO t (x, y) VALUES (?, ?)', (x, -x))
+        bdb.execute('CREATE POPULATION p FOR t (x NUMERICAL; y NUMERICAL)')
+        bdb.execute('CREATE GENERATOR g FOR p USING nig_normal')
+        bdb.execute('INITIALIZE 1 MODEL FOR g')
+        # Rows are simulated a chunk at a time, as they are read.
+        cursor = bdb.execute('SIMULATE x, y FROM p LIMIT 10')
+        assert [d[0] for d in cursor.description] == ['x', 'y']
+        assert calls() == [3]
+        assert len(list(itertools.islice(cursor, 4))) == 4
+        assert calls() == [3, 3]
+        assert len(cursor.fetchall()) == 6
+        assert calls() == [3, 3, 3, 1]
+        del cursor
+        del backend.calls[:]
+        assert bdb.execute('SIMULATE x FROM p LIMIT 0').fetchall() == []
+        assert calls() == []
+        bdb.execute('CREATE TABLE s AS SIMULATE y FROM p GIVEN x = 1 LIMIT 7')
+        assert calls() == [3, 3, 1]
+        assert bdb.execute('SELECT COUNT(*) FROM s').fetchvalue() == 7
+        # The virtual table is gone once the query is done.
+        assert bdb.sql_execute('''
+            SELECT COUNT(*) FROM sqlite_temp_master
+                WHERE name LIKE 'bayesdb_temp_%'
+        ''').fetchvalue() == 0